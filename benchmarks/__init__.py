@@ -0,0 +1,6 @@
+"""
+Benchmarks for pymag. ``python -m benchmarks`` runs the offline suite in
+``benchmarks.hot_paths`` and can compare it with a stored baseline. Each
+module can also be run on its own with ``python -m benchmarks.<module>``.
+Only ``native_expressions`` needs a mongod.
+"""
@@ -0,0 +1,91 @@
+"""
+Run the pymag benchmark suite and compare it with a baseline.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json --threshold 0.3
+
+The exit status is 1 when a metric is worse than the baseline by more
+than the threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+
+from benchmarks.hot_paths import BENCHMARKS
+
+
+def run(names, scale):
+    metrics = []
+    for name in names:
+        metrics.extend(BENCHMARKS[name](scale))
+    return metrics
+
+
+def to_json(metrics):
+    return {"created": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "metrics": {m.name: {"value": m.value, "unit": m.unit, "higher_is_better": m.higher_is_better}
+                        for m in metrics}}
+
+
+def compare(metrics, baseline, threshold):
+    """
+    Compare metrics with a baseline produced by ``to_json``.
+
+    :return: list of (metric, baseline value, change) for every metric in
+             both, and the list of those that regressed past ``threshold``
+    """
+    rows = []
+    regressions = []
+    for m in metrics:
+        base = baseline["metrics"].get(m.name)
+        if base is None or not base["value"]:
+            continue
+        change = (m.value - base["value"]) / base["value"]
+        worse = -change if m.higher_is_better else change
+        rows.append((m, base["value"], change))
+        if worse > threshold:
+            regressions.append((m, base["value"], change))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        help="benchmarks to run [default: all]")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the work done by each benchmark [default: %(default)s]")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.3,
+                        help="fraction a metric may get worse before failing [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    metrics = run(args.only, args.scale)
+    for m in metrics:
+        print(f"{m.name:40} {m.value:16,.1f} {m.unit}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(to_json(metrics), output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            rows, regressions = compare(metrics, json.load(baseline), args.threshold)
+        print()
+        print(f"{'metric':40} {'baseline':>16} {'change':>8}")
+        for m, base, change in rows:
+            print(f"{m.name:40} {base:16,.1f} {change:+8.1%}")
+        if regressions:
+            print()
+            for m, base, change in regressions:
+                print(f"REGRESSION {m.name}: {m.value:,.1f} {m.unit} against {base:,.1f} ({change:+.1%})")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Peak RSS of CursorFormatter as the number of documents written grows.
+
+Each run happens in a fresh process so the peak of one run does not hide
+the next. With keep="none" the peak should stay flat as the output size
+grows, with keep="all" it grows with the number of documents.
+
+    python -m benchmarks.cursor_memory
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+
+from pymag.cursor import CursorFormatter, LastResults
+
+
+def synthetic_docs(n):
+    for i in range(n):
+        yield {"_id": i,
+               "member": {"name": f"member {i}", "id": i, "city": "Dublin"},
+               "event": {"name": f"event {i % 100}", "rsvp": "yes"},
+               "payload": "x" * 200}
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _run(n, keep, fmt, queue):
+    if keep == "last":
+        keep = LastResults(1000)
+    formatter = CursorFormatter(synthetic_docs(n), filename=os.devnull, formatter=fmt, keep=keep)
+    formatter.output(fieldNames=["_id", "member.name", "event.name", "payload"])
+    queue.put(peak_rss_kb())
+
+
+def measure(n, keep, fmt="csv"):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run, args=(n, keep, fmt, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"benchmark run for {n} documents with keep={keep} failed")
+    return queue.get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000],
+                        help="numbers of documents to write [default: %(default)s]")
+    parser.add_argument("--format", default="csv", choices=["csv", "json"],
+                        help="output format [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    print(f"{'docs':>10} {'keep':>6} {'peak RSS (KB)':>14}")
+    for keep in ["none", "last", "all"]:
+        for n in args.sizes:
+            print(f"{n:>10} {keep:>6} {measure(n, keep, args.format):>14}")
+
+
+if __name__ == "__main__":
+    main()
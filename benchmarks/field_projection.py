@@ -0,0 +1,71 @@
+"""
+Compare the NestedDict based field mapper CursorFormatter used to have
+with the precompiled FieldProjection on wide documents.
+
+    python -m benchmarks.field_projection
+"""
+import argparse
+import timeit
+
+from nesteddict import NestedDict
+
+from pymag.cursor import FieldProjection
+
+
+def wide_doc(width):
+    doc = {"_id": 1}
+    for i in range(width):
+        doc[f"f{i}"] = i
+        doc[f"n{i}"] = {"a": i, "b": {"c": str(i)}}
+    return doc
+
+
+def nesteddict_mapper(doc, fields):
+    """
+    The fieldMapper implementation before FieldProjection.
+    """
+    new_doc = NestedDict()
+    old_doc = NestedDict(doc)
+    for i in fields:
+        if i in old_doc:
+            new_doc[i] = old_doc[i]
+    return dict(new_doc)
+
+
+def fields_for(width):
+    return [f"f{i}" for i in range(0, width, 2)] + \
+           [f"n{i}.b.c" for i in range(0, width, 2)] + ["missing.field"]
+
+
+def measure(width, docs):
+    """
+    Return the docs/s of the NestedDict mapper and of FieldProjection.
+    """
+    doc = wide_doc(width)
+    fields = fields_for(width)
+    projection = FieldProjection(fields)
+    assert projection(doc) == nesteddict_mapper(doc, fields)
+
+    old = min(timeit.repeat(lambda: nesteddict_mapper(doc, fields), number=docs, repeat=3))
+    new = min(timeit.repeat(lambda: projection(doc), number=docs, repeat=3))
+    return docs / old, docs / new
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=50,
+                        help="number of top level and nested field pairs [default: %(default)s]")
+    parser.add_argument("--docs", type=int, default=2000,
+                        help="documents per timing run [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    old, new = measure(args.width, args.docs)
+    print(f"{len(fields_for(args.width))} fields from a {len(wide_doc(args.width))} field document, "
+          f"{args.docs} documents")
+    print(f"NestedDict fieldMapper : {old:12,.0f} docs/s")
+    print(f"FieldProjection        : {new:12,.0f} docs/s")
+    print(f"speedup                : {new / old:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
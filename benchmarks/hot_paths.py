@@ -0,0 +1,146 @@
+"""
+Micro benchmarks for the code every pipeline goes through: building
+stages, serializing pipelines, formatting cursors and building JSCode.
+All of them run on synthetic data.
+
+Each benchmark function takes a ``scale`` factor for the amount of work
+and returns a list of ``Metric``.
+"""
+import os
+import shutil
+import statistics
+import tempfile
+import timeit
+from collections import namedtuple
+from unittest import mock
+
+import pymongo
+
+from benchmarks import cursor_memory, field_projection, stage_memory
+from pymag.aggregation import Aggregation
+from pymag.cursor import CursorFormatter
+from pymag.jscode import JSCode
+from pymag.pipeline import Pipeline, PipelineTemplate
+from pymag.stages import match, group, sort, project, limit, addFields, unwind, param
+
+Metric = namedtuple("Metric", ["name", "value", "unit", "higher_is_better"])
+
+FIELDS = ["_id", "member.name", "member.city", "event.name", "event.rsvp", "payload"]
+
+
+def rate(func, number, repeat=7):
+    """
+    Calls per second of ``func``, the median of ``repeat`` runs of
+    ``number`` calls. The median moves less between runs than the best
+    run, which depends on a single lucky timing.
+    """
+    return number / statistics.median(timeit.repeat(func, number=number, repeat=repeat))
+
+
+def build_stages():
+    return [match({"event.rsvp": "yes", "member.city": {"$in": ["Dublin", "London"]}}),
+            unwind({"path": "$topics"}),
+            addFields({"year": {"$year": "$event.time"}}),
+            group({"_id": {"member": "$member.id", "year": "$year"}, "events": {"$sum": 1}}),
+            sort(("events", pymongo.DESCENDING), "_id"),
+            project({"_id": 0, "member": "$_id.member", "events": 1}),
+            limit(100)]
+
+
+def stages(scale):
+    return [Metric("stages.build", rate(build_stages, 2000 * scale), "pipelines/s", True)]
+
+
+def stage_size(scale):
+    n = 20000 * scale
+    return [Metric("stages.match_bytes", stage_memory.bytes_per_stage("match", n), "bytes", False),
+            Metric("stages.match_eager", stage_memory.stages_per_second("match", False, n), "stages/s", True),
+            Metric("stages.match_lazy", stage_memory.stages_per_second("match", True, n), "stages/s", True)]
+
+
+def pipeline(scale):
+    p = Pipeline(build_stages())
+    return [Metric("pipeline.call", rate(p, 5000 * scale), "calls/s", True),
+            Metric("pipeline.str", rate(lambda: str(p), 5000 * scale), "calls/s", True)]
+
+
+def tenant_stages(tenant, start, end):
+    return [match({"tenant": tenant, "event.time": {"$gte": start, "$lt": end}}),
+            *build_stages()]
+
+
+def template(scale):
+    t = PipelineTemplate(Pipeline(tenant_stages(param("tenant"), param("start"), param("end"))))
+    return [Metric("template.build_frozen", rate(lambda: Pipeline(tenant_stages("t1", 1, 2)).freeze(), 2000 * scale),
+                   "pipelines/s", True),
+            Metric("template.bind_frozen", rate(lambda: t.bind_frozen(tenant="t1", start=1, end=2), 2000 * scale),
+                   "pipelines/s", True)]
+
+
+def aggregation(scale):
+    a = Aggregation(*build_stages())
+    return [Metric("aggregation.aggregation_string", rate(lambda: a.aggregation_string, 2000 * scale),
+                   "calls/s", True)]
+
+
+def cursor_formatter(scale):
+    docs = list(cursor_memory.synthetic_docs(5000 * scale))
+    metrics = []
+    for fmt in ("csv", "json", "ndjson"):
+        def run():
+            CursorFormatter(iter(docs), filename=os.devnull, formatter=fmt, keep="none").output(
+                fieldNames=FIELDS)
+        metrics.append(Metric(f"cursor_formatter.{fmt}", rate(run, 1) * len(docs), "docs/s", True))
+    return metrics
+
+
+def projection(scale):
+    _, new = field_projection.measure(50, 2000 * scale)
+    return [Metric("field_projection.wide", new, "docs/s", True)]
+
+
+def cursor_peak_rss(scale):
+    return [Metric("cursor_formatter.peak_rss", cursor_memory.measure(20000 * scale, "none"), "KB", False)]
+
+
+def jscode_target(x, y):
+    return x + y
+
+
+def jscode(scale):
+    """
+    JSCode construction from the in-process memo and from the cache
+    directory. The cache is seeded directly so transcrypt is not needed.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        with mock.patch.dict(os.environ, {JSCode.CACHE_ENV: directory}):
+            seed = JSCode.__new__(JSCode)
+            seed._setup(jscode_target, ())
+            os.makedirs(directory, exist_ok=True)
+            JSCode.write_cache(seed.cache_path, ["function (x, y) {", "\treturn x + y;", "};"])
+
+            def disk_hit():
+                JSCode.clear_memo()
+                JSCode(jscode_target, "a", "b")
+
+            disk = rate(disk_hit, 500 * scale)
+            memo = rate(lambda: JSCode(jscode_target, "a", "b"), 500 * scale)
+            JSCode.clear_memo()
+    finally:
+        shutil.rmtree(directory)
+    return [Metric("jscode.memo_hit", memo, "objects/s", True),
+            Metric("jscode.disk_hit", disk, "objects/s", True)]
+
+
+BENCHMARKS = {
+    "stages": stages,
+    "stage_size": stage_size,
+    "pipeline": pipeline,
+    "template": template,
+    "aggregation": aggregation,
+    "cursor_formatter": cursor_formatter,
+    "field_projection": projection,
+    "cursor_memory": cursor_peak_rss,
+    "jscode": jscode,
+}
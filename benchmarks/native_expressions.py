@@ -0,0 +1,79 @@
+"""
+Compare a Python helper run as a $function with the native expression
+``pymag.translator.translate`` builds from it, on the same documents.
+
+Needs a MongoDB server (4.4 or later) and transcrypt for the $function
+form. The documents are written to a scratch collection which is
+dropped afterwards.
+
+    python -m benchmarks.native_expressions --uri mongodb://localhost:27017
+"""
+import argparse
+import random
+import time
+
+import pymongo
+
+from pymag import Pipeline, addFields, count, group, match
+from pymag.jscode import JSCode
+from pymag.operators import function
+from pymag.translator import translate
+
+
+def price_band(price, rate):
+    total = price + price * rate / 100
+    if total > 500:
+        return "high " + str(round(total))
+    return "low"
+
+
+def timed(collection, pipeline, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(pipeline.aggregate(collection))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--uri", default="mongodb://localhost:27017",
+                        help="MongoDB connection string [default: %(default)s]")
+    parser.add_argument("--database", default="pymag_benchmarks",
+                        help="database for the scratch collection [default: %(default)s]")
+    parser.add_argument("--docs", type=int, default=100000,
+                        help="documents in the scratch collection [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timing runs per form, the best is reported [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    collection = pymongo.MongoClient(args.uri)[args.database]["native_expressions"]
+    collection.drop()
+    rng = random.Random(42)
+    for start in range(0, args.docs, 10000):
+        collection.insert_many([{"price": rng.uniform(1, 1000), "rate": rng.choice([0, 5, 10, 20])}
+                                for _ in range(start, min(start + 10000, args.docs))], ordered=False)
+
+    try:
+        native = translate(price_band, "price", "rate")
+        javascript = function(JSCode(price_band, "price", "rate"))()
+
+        differ = list(Pipeline([match({"$expr": {"$ne": [native, javascript]}}), count("docs")])
+                      .aggregate(collection))
+
+        by_band = group({"_id": "$band", "docs": {"$sum": 1}})
+        native_time = timed(collection, Pipeline([addFields({"band": native}), by_band]), args.repeat)
+        js_time = timed(collection, Pipeline([addFields({"band": javascript}), by_band]), args.repeat)
+    finally:
+        collection.drop()
+
+    print(f"{args.docs} documents, {differ[0]['docs'] if differ else 0} with different results")
+    print(f"$function         : {args.docs / js_time:12,.0f} docs/s")
+    print(f"native expression : {args.docs / native_time:12,.0f} docs/s")
+    print(f"speedup           : {js_time / native_time:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
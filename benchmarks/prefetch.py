@@ -0,0 +1,69 @@
+"""
+Time to consume a cursor with a simulated getMore latency, read on the
+calling thread and through a PrefetchIterator.
+
+Every ``batch_size`` documents the fake cursor sleeps for ``latency``
+seconds as a getMore round trip would, and the consumer spends ``work``
+seconds on each document. With prefetching the total should approach
+the larger of the two instead of their sum.
+
+    python -m benchmarks.prefetch
+"""
+import argparse
+import time
+
+from pymag.aggregation import PrefetchIterator
+
+
+class SlowCursor:
+
+    def __init__(self, n, batch_size, latency):
+        self._n = n
+        self._batch_size = batch_size
+        self._latency = latency
+        self._i = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._i == self._n:
+            raise StopIteration
+        if self._i % self._batch_size == 0:
+            time.sleep(self._latency)
+        self._i = self._i + 1
+        return {"_id": self._i}
+
+    def close(self):
+        pass
+
+
+def consume(docs, work):
+    start = time.perf_counter()
+    for _ in docs:
+        deadline = time.perf_counter() + work
+        while time.perf_counter() < deadline:
+            pass
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000, help="documents [default: %(default)s]")
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per batch [default: %(default)s]")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds per getMore [default: %(default)s]")
+    parser.add_argument("--work", type=float, default=0.00004,
+                        help="seconds of work per document [default: %(default)s]")
+    parser.add_argument("--depth", type=int, default=2, help="batches fetched ahead [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    serial = consume(SlowCursor(args.docs, args.batch_size, args.latency), args.work)
+    prefetched = consume(PrefetchIterator(SlowCursor(args.docs, args.batch_size, args.latency),
+                                          batch_size=args.batch_size, depth=args.depth), args.work)
+    print(f"{'serial':>12} {serial:8.3f}s")
+    print(f"{'prefetched':>12} {prefetched:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
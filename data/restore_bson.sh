@@ -0,0 +1,11 @@
+#!/bin/sh
+# Load a .bson (or .bson.gz) file written by CursorFormatter(formatter="bson")
+# usage: sh restore_bson.sh <file> [db] [collection]
+FILE=${1:?usage: restore_bson.sh <file> [db] [collection]}
+DB=${2:-TEST_AGG}
+COLLECTION=${3:-test_groups}
+case "$FILE" in
+    *.gz) GZIP=--gzip ;;
+    *) GZIP= ;;
+esac
+mongorestore $GZIP --db="$DB" --collection="$COLLECTION" --drop "$FILE"
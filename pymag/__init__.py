@@ -1,4 +1,5 @@
 from .stages import *
 from .pipeline import *
+from .executor import *
 from .jscode import *
 from .operators import *
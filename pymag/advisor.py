@@ -0,0 +1,174 @@
+"""
+Propose indexes for pipelines.
+
+Only the leading $match and $sort stages of a pipeline can use an index,
+so those are read to build one compound index per pipeline following
+the equality, sort, range rule: fields compared for equality first, then
+the sort keys in sort order, then fields filtered by range. A $lookup
+with localField/foreignField proposes an index on the foreign field of
+the joined collection.
+
+    advisor = IndexAdvisor(db)
+    proposals = advisor.recommend([("events", p1), ("events", p2)])
+    advisor.create(proposals)
+
+Proposals for many pipelines are combined so that an index which is a
+prefix of another proposal, or of an existing index, is not created.
+"""
+from collections import namedtuple
+
+import pymongo
+
+IndexProposal = namedtuple("IndexProposal", ["collection", "keys", "reason"])
+
+EQUALITY = ("$eq",)
+RANGE = ("$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$exists", "$regex", "$type", "$elemMatch")
+
+
+def _classify(query, equality, in_list, ranges):
+    for field, condition in query.items():
+        if field == "$and":
+            for clause in condition:
+                _classify(clause, equality, in_list, ranges)
+            continue
+        if field.startswith("$"):
+            # $or, $expr, $text etc. need their own plans
+            continue
+        if not isinstance(condition, dict) or not condition or not next(iter(condition)).startswith("$"):
+            equality.append(field)
+        elif all(op in EQUALITY for op in condition):
+            equality.append(field)
+        elif "$in" in condition and len(condition) == 1:
+            in_list.append(field)
+        elif any(op in RANGE or op == "$in" for op in condition):
+            ranges.append(field)
+
+
+def _append(keys, field, direction):
+    if field not in (k for k, _ in keys):
+        keys.append((field, direction))
+
+
+def propose(pipeline, collection):
+    """
+    The indexes that would serve ``pipeline`` run on the collection
+    named ``collection``.
+
+    :return: list of IndexProposal
+    """
+    equality, in_list, ranges, sort_keys = [], [], [], []
+    proposals = []
+    leading = True
+    for stage in pipeline:
+        if leading and stage.op_name == "$match":
+            _classify(stage.arg, equality, in_list, ranges)
+        elif leading and stage.op_name == "$sort" and not sort_keys:
+            sort_keys = list(stage.arg.items())
+        else:
+            leading = False
+        if stage.op_name == "$lookup" and "foreignField" in stage.arg and "from" in stage.arg:
+            foreign = stage.arg["foreignField"]
+            if foreign != "_id":
+                proposals.append(IndexProposal(stage.arg["from"], [(foreign, pymongo.ASCENDING)],
+                                               f"$lookup from {collection} on {foreign}"))
+
+    # with a sort, $in behaves as a range (the index returns one sorted
+    # run per value) so only plain equality goes before the sort keys
+    if sort_keys:
+        ranges = in_list + ranges
+    else:
+        equality = equality + in_list
+    keys = []
+    for field in equality:
+        _append(keys, field, pymongo.ASCENDING)
+    for field, direction in sort_keys:
+        _append(keys, field, direction)
+    for field in ranges:
+        _append(keys, field, pymongo.ASCENDING)
+
+    if keys and keys != [("_id", pymongo.ASCENDING)]:
+        parts = [f"equality {', '.join(equality)}" if equality else "",
+                 f"sort {', '.join(f for f, _ in sort_keys)}" if sort_keys else "",
+                 f"range {', '.join(ranges)}" if ranges else ""]
+        proposals.insert(0, IndexProposal(collection, keys, "; ".join(p for p in parts if p)))
+    return proposals
+
+
+def _reversed(keys):
+    return [(f, -d) for f, d in keys]
+
+
+def is_prefix(keys, of):
+    """
+    True if an index on ``of`` can serve every query an index on
+    ``keys`` serves, i.e. ``keys`` is a prefix of ``of`` with the same
+    directions or with every direction reversed.
+    """
+    keys = list(keys)
+    head = list(of)[:len(keys)]
+    return len(keys) <= len(of) and (head == keys or head == _reversed(keys))
+
+
+def covered(proposal, index_information):
+    """
+    True if one of the indexes described by ``index_information`` (the
+    result of ``collection.index_information()``) starts with the
+    proposed keys.
+    """
+    return any(is_prefix(proposal.keys, [(f, d) for f, d in info["key"]])
+               for info in index_information.values())
+
+
+def combine(proposals):
+    """
+    Merge proposals for many pipelines, dropping duplicates and any
+    proposal that is a prefix of another on the same collection.
+    """
+    result = []
+    for proposal in sorted(proposals, key=lambda p: -len(p.keys)):
+        redundant = any(p.collection == proposal.collection and is_prefix(proposal.keys, p.keys)
+                        for p in result)
+        if not redundant:
+            result.append(proposal)
+    return result
+
+
+def index_name(keys):
+    return "_".join(f"{f}_{d}" for f, d in keys)
+
+
+class IndexAdvisor:
+    """
+    Recommend and create indexes for pipelines run against ``database``.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def recommend(self, jobs):
+        """
+        :param jobs: iterable of (collection, pipeline) pairs where
+                     collection is a Collection or a collection name
+        :return: combined proposals not served by an existing index
+        """
+        proposals = []
+        for collection, pipeline in jobs:
+            name = collection if isinstance(collection, str) else collection.name
+            proposals.extend(propose(pipeline, name))
+
+        indexes = {}
+        missing = []
+        for proposal in combine(proposals):
+            if proposal.collection not in indexes:
+                indexes[proposal.collection] = self._database[proposal.collection].index_information()
+            if not covered(proposal, indexes[proposal.collection]):
+                missing.append(proposal)
+        return missing
+
+    def create(self, proposals, **kwargs):
+        """
+        Create an index for each proposal, passing ``kwargs`` to
+        ``create_index``, and return the index names.
+        """
+        return [self._database[p.collection].create_index(p.keys, name=index_name(p.keys), **kwargs)
+                for p in proposals]
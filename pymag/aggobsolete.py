@@ -261,6 +261,8 @@ class AggObsolete(object):
     def create_view(self, database, view_name, collation=None):
         '''
         Create a view using the existing pipeline constructed within the class
+        The view is computed on every read, see pymag.views.MaterializedView
+        for a view that is stored and refreshed incrementally
         '''
 
         if collation is None:
@@ -1,5 +1,8 @@
 import pprint
+import queue
+import threading
 
+from pymag.optimizer import optimize
 from pymag.stages import AggStage
 from pymag.typedlist import TypedList
 
@@ -16,6 +19,14 @@ class Aggregation(TypedList):
     def aggregation_string(self):
         return "[" + ", ".join([str(x) for x in self]) + "]"
 
+    def optimize(self):
+        """
+        Return an optimized copy of the aggregation and an OptimizerReport
+        listing the rewrites that were made.
+        """
+        stages, report = optimize(self)
+        return Aggregation(*stages), report
+
 def project_doc(doc, *args):
     if args:
         if args[0] in doc:
@@ -26,11 +37,135 @@ def project_doc(doc, *args):
         return doc
 
 
+_END = object()
+
+
+class PrefetchIterator(object):
+    """
+    Iterate over ``cursor`` while a background thread fetches the next
+    batches. The thread reads ``batch_size`` documents at a time into a
+    queue holding at most ``depth`` batches, so the server round trip
+    for the next batch overlaps with the work done on the current one.
+
+        with PrefetchIterator(cursor, batch_size=500, depth=2) as docs:
+            for doc in docs:
+                transform(doc)
+
+    Leaving the loop early, or calling ``close``, stops the thread and
+    closes the cursor. Errors raised by the cursor are raised again in
+    the consuming thread.
+    """
+
+    def __init__(self, cursor, batch_size=100, depth=2):
+        if type(batch_size) is not int or batch_size < 1:
+            raise ValueError(f"batch_size {batch_size} must be a positive int")
+        if type(depth) is not int or depth < 1:
+            raise ValueError(f"depth {depth} must be a positive int")
+        if hasattr(cursor, "batch_size"):
+            cursor.batch_size(batch_size)
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+        self._thread.start()
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self):
+        try:
+            cursor = iter(self._cursor)
+            while not self._stop.is_set():
+                batch = []
+                for doc in cursor:
+                    batch.append(doc)
+                    if len(batch) == self._batch_size:
+                        break
+                if batch and not self._put(batch):
+                    return
+                if len(batch) < self._batch_size:
+                    break
+            self._put(_END)
+        except Exception as e:
+            self._put(e)
+
+    def batches(self):
+        """
+        Yield the prefetched batches as lists of documents.
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self):
+        """
+        Stop the fetching thread and close the cursor.
+        """
+        self._stop.set()
+        self._thread.join()
+        if hasattr(self._cursor, "close"):
+            self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class CursorIterator(object):
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, monitor=None, prefetch=None, batch_size=100):
+        """
+        :param monitor: optional ``PipelineMonitor`` that recorded the
+                        aggregate which opened ``cursor``. The cursor is
+                        closed after ``print`` so the run is complete in
+                        the monitor's stats.
+        :param prefetch: optional number of batches of ``batch_size``
+                         documents to fetch ahead on a background thread
+                         while ``print`` formats the current batch
+        """
+        if prefetch is not None:
+            cursor = PrefetchIterator(cursor, batch_size=batch_size, depth=prefetch)
         self._cursor = cursor
         self._limit =1
+        self._monitor = monitor
+        self._fingerprint = monitor.last_fingerprint() if monitor is not None else None
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint
+
+    @property
+    def record(self):
+        """
+        The monitor's PipelineRecord for the pipeline behind this cursor.
+        """
+        if self._monitor is None or self._fingerprint is None:
+            return None
+        return self._monitor.stats.get(self._fingerprint)
 
     @property
     def limit(self):
@@ -45,10 +180,13 @@ class CursorIterator(object):
             for i in self._cursor:
                 pprint.pprint(project_doc(i, *args))
         else:
+            docs = iter(self._cursor)
             try:
                 for _ in range(self._limit):
-                    item = self._cursor.next()
+                    item = next(docs)
                     pprint.pprint(project_doc(item, *args))
             except StopIteration:
                 pass
+        if (self._monitor is not None or isinstance(self._cursor, PrefetchIterator)) and hasattr(self._cursor, "close"):
+            self._cursor.close()
 
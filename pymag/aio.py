@@ -0,0 +1,140 @@
+"""
+Run pipelines from asyncio code without blocking the event loop.
+
+Works with any async driver whose ``collection.aggregate`` returns a
+cursor (Motor) or an awaitable that resolves to one (the pymongo async
+API) as long as the cursor has an awaitable ``to_list(length)``.
+
+    async for batch in pipeline.aggregate_async(collection, batch_size=500):
+        process(batch)
+
+    results = await aggregate_many([(collection, p1), (collection, p2)],
+                                   concurrency=4)
+"""
+import asyncio
+import inspect
+import pprint
+
+from pymag.aggregation import project_doc
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncBatchIterator:
+    """
+    Async iterator over the batches of an aggregation. Each batch is a
+    list of at most ``batch_size`` documents. The cursor is opened on
+    the first iteration and closed when it is exhausted or when
+    ``aclose`` is called.
+    """
+
+    def __init__(self, collection, pipeline, batch_size=100, **kwargs):
+        if type(batch_size) is not int or batch_size < 1:
+            raise ValueError(f"batch_size {batch_size} must be a positive int")
+        self._collection = collection
+        self._pipeline = pipeline
+        self._batch_size = batch_size
+        self._kwargs = kwargs
+        self._cursor = None
+        self._exhausted = False
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._exhausted:
+            raise StopAsyncIteration
+        if self._cursor is None:
+            self._cursor = await _maybe_await(
+                self._collection.aggregate(self._pipeline, batchSize=self._batch_size, **self._kwargs))
+        batch = await self._cursor.to_list(self._batch_size)
+        if not batch:
+            await self.aclose()
+            raise StopAsyncIteration
+        return batch
+
+    async def documents(self):
+        """
+        Yield the documents of every batch one at a time.
+        """
+        async for batch in self:
+            for doc in batch:
+                yield doc
+
+    async def to_list(self):
+        return [doc async for doc in self.documents()]
+
+    async def aclose(self):
+        self._exhausted = True
+        if self._cursor is not None:
+            cursor, self._cursor = self._cursor, None
+            await _maybe_await(cursor.close())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+class AsyncCursorIterator:
+    """
+    asyncio counterpart of ``CursorIterator``.
+    """
+
+    def __init__(self, batches):
+        self._batches = batches
+        self._limit = 1
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._limit = limit
+
+    async def print(self, *args):
+        count = 0
+        async for doc in self._batches.documents():
+            if self._limit and count >= self._limit:
+                break
+            pprint.pprint(project_doc(doc, *args))
+            count = count + 1
+        await self._batches.aclose()
+
+
+async def aggregate_many(jobs, concurrency=8, batch_size=100):
+    """
+    Run many pipelines at once with at most ``concurrency`` of them in
+    flight.
+
+    :param jobs: iterable of (collection, pipeline) pairs, where pipeline
+                 is a Pipeline or a list of stage dicts
+    :param concurrency: maximum number of pipelines running at a time
+    :param batch_size: batch size used for each cursor
+    :return: list of result lists in the same order as ``jobs``
+    """
+    if type(concurrency) is not int or concurrency < 1:
+        raise ValueError(f"concurrency {concurrency} must be a positive int")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(collection, pipeline):
+        async with semaphore:
+            if hasattr(pipeline, "aggregate_async"):
+                batches = pipeline.aggregate_async(collection, batch_size=batch_size)
+            else:
+                batches = AsyncBatchIterator(collection, pipeline, batch_size=batch_size)
+            async with batches:
+                return await batches.to_list()
+
+    return await asyncio.gather(*[run(c, p) for c, p in jobs])
@@ -0,0 +1,264 @@
+"""
+Cache the results of pipelines that are run again and again over slowly
+changing collections.
+
+Results are keyed on the database name, the collection name and a
+normalized fingerprint of the pipeline. Two backends are provided, an
+in-memory LRU capped by number of entries and an on-disk store capped by
+total bytes. Every entry has a time to live, set per cache and
+overridable per pipeline. Pipelines ending in $out or $merge write to
+the database and are never cached.
+
+    cache = PipelineCache(MemoryCache(max_entries=256), ttl=300)
+    docs = cache.aggregate(pipeline, collection)
+    docs = pipeline.aggregate_cached(collection, cache, ttl=60)
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+
+WRITE_STAGES = ("$out", "$merge")
+
+
+def _normalize_query(query):
+    return {field: _normalize_condition(field, query[field]) for field in sorted(query)}
+
+
+def _normalize_condition(field, value):
+    if field in ("$and", "$or", "$nor") and isinstance(value, list):
+        return [_normalize_query(q) if isinstance(q, dict) else q for q in value]
+    if isinstance(value, dict) and value and all(k.startswith("$") for k in value):
+        return {op: _normalize_operator(op, value[op]) for op in sorted(value)}
+    # a literal value, key order inside an embedded document matters
+    return value
+
+
+def _normalize_operator(op_name, arg):
+    if op_name == "$elemMatch" and isinstance(arg, dict):
+        return _normalize_query(arg)
+    if op_name == "$not" and isinstance(arg, dict):
+        return _normalize_condition(op_name, arg)
+    return arg
+
+
+def fingerprint(pipeline, codec_options=DEFAULT_CODEC_OPTIONS):
+    """
+    A sha256 hex digest identifying a pipeline. The order of the fields
+    of a $match filter, and of the operators applied to a field, does not
+    change the query so those keys are sorted. Embedded documents
+    compared by value are left as they are, since MongoDB compares them
+    field by field in order. Every other stage is hashed as encoded,
+    since key order matters for $sort, $project and $group.
+    """
+    digest = hashlib.sha256()
+    for stage in pipeline:
+        if stage.op_name == "$match":
+            digest.update(bson.encode({"$match": _normalize_query(stage.arg)}, codec_options=codec_options))
+        else:
+            digest.update(bson.encode(stage(), codec_options=codec_options))
+    return digest.hexdigest()
+
+
+def cache_key(collection, pipeline):
+    name = f"{collection.database.name}.{collection.name}"
+    digest = fingerprint(pipeline, collection.codec_options)
+    return hashlib.sha256(f"{name}\0{digest}".encode("utf-8")).hexdigest()
+
+
+def is_cacheable(pipeline):
+    return not any(stage.op_name in WRITE_STAGES for stage in pipeline)
+
+
+def _encode(docs, codec_options):
+    return b"".join(bson.encode(doc, codec_options=codec_options) for doc in docs)
+
+
+class MemoryCache:
+    """
+    In-memory LRU backend holding at most ``max_entries`` results.
+    Results are held encoded and decoded on every hit, so callers never
+    share documents with the cache or with each other.
+    """
+
+    def __init__(self, max_entries=128):
+        if type(max_entries) is not int or max_entries < 1:
+            raise ValueError(f"max_entries {max_entries} must be a positive int")
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, codec_options=DEFAULT_CODEC_OPTIONS):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return bson.decode_all(data, codec_options)
+
+    def set(self, key, docs, ttl, codec_options=DEFAULT_CODEC_OPTIONS):
+        data = _encode(docs, codec_options)
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    On-disk backend storing each result as a file of concatenated BSON
+    documents, the first of which holds the expiry time. When the files
+    take more than ``max_bytes`` the least recently used are removed.
+    The directory can be shared between processes.
+    """
+
+    SUFFIX = ".bson"
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        if type(max_bytes) is not int or max_bytes < 1:
+            raise ValueError(f"max_bytes {max_bytes} must be a positive int")
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self.SUFFIX)
+
+    def get(self, key, codec_options=DEFAULT_CODEC_OPTIONS):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        size = int.from_bytes(data[:4], "little") if len(data) >= 4 else 0
+        if not size or bson.decode(data[:size]).get("expires", 0) <= time.time():
+            self.delete(key)
+            return None
+        os.utime(path)
+        return bson.decode_all(data[size:], codec_options)
+
+    def set(self, key, docs, ttl, codec_options=DEFAULT_CODEC_OPTIONS):
+        header = bson.encode({"expires": time.time() + ttl})
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(_encode(docs, codec_options))
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for path in self._files():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _files(self):
+        return [os.path.join(self._directory, name) for name in os.listdir(self._directory)
+                if name.endswith(self.SUFFIX)]
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total = total + st.st_size
+        entries.sort()
+        while total > self._max_bytes and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total = total - size
+
+    def __len__(self):
+        return len(self._files())
+
+
+class PipelineCache:
+    """
+    Run pipelines through a cache backend.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self._backend = backend if backend is not None else MemoryCache()
+        self._ttl = ttl
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def aggregate(self, pipeline, collection, ttl=None):
+        """
+        Return the results of ``pipeline`` on ``collection`` as a list,
+        from the cache if a live entry exists. ``ttl`` overrides the
+        cache wide time to live for this pipeline.
+        """
+        if not is_cacheable(pipeline):
+            return list(pipeline.aggregate(collection))
+
+        key = cache_key(collection, pipeline)
+        docs = self._backend.get(key, collection.codec_options)
+        if docs is not None:
+            self._hits = self._hits + 1
+            return docs
+
+        self._misses = self._misses + 1
+        docs = list(pipeline.aggregate(collection))
+        ttl = self._ttl if ttl is None else ttl
+        if ttl > 0:
+            self._backend.set(key, docs, ttl, collection.codec_options)
+        return docs
+
+    def invalidate(self, pipeline, collection):
+        self._backend.delete(cache_key(collection, pipeline))
+
+    def clear(self):
+        self._backend.clear()
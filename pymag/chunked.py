@@ -0,0 +1,135 @@
+"""
+Run a reshaping pipeline over a large collection in resumable chunks.
+
+The source is split into ``_id`` ranges with $bucketAuto. Each range
+runs as its own pipeline ending in a $merge on ``_id``, so documents
+that were already written by an interrupted run are simply replaced.
+Finished chunks are recorded in a checkpoint collection together with
+the chunk boundaries, and a restarted run only processes the chunks
+that are not recorded yet.
+
+    job = ChunkedMerge(taxis, [project(point_mapper)], yellow_cabs,
+                       checkpoint=db["yellow_cabs_checkpoint"], chunks=512)
+    job.run(workers=8, progress=print)
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from pymag.pipeline import Pipeline
+from pymag.stages import match, bucketAuto, merge
+
+WRITE_STAGES = ("$out", "$merge")
+
+
+class ChunkedMerge:
+    """
+    Apply ``stages`` to ``source`` chunk by chunk, merging the results
+    into ``target`` and recording progress in ``checkpoint``.
+    """
+
+    def __init__(self, source, stages, target, checkpoint, chunks=64, name=None):
+        if type(chunks) is not int or chunks < 1:
+            raise ValueError(f"chunks {chunks} must be a positive int")
+        for stage in stages:
+            if stage.op_name in WRITE_STAGES:
+                raise ValueError(f"{stage.name} cannot be used, each chunk ends with its own $merge")
+        self._source = source
+        self._stages = list(stages)
+        self._target = target
+        self._checkpoint = checkpoint
+        self._chunks = chunks
+        self._name = name or f"{source.full_name}->{target.full_name}"
+
+    @property
+    def name(self):
+        return self._name
+
+    def _plan_bounds(self):
+        buckets = Pipeline([bucketAuto({"groupBy": "$_id", "buckets": self._chunks})]).aggregate(
+            self._source, allowDiskUse=True)
+        bounds = []
+        for bucket in buckets:
+            if not bounds:
+                bounds.append(bucket["_id"]["min"])
+            bounds.append(bucket["_id"]["max"])
+        return bounds
+
+    def bounds(self):
+        """
+        The chunk boundaries. They are computed once and stored in the
+        checkpoint collection so a restarted run uses the same chunks.
+        When two runs start together and both plan, the plan stored first
+        is used by both.
+        """
+        plan = self._checkpoint.find_one({"_id": self._name})
+        if plan is None:
+            try:
+                self._checkpoint.insert_one({"_id": self._name,
+                                             "bounds": self._plan_bounds(),
+                                             "created": datetime.utcnow()})
+            except DuplicateKeyError:
+                pass
+            plan = self._checkpoint.find_one({"_id": self._name})
+        return plan["bounds"]
+
+    def done(self):
+        return {doc["chunk"] for doc in self._checkpoint.find({"run": self._name}, {"chunk": 1})}
+
+    def pipeline(self, chunk, bounds):
+        """
+        The pipeline for chunk number ``chunk``. Every range is half open
+        except the last one, which includes the largest _id.
+        """
+        last = len(bounds) - 2
+        condition = {"$gte": bounds[chunk], "$lte" if chunk == last else "$lt": bounds[chunk + 1]}
+        into = {"db": self._target.database.name, "coll": self._target.name}
+        return Pipeline([match({"_id": condition})] + self._stages +
+                        [merge({"into": into, "on": "_id",
+                                "whenMatched": "replace", "whenNotMatched": "insert"})])
+
+    def _run_chunk(self, chunk, bounds):
+        for _ in self.pipeline(chunk, bounds).aggregate(self._source, allowDiskUse=True):
+            pass
+        self._checkpoint.update_one({"_id": f"{self._name}:{chunk}"},
+                                    {"$set": {"run": self._name, "chunk": chunk,
+                                              "min": bounds[chunk], "max": bounds[chunk + 1],
+                                              "finished": datetime.utcnow()}},
+                                    upsert=True)
+        return chunk
+
+    def pending(self):
+        bounds = self.bounds()
+        done = self.done()
+        return [chunk for chunk in range(len(bounds) - 1) if chunk not in done]
+
+    def run(self, workers=4, progress=None):
+        """
+        Process every chunk not yet recorded in the checkpoint collection
+        with ``workers`` threads.
+
+        :param progress: optional callable given (chunk, finished, total)
+                         as each chunk completes
+        :return: the number of chunks processed by this call
+        """
+        bounds = self.bounds()
+        total = max(len(bounds) - 1, 0)
+        pending = self.pending()
+        finished = total - len(pending)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._run_chunk, chunk, bounds) for chunk in pending]
+            for future in as_completed(futures):
+                chunk = future.result()
+                finished = finished + 1
+                if progress:
+                    progress(chunk, finished, total)
+        return len(pending)
+
+    def reset(self):
+        """
+        Forget the plan and the finished chunks so the next run starts
+        over.
+        """
+        self._checkpoint.delete_many({"run": self._name})
+        self._checkpoint.delete_one({"_id": self._name})
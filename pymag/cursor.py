@@ -1,12 +1,132 @@
+import collections
+import collections.abc
 import contextlib
 import csv
+import gzip
 import pprint
+import re
+import struct
 import sys
 from datetime import datetime
 from nesteddict import NestedDict
 
 
 import pymongo
+from bson import json_util
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# a null written as a value, after a key or inside an array
+NULL_VALUE = re.compile(rb"[:\[,]null\b")
+
+
+class NoResults(object):
+    '''
+    Results store that keeps nothing. Use when streaming a large cursor
+    to a file so memory stays flat however many documents are written.
+    '''
+
+    def append(self, doc):
+        pass
+
+    def view(self):
+        raise ValueError("results were not kept: create the CursorFormatter with "
+                         "keep='all', FirstResults(n) or LastResults(n) to keep them")
+
+
+class FirstResults(object):
+    '''
+    Results store that keeps the first ``n`` documents.
+    '''
+
+    def __init__(self, n):
+        if type(n) is not int or n < 0:
+            raise ValueError(f"{n} must be a non-negative int")
+        self._n = n
+        self._docs = []
+
+    def append(self, doc):
+        if len(self._docs) < self._n:
+            self._docs.append(doc)
+
+    def view(self):
+        return tuple(self._docs)
+
+
+class LastResults(object):
+    '''
+    Results store that keeps the last ``n`` documents in a ring buffer.
+    '''
+
+    def __init__(self, n):
+        if type(n) is not int or n < 0:
+            raise ValueError(f"{n} must be a non-negative int")
+        self._docs = collections.deque(maxlen=n)
+
+    def append(self, doc):
+        self._docs.append(doc)
+
+    def view(self):
+        return tuple(self._docs)
+
+
+class FieldProjection(object):
+    '''
+    Pull a fixed list of fields out of documents. Dotted field names such
+    as "member.name" are split into key tuples once, when the projection
+    is created, and values are read with plain dict lookups. Fields that
+    are missing from a document are left out of the result.
+
+    With nested=True (the default) the result has the same shape as the
+    source document, {"member": {"name": ...}}. With nested=False the
+    dotted names are used as flat keys, {"member.name": ...}, which is
+    what csv.DictWriter expects.
+    '''
+
+    _MISSING = object()
+
+    def __init__(self, fieldnames, nested=True):
+        self._fieldnames = list(fieldnames)
+        self._nested = nested
+        self._paths = [(name, tuple(name.split("."))) for name in self._fieldnames]
+
+    @property
+    def fieldnames(self):
+        return list(self._fieldnames)
+
+    def _get(self, doc, path):
+        value = doc
+        for key in path:
+            try:
+                value = value[key]
+            except (KeyError, TypeError, IndexError):
+                return self._MISSING
+        return value
+
+    def __call__(self, doc):
+        new_doc = {}
+        missing = self._MISSING
+        for name, path in self._paths:
+            if len(path) == 1:
+                value = doc.get(name, missing)
+            else:
+                value = self._get(doc, path)
+            if value is missing:
+                continue
+            if not self._nested or len(path) == 1:
+                new_doc[name] = value
+            else:
+                target = new_doc
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                    if not isinstance(target, dict):
+                        break
+                else:
+                    target[path[-1]] = value
+        return new_doc
 
 
 class CursorFormatter(object):
@@ -14,40 +134,80 @@ class CursorFormatter(object):
     Output a set of cursor elements by iterating over then.
 
     If root is a file name output the content to that file.
+
+    By default every document written is also kept in memory and returned
+    by results(). For large cursors pass keep="none", FirstResults(n) or
+    LastResults(n) to bound the memory used.
     '''
 
-    def __init__(self, cursor, filename="", formatter="json", results=None):
+    NDJSON_BATCH = 1000
+    NDJSON_BUFFER = 1 << 20
+
+    def __init__(self, cursor, filename="", formatter="json", results=None, keep="all",
+                 json_options=None, fast_json=True):
         '''
         Data from cursor
         output to <filename>suffix.ext.
+
+        cursor may be a pymongo cursor or any iterable of documents, for
+        instance the output of Pipeline.aggregate_local.
+
+        formatter is "json" (pprint), "csv", "ndjson" or "bson". ndjson output uses
+        json_options (a bson.json_util.JSONOptions, relaxed Extended JSON by
+        default). With fast_json and relaxed output orjson is used when it
+        is installed. Documents orjson cannot encode, or that hold a null
+        value which may have been a NaN or infinite double, are encoded by
+        json_util instead.
         '''
 
-        self._results = []
         self._cursor = cursor
 
         if (isinstance(cursor, pymongo.cursor.Cursor) or
-                isinstance(cursor, pymongo.command_cursor.CommandCursor)):
+                isinstance(cursor, pymongo.command_cursor.CommandCursor) or
+                isinstance(cursor, collections.abc.Iterable)):
             self._format = formatter
             self._filename = filename
-            if results:
-                self._results = results
         else:
-            raise ValueError("aggregate argument to CursorFormatter is not of class pymongo cursor")
+            raise ValueError("aggregate argument to CursorFormatter is not a pymongo cursor or iterable")
+
+        self._json_options = json_options or json_util.RELAXED_JSON_OPTIONS
+        self._fast_json = fast_json
+
+        if results is not None:
+            self._results = results
+        elif keep == "all":
+            self._results = []
+        elif keep == "none":
+            self._results = NoResults()
+        elif hasattr(keep, "append") and hasattr(keep, "view"):
+            self._results = keep
+        else:
+            raise ValueError(f"keep must be 'all', 'none' or a results store such as FirstResults(n): {keep!r}")
 
     def results(self):
-        return self._results
+        '''
+        The documents kept while writing. Raises ValueError if the
+        formatter was created with keep="none".
+        '''
+        if isinstance(self._results, list):
+            return self._results
+        return self._results.view()
 
     @contextlib.contextmanager
-    def _smart_open(self, filename=None):
-        if filename and filename != '-':
-            fh = open(filename, 'w')
+    def _smart_open(self, filename=None, mode='w', buffering=-1):
+        if filename and filename != '-' and filename.endswith('.gz') and 'b' in mode:
+            fh = gzip.open(filename, mode)
+        elif filename and filename != '-':
+            fh = open(filename, mode, buffering=buffering)
+        elif 'b' in mode:
+            fh = sys.stdout.buffer
         else:
             fh = sys.stdout
 
         try:
             yield fh
         finally:
-            if fh is not sys.stdout:
+            if fh is not sys.stdout and fh is not sys.stdout.buffer:
                 fh.close()
 
     @staticmethod
@@ -80,15 +240,23 @@ class CursorFormatter(object):
         if fields is None or len(fields) == 0:
             return doc
 
-        new_doc = NestedDict()
-        old_doc = NestedDict(doc)
+        return CursorFormatter._projection(fields)(doc)
 
-        for i in fields:
-            if i in old_doc:
-                # print( "doc: %s" % doc )
-                # print( "i: %s" %i )
-                new_doc[i] = old_doc[i]
-        return dict(new_doc)
+    _projections = {}
+
+    @staticmethod
+    def _projection(fields, nested=True):
+        '''
+        Compiled FieldProjection for 'fields', cached so repeated calls with
+        the same field list do not split the names again.
+        '''
+        key = (tuple(fields), nested)
+        projection = CursorFormatter._projections.get(key)
+        if projection is None:
+            if len(CursorFormatter._projections) > 128:
+                CursorFormatter._projections.clear()
+            projection = CursorFormatter._projections[key] = FieldProjection(fields, nested)
+        return projection
 
     @staticmethod
     def dateMapper(doc, date_map, time_format=None):
@@ -105,10 +273,12 @@ class CursorFormatter(object):
     def printCSVCursor(self, c, fieldnames, datemap, time_format=None):
         '''
         Output CSV format. items are separated by commas. We only output the fields listed
-        in the 'fieldnames'. We datemap fields listed in 'datemap'. If a datemap listed field
+        in the 'fieldnames'. Dotted field names are written as flat columns named after
+        the field. We datemap fields listed in 'datemap'. If a datemap listed field
         is not a datetime object we will thow an exception.
         '''
 
+        projection = FieldProjection(fieldnames, nested=False)
         with self._smart_open(self._filename) as output:
             writer = csv.DictWriter(output, fieldnames=fieldnames)
             writer.writeheader()
@@ -116,7 +286,7 @@ class CursorFormatter(object):
             for i in c:
                 self._results.append(i)
                 count = count + 1
-                d = CursorFormatter.fieldMapper(i, fieldnames)
+                d = projection(i)
                 d = CursorFormatter.dateMapper(d, datemap, time_format)
                 writer.writerow(d)
 
@@ -135,13 +305,14 @@ class CursorFormatter(object):
         """
 
         count = 0
+        projection = FieldProjection(fieldnames) if fieldnames else None
 
         with self._smart_open(self._filename) as output:
             for i in c:
                 # print( "processing: %s" % i )
                 # print( "fieldnames: %s" % fieldnames )
                 self._results.append(i)
-                d = CursorFormatter.fieldMapper(i, fieldnames)
+                d = projection(i) if projection else i
                 # print( "processing fieldmapper: %s" % d )
                 d = CursorFormatter.dateMapper(d, datemap, time_format)
                 pprint.pprint(d, output)
@@ -149,14 +320,115 @@ class CursorFormatter(object):
 
         return count
 
+    def ndjson_encoder(self):
+        '''
+        Return a function that encodes a document as one line of Extended
+        JSON bytes. ObjectId, datetime, Decimal128 and the other BSON types
+        are encoded natively so no datemap is needed.
+        '''
+        json_options = self._json_options
+        if (self._fast_json and orjson is not None and
+                json_options.json_mode == json_util.JSONMode.RELAXED):
+            # subclasses of str and int, such as Code and Int64, go to
+            # default so they keep their Extended JSON form
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS
+
+            def default(obj):
+                return json_util.default(obj, json_options)
+
+            def slow(doc):
+                return json_util.dumps(doc, json_options=json_options).encode("utf-8")
+
+            def encode(doc):
+                try:
+                    line = orjson.dumps(doc, default=default, option=option)
+                except TypeError:
+                    # ints wider than 64 bits and types orjson has no
+                    # encoding for
+                    return slow(doc)
+                # orjson writes NaN and +/-Infinity as null where Extended
+                # JSON has $numberDouble, so a line with a null value is
+                # encoded again by json_util
+                if NULL_VALUE.search(line):
+                    return slow(doc)
+                return line
+
+            return encode
+
+        return lambda doc: json_util.dumps(doc, json_options=json_options).encode("utf-8")
+
+    def printNDJSONCursor(self, c, fieldnames):
+        '''
+        Output newline delimited Extended JSON, one document per line. Lines
+        are joined in batches and written through a large buffer.
+        '''
+        count = 0
+        projection = FieldProjection(fieldnames) if fieldnames else None
+        encode = self.ndjson_encoder()
+        batch = []
+
+        with self._smart_open(self._filename, 'wb', self.NDJSON_BUFFER) as output:
+            for i in c:
+                self._results.append(i)
+                batch.append(encode(projection(i) if projection else i))
+                count = count + 1
+                if len(batch) >= self.NDJSON_BATCH:
+                    batch.append(b"")
+                    output.write(b"\n".join(batch))
+                    batch = []
+            if batch:
+                batch.append(b"")
+                output.write(b"\n".join(batch))
+
+        return count
+
+    @staticmethod
+    def count_bson_documents(batch):
+        '''
+        Count the documents in a buffer of concatenated BSON documents by
+        walking their length prefixes, without decoding them.
+        '''
+        count = 0
+        offset = 0
+        end = len(batch)
+        while offset < end:
+            size, = struct.unpack_from("<i", batch, offset)
+            if size < 5 or offset + size > end:
+                raise ValueError(f"corrupt BSON document at offset {offset}")
+            offset = offset + size
+            count = count + 1
+        return count
+
+    def printBSONCursor(self, c):
+        '''
+        Write the raw batches of a RawBatchCommandCursor, as returned by
+        Pipeline.aggregate_raw_batches, straight to the output. No document
+        is decoded. The result is a mongodump style .bson file (gzipped if
+        the filename ends in .gz) that mongorestore can load. Documents are
+        not kept in results().
+        '''
+        count = 0
+        with self._smart_open(self._filename, 'wb', self.NDJSON_BUFFER) as output:
+            for batch in c:
+                if not isinstance(batch, (bytes, bytearray, memoryview)):
+                    raise ValueError("bson output needs a raw batch cursor, "
+                                     "use Pipeline.aggregate_raw_batches")
+                count = count + CursorFormatter.count_bson_documents(batch)
+                output.write(batch)
+        return count
+
     def printCursor(self, c, fieldnames=None, datemap=None, time_format=None):
         '''
         Output a cursor to a filename or stdout if filename is "-".
-        fmt defines whether we output CSV or JSON.
+        fmt defines whether we output CSV, NDJSON, BSON or JSON.
         '''
 
         if self._format == 'csv':
             count = self.printCSVCursor(c, fieldnames, datemap, time_format)
+        elif self._format == 'ndjson':
+            count = self.printNDJSONCursor(c, fieldnames)
+        elif self._format == 'bson':
+            count = self.printBSONCursor(c)
         else:
             count = self.printJSONCursor(c, fieldnames, datemap, time_format)
 
@@ -170,3 +442,4 @@ class CursorFormatter(object):
 
 
         count = self.printCursor(self._cursor, fieldNames, datemap, time_format)
+        return count
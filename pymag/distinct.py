@@ -0,0 +1,109 @@
+"""
+Copy one representative document per distinct key value.
+
+Instead of a ``distinct`` followed by a ``find_one`` and an
+``insert_one`` per value, a single pipeline picks the first document for
+each key with $group/$first and $replaceRoot. When source and target are
+on the same cluster a $merge writes the result on the server, otherwise
+the results are streamed back and written with unordered ``insert_many``
+batches.
+
+    copied = distinct_copy(db["groups"], db["test_groups"], "group.id")
+"""
+import pymongo.errors
+
+from pymag.pipeline import Pipeline
+from pymag.stages import match, sort, group, replaceRoot, merge
+
+DUPLICATE_KEY = 11000
+
+
+def distinct_pipeline(key, query=None, order=None):
+    """
+    The pipeline picking one document per value of ``key``.
+
+    :param key: dotted path of the field whose values must be distinct
+    :param query: optional filter applied before grouping
+    :param order: optional list of (field, direction) pairs deciding
+                  which document is the first for each key
+    """
+    query = dict(query or {})
+    query.setdefault(key, {"$exists": True})
+    stages = [match(query)]
+    if order:
+        stages.append(sort(*order))
+    stages.append(group({"_id": f"${key}", "doc": {"$first": "$$ROOT"}}))
+    stages.append(replaceRoot({"newRoot": "$doc"}))
+    return Pipeline(stages)
+
+
+def same_cluster(source, target):
+    return source.database.client == target.database.client
+
+
+def _insert_batch(target, batch):
+    """
+    Insert ``batch`` unordered and return the number inserted. Documents
+    already in the target, from an earlier run, are skipped.
+    """
+    try:
+        return len(target.insert_many(batch, ordered=False).inserted_ids)
+    except pymongo.errors.BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get("nInserted", len(batch) - len(errors))
+
+
+def distinct_copy(source, target, key, query=None, order=None, batch_size=1000,
+                  use_merge=None, progress=None):
+    """
+    Copy the first document for each distinct value of ``key`` from
+    ``source`` to ``target``.
+
+    :param source: collection to read
+    :param target: collection to write
+    :param key: dotted path of the field whose values must be distinct
+    :param query: optional filter applied before grouping
+    :param order: optional list of (field, direction) pairs deciding
+                  which document represents each key
+    :param batch_size: documents per cursor batch and per ``insert_many``
+    :param use_merge: write with $merge on the server. The default is to
+                      do so when source and target share a client
+    :param progress: optional callable given the running count of copied
+                     documents after each batch
+    :return: the number of documents copied, or with $merge the number
+             of documents in the target
+    """
+    if type(batch_size) is not int or batch_size < 1:
+        raise ValueError(f"batch_size {batch_size} must be a positive int")
+
+    pipeline = distinct_pipeline(key, query, order)
+    if use_merge is None:
+        use_merge = same_cluster(source, target)
+
+    if use_merge:
+        pipeline.append(merge({"into": {"db": target.database.name, "coll": target.name},
+                               "whenMatched": "keepExisting",
+                               "whenNotMatched": "insert"}))
+        for _ in pipeline.aggregate(source, allowDiskUse=True):
+            pass
+        copied = target.estimated_document_count()
+        if progress:
+            progress(copied)
+        return copied
+
+    copied = 0
+    batch = []
+    for doc in pipeline.aggregate(source, allowDiskUse=True, batchSize=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            copied = copied + _insert_batch(target, batch)
+            batch = []
+            if progress:
+                progress(copied)
+    if batch:
+        copied = copied + _insert_batch(target, batch)
+        if progress:
+            progress(copied)
+    return copied
@@ -0,0 +1,172 @@
+"""
+Helpers for working with documents as plain Python dicts: dotted field
+paths and the MongoDB comparison order of BSON values. Shared by the
+local executor and the match compiler.
+"""
+from datetime import datetime
+
+from bson import Decimal128, ObjectId
+
+MISSING = object()
+
+
+def split_path(path):
+    """
+    Split a dotted field name into a tuple of keys.
+    """
+    return tuple(path.split("."))
+
+
+def get_path(doc, parts):
+    """
+    Get the value at ``parts`` in ``doc``. Arrays along the path are
+    traversed the way MongoDB does, so "a.b" on {"a": [{"b": 1}, {"b": 2}]}
+    returns [1, 2]. Returns MISSING if the path does not exist.
+    """
+    value = doc
+    for i, part in enumerate(parts):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+            if value is MISSING:
+                return MISSING
+        elif isinstance(value, list):
+            rest = parts[i:]
+            values = [get_path(v, rest) for v in value if isinstance(v, dict)]
+            return [v for v in values if v is not MISSING]
+        else:
+            return MISSING
+    return value
+
+
+def query_path(doc, parts):
+    """
+    Get the value at ``parts`` in ``doc`` as a query filter sees it.
+    Arrays along the path are traversed like ``get_path`` but elements
+    without the field are kept as MISSING, so that they compare equal to
+    null, and MISSING is returned if no element has the field.
+    """
+    value = doc
+    for i, part in enumerate(parts):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+            if value is MISSING:
+                return MISSING
+        elif isinstance(value, list):
+            rest = parts[i:]
+            values = [query_path(v, rest) if isinstance(v, dict) else MISSING for v in value]
+            return values if any(v is not MISSING for v in values) else MISSING
+        else:
+            return MISSING
+    return value
+
+
+def _lookup(doc, parts):
+    """
+    Get the value at ``parts`` walking embedded documents only.
+    """
+    value = doc
+    for part in parts:
+        if not isinstance(value, dict):
+            return MISSING
+        value = value.get(part, MISSING)
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _set_path(doc, parts, value):
+    """
+    Set ``value`` at ``parts`` in ``doc``. ``doc`` must be a copy owned by
+    the caller, embedded documents along the path are copied before they
+    are written to so the input document is never modified.
+    """
+    for part in parts[:-1]:
+        child = doc.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        doc[part] = child
+        doc = child
+    doc[parts[-1]] = value
+
+
+def _value(v):
+    return None if v is MISSING else v
+
+
+def _type_rank(v):
+    """
+    Rank of a value in the MongoDB comparison order for BSON types.
+    """
+    if v is MISSING or v is None:
+        return 1
+    if isinstance(v, bool):
+        return 8
+    if isinstance(v, (int, float, Decimal128)):
+        return 2
+    if isinstance(v, str):
+        return 3
+    if isinstance(v, dict):
+        return 4
+    if isinstance(v, list):
+        return 5
+    if isinstance(v, bytes):
+        return 6
+    if isinstance(v, ObjectId):
+        return 7
+    if isinstance(v, datetime):
+        return 9
+    return 10
+
+
+def compare(a, b):
+    """
+    Compare two values using the MongoDB ordering of BSON types.
+    Returns -1, 0 or 1.
+    """
+    rank_a = _type_rank(a)
+    rank_b = _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 1:
+        return 0
+    if rank_a == 4:
+        for (ka, va), (kb, vb) in zip(a.items(), b.items()):
+            c = compare(ka, kb) or compare(va, vb)
+            if c:
+                return c
+        return compare(len(a), len(b))
+    if rank_a == 5:
+        for va, vb in zip(a, b):
+            c = compare(va, vb)
+            if c:
+                return c
+        return compare(len(a), len(b))
+    if isinstance(a, Decimal128):
+        a = a.to_decimal()
+    if isinstance(b, Decimal128):
+        b = b.to_decimal()
+    return (a > b) - (a < b)
+
+
+def _truthy(v):
+    """
+    Aggregation truthiness: null, missing, false and zero are false.
+    """
+    if v is MISSING or v is None or v is False:
+        return False
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v != 0
+    return True
+
+
+def _hashable(v):
+    """
+    A hashable stand-in for a group key. Booleans are tagged so they do
+    not collide with 0 and 1.
+    """
+    if isinstance(v, dict):
+        return ("object", tuple((k, _hashable(x)) for k, x in v.items()))
+    if isinstance(v, list):
+        return ("array", tuple(_hashable(x) for x in v))
+    if isinstance(v, bool):
+        return ("bool", v)
+    return v
@@ -0,0 +1,673 @@
+"""
+Run a pymag Pipeline in process against an iterable of Python dicts.
+
+``LocalExecutor`` compiles each stage once into a generator transform so
+the same pipeline can be run over many inputs without a round trip to
+MongoDB. Documents stream through the stages one at a time. Only stages
+that must see all of their input before producing output ($sort, $group
+and $count) hold it.
+
+Supported stages are $match, $project, $addFields, $set, $group, $sort,
+$limit, $skip, $unwind, $count, $replaceRoot and $replaceWith. A $sort
+directly followed by a $limit runs as a bounded top-k.
+"""
+import functools
+import heapq
+import itertools
+import math
+
+from pymag.documents import MISSING, split_path, get_path, compare, \
+    _lookup, _set_path, _value, _truthy, _hashable
+from pymag.matcher import compile_filter
+from pymag.stages import AggStage
+
+__all__ = ["LocalExecutor"]
+
+
+#
+# Expressions
+#
+
+def _compile_args(arg):
+    if not isinstance(arg, list):
+        arg = [arg]
+    return [compile_expression(a) for a in arg]
+
+
+def _numeric_op(func):
+    def compiler(arg):
+        args = _compile_args(arg)
+
+        def op(doc):
+            values = [_value(f(doc)) for f in args]
+            if any(v is None for v in values):
+                return None
+            return func(*values)
+        return op
+    return compiler
+
+
+def _compare_op(test):
+    def compiler(arg):
+        lhs, rhs = _compile_args(arg)
+        return lambda doc: test(compare(_value(lhs(doc)), _value(rhs(doc))))
+    return compiler
+
+
+def _add(*values):
+    return functools.reduce(lambda x, y: x + y, values, 0)
+
+
+def _multiply(*values):
+    return functools.reduce(lambda x, y: x * y, values, 1)
+
+
+def _mod(x, y):
+    # the server truncates, so the remainder has the sign of the dividend
+    # where Python's % takes the sign of the divisor
+    if isinstance(x, int) and isinstance(y, int):
+        remainder = abs(x) % abs(y)
+        return -remainder if x < 0 else remainder
+    return math.fmod(x, y)
+
+
+def _concat(arg):
+    args = _compile_args(arg)
+
+    def op(doc):
+        values = [_value(f(doc)) for f in args]
+        if any(v is None for v in values):
+            return None
+        return "".join(values)
+    return op
+
+
+def _string_op(func):
+    def compiler(arg):
+        f, = _compile_args(arg)
+
+        def op(doc):
+            v = _value(f(doc))
+            return "" if v is None else func(str(v))
+        return op
+    return compiler
+
+
+def _and(arg):
+    args = _compile_args(arg)
+    return lambda doc: all(_truthy(f(doc)) for f in args)
+
+
+def _or(arg):
+    args = _compile_args(arg)
+    return lambda doc: any(_truthy(f(doc)) for f in args)
+
+
+def _not(arg):
+    f, = _compile_args(arg)
+    return lambda doc: not _truthy(f(doc))
+
+
+def _cond(arg):
+    if isinstance(arg, dict):
+        arg = [arg["if"], arg["then"], arg["else"]]
+    test, then_expr, else_expr = _compile_args(arg)
+    return lambda doc: then_expr(doc) if _truthy(test(doc)) else else_expr(doc)
+
+
+def _if_null(arg):
+    args = _compile_args(arg)
+
+    def op(doc):
+        for f in args[:-1]:
+            v = _value(f(doc))
+            if v is not None:
+                return v
+        return args[-1](doc)
+    return op
+
+
+def _size(arg):
+    f, = _compile_args(arg)
+
+    def op(doc):
+        v = f(doc)
+        if not isinstance(v, list):
+            raise ValueError(f"The argument to $size must be an array, not {v!r}")
+        return len(v)
+    return op
+
+
+def _in(arg):
+    item, array = _compile_args(arg)
+
+    def op(doc):
+        values = array(doc)
+        if not isinstance(values, list):
+            raise ValueError(f"The second argument to $in must be an array, not {values!r}")
+        v = _value(item(doc))
+        return any(compare(v, x) == 0 for x in values)
+    return op
+
+
+EXPRESSION_OPERATORS = {
+    "$add": _numeric_op(_add),
+    "$subtract": _numeric_op(lambda x, y: x - y),
+    "$multiply": _numeric_op(_multiply),
+    "$divide": _numeric_op(lambda x, y: x / y),
+    "$mod": _numeric_op(_mod),
+    "$abs": _numeric_op(abs),
+    "$concat": _concat,
+    "$toUpper": _string_op(str.upper),
+    "$toLower": _string_op(str.lower),
+    "$eq": _compare_op(lambda c: c == 0),
+    "$ne": _compare_op(lambda c: c != 0),
+    "$gt": _compare_op(lambda c: c > 0),
+    "$gte": _compare_op(lambda c: c >= 0),
+    "$lt": _compare_op(lambda c: c < 0),
+    "$lte": _compare_op(lambda c: c <= 0),
+    "$and": _and,
+    "$or": _or,
+    "$not": _not,
+    "$cond": _cond,
+    "$ifNull": _if_null,
+    "$size": _size,
+    "$in": _in,
+}
+
+
+def compile_expression(expr):
+    """
+    Compile an aggregation expression into a callable taking a document.
+    The callable returns MISSING when a field path does not resolve.
+    """
+    if isinstance(expr, str) and expr.startswith("$"):
+        if expr.startswith("$$"):
+            name, _, rest = expr[2:].partition(".")
+            if name not in ("ROOT", "CURRENT"):
+                raise ValueError(f"variable {expr} is not supported by the local executor")
+            if not rest:
+                return lambda doc: doc
+            expr = f"${rest}"
+        parts = split_path(expr[1:])
+        return lambda doc: get_path(doc, parts)
+
+    if isinstance(expr, dict):
+        if len(expr) == 1:
+            (op_name, arg), = expr.items()
+            if op_name.startswith("$"):
+                if op_name == "$literal":
+                    return lambda doc: arg
+                try:
+                    compiler = EXPRESSION_OPERATORS[op_name]
+                except KeyError:
+                    raise ValueError(f"operator {op_name} is not supported by the local executor")
+                return compiler(arg)
+
+        fields = [(k, compile_expression(v)) for k, v in expr.items()]
+
+        def object_expr(doc):
+            result = {}
+            for k, f in fields:
+                v = f(doc)
+                if v is not MISSING:
+                    result[k] = v
+            return result
+        return object_expr
+
+    if isinstance(expr, list):
+        items = [compile_expression(x) for x in expr]
+        return lambda doc: [_value(f(doc)) for f in items]
+
+    return lambda doc: expr
+
+
+#
+# Accumulators
+#
+
+class _Accumulator:
+
+    def __init__(self, expr):
+        self._expr = compile_expression(expr)
+
+    def init(self):
+        return None
+
+    def step(self, state, doc):
+        return state
+
+    def result(self, state):
+        return state
+
+
+class _Sum(_Accumulator):
+
+    def init(self):
+        return 0
+
+    def step(self, state, doc):
+        v = self._expr(doc)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return state + v
+        return state
+
+
+class _Avg(_Accumulator):
+
+    def init(self):
+        return [0, 0]
+
+    def step(self, state, doc):
+        v = self._expr(doc)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            state[0] += v
+            state[1] += 1
+        return state
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+class _Min(_Accumulator):
+
+    def init(self):
+        return MISSING
+
+    def step(self, state, doc):
+        v = _value(self._expr(doc))
+        if v is None:
+            return state
+        if state is MISSING or compare(v, state) < 0:
+            return v
+        return state
+
+    def result(self, state):
+        return _value(state)
+
+
+class _Max(_Min):
+
+    def step(self, state, doc):
+        v = _value(self._expr(doc))
+        if v is None:
+            return state
+        if state is MISSING or compare(v, state) > 0:
+            return v
+        return state
+
+
+class _First(_Accumulator):
+
+    def init(self):
+        return MISSING
+
+    def step(self, state, doc):
+        return _value(self._expr(doc)) if state is MISSING else state
+
+    def result(self, state):
+        return _value(state)
+
+
+class _Last(_Accumulator):
+
+    def step(self, state, doc):
+        return _value(self._expr(doc))
+
+
+class _Push(_Accumulator):
+
+    def init(self):
+        return []
+
+    def step(self, state, doc):
+        v = self._expr(doc)
+        if v is not MISSING:
+            state.append(v)
+        return state
+
+
+class _AddToSet(_Accumulator):
+
+    def init(self):
+        return {}
+
+    def step(self, state, doc):
+        v = self._expr(doc)
+        if v is not MISSING:
+            state.setdefault(_hashable(v), v)
+        return state
+
+    def result(self, state):
+        return list(state.values())
+
+
+class _Count(_Sum):
+
+    def __init__(self, expr):
+        super().__init__(1)
+
+
+ACCUMULATORS = {
+    "$sum": _Sum,
+    "$avg": _Avg,
+    "$min": _Min,
+    "$max": _Max,
+    "$first": _First,
+    "$last": _Last,
+    "$push": _Push,
+    "$addToSet": _AddToSet,
+    "$count": _Count,
+}
+
+
+def _compile_accumulator(field, spec):
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError(f"group field {field} must be a single accumulator e.g. {{'$sum': 1}}")
+    (op_name, expr), = spec.items()
+    try:
+        return ACCUMULATORS[op_name](expr)
+    except KeyError:
+        raise ValueError(f"accumulator {op_name} is not supported by the local executor")
+
+
+#
+# Stages
+#
+
+def _match_stage(arg):
+    predicate = compile_filter(arg)
+    return lambda docs: filter(predicate, docs)
+
+
+def _flatten_projection(spec, prefix=""):
+    """
+    Turn {"a": {"b": 1}} into [("a.b", 1)] leaving expressions alone.
+    """
+    for field, value in spec.items():
+        if isinstance(value, dict) and value and not next(iter(value)).startswith("$"):
+            yield from _flatten_projection(value, f"{prefix}{field}.")
+        else:
+            yield f"{prefix}{field}", value
+
+
+def _include(src, dst, parts):
+    head = parts[0]
+    if head not in src:
+        return
+    value = src[head]
+    if len(parts) == 1:
+        dst[head] = value
+    elif isinstance(value, dict):
+        child = dst.get(head)
+        if not isinstance(child, dict):
+            child = dst[head] = {}
+        _include(value, child, parts[1:])
+    elif isinstance(value, list):
+        subdocs = [v for v in value if isinstance(v, dict)]
+        items = dst.get(head)
+        if not isinstance(items, list):
+            items = dst[head] = [{} for _ in subdocs]
+        for s, d in zip(subdocs, items):
+            _include(s, d, parts[1:])
+
+
+def _exclude(doc, parts):
+    head = parts[0]
+    if head not in doc:
+        return
+    if len(parts) == 1:
+        del doc[head]
+    elif isinstance(doc[head], dict):
+        child = doc[head] = dict(doc[head])
+        _exclude(child, parts[1:])
+
+
+def _project_stage(arg):
+    include_id = True
+    inclusions = []
+    exclusions = []
+    computed = []
+    for field, value in _flatten_projection(arg):
+        if isinstance(value, (bool, int, float)):
+            if field == "_id":
+                include_id = bool(value)
+            elif value:
+                inclusions.append(split_path(field))
+            else:
+                exclusions.append(split_path(field))
+        else:
+            computed.append((split_path(field), compile_expression(value)))
+
+    if exclusions and (inclusions or computed):
+        raise ValueError(f"cannot mix inclusion and exclusion in a projection: {arg}")
+
+    if exclusions or not (inclusions or computed):
+        if not include_id:
+            exclusions.append(("_id",))
+
+        def exclude(docs):
+            for doc in docs:
+                new_doc = dict(doc)
+                for parts in exclusions:
+                    _exclude(new_doc, parts)
+                yield new_doc
+        return exclude
+
+    def include(docs):
+        for doc in docs:
+            new_doc = {}
+            if include_id and "_id" in doc:
+                new_doc["_id"] = doc["_id"]
+            for parts in inclusions:
+                _include(doc, new_doc, parts)
+            for parts, f in computed:
+                v = f(doc)
+                if v is not MISSING:
+                    _set_path(new_doc, parts, v)
+            yield new_doc
+    return include
+
+
+def _add_fields_stage(arg):
+    fields = [(split_path(k), compile_expression(v)) for k, v in arg.items()]
+
+    def run(docs):
+        for doc in docs:
+            new_doc = dict(doc)
+            for parts, f in fields:
+                v = f(doc)
+                if v is not MISSING:
+                    _set_path(new_doc, parts, v)
+            yield new_doc
+    return run
+
+
+def _group_stage(arg):
+    spec = dict(arg)
+    if "_id" not in spec:
+        raise ValueError(f"a group specification must include an _id: {arg}")
+    key = compile_expression(spec.pop("_id"))
+    fields = list(spec.keys())
+    accumulators = [_compile_accumulator(k, v) for k, v in spec.items()]
+
+    def run(docs):
+        groups = {}
+        for doc in docs:
+            group_id = _value(key(doc))
+            hashed = _hashable(group_id)
+            state = groups.get(hashed)
+            if state is None:
+                state = groups[hashed] = [group_id] + [a.init() for a in accumulators]
+            for i, a in enumerate(accumulators, 1):
+                state[i] = a.step(state[i], doc)
+
+        for state in groups.values():
+            result = {"_id": state[0]}
+            for field, a, s in zip(fields, accumulators, state[1:]):
+                result[field] = a.result(s)
+            yield result
+    return run
+
+
+def sort_key(sort_spec):
+    """
+    A key function for ``sorted`` from a $sort specification.
+    """
+    specs = [(split_path(k), v) for k, v in sort_spec.items()]
+
+    def cmp(a, b):
+        for parts, direction in specs:
+            c = compare(get_path(a, parts), get_path(b, parts))
+            if c:
+                return c * direction
+        return 0
+    return functools.cmp_to_key(cmp)
+
+
+def _sort_stage(arg):
+    key = sort_key(arg)
+    return lambda docs: iter(sorted(docs, key=key))
+
+
+def _top_k(sort_arg, k):
+    """
+    $sort directly followed by $limit: keep only the best ``k`` documents.
+    """
+    key = sort_key(sort_arg)
+    return lambda docs: iter(heapq.nsmallest(k, docs, key=key))
+
+
+def _limit_stage(arg):
+    return lambda docs: itertools.islice(docs, arg)
+
+
+def _skip_stage(arg):
+    return lambda docs: itertools.islice(docs, arg, None)
+
+
+def _count_stage(arg):
+    def run(docs):
+        n = sum(1 for _ in docs)
+        if n:
+            yield {arg: n}
+    return run
+
+
+def _unwind_stage(arg):
+    if isinstance(arg, str):
+        arg = {"path": arg}
+    path = arg.get("path")
+    if not isinstance(path, str) or not path.startswith("$"):
+        raise ValueError(f"unwind path must be a field path starting with '$': {arg}")
+    parts = split_path(path[1:])
+    index_parts = split_path(arg["includeArrayIndex"]) if arg.get("includeArrayIndex") else None
+    preserve = arg.get("preserveNullAndEmptyArrays", False)
+
+    def run(docs):
+        for doc in docs:
+            value = _lookup(doc, parts)
+            if isinstance(value, list) and value:
+                for i, item in enumerate(value):
+                    new_doc = dict(doc)
+                    _set_path(new_doc, parts, item)
+                    if index_parts:
+                        _set_path(new_doc, index_parts, i)
+                    yield new_doc
+            elif isinstance(value, list) or value is MISSING or value is None:
+                if preserve:
+                    new_doc = dict(doc)
+                    if index_parts:
+                        _set_path(new_doc, index_parts, None)
+                    yield new_doc
+            else:
+                new_doc = dict(doc)
+                if index_parts:
+                    _set_path(new_doc, index_parts, None)
+                yield new_doc
+    return run
+
+
+def _replace_root_stage(arg):
+    new_root = compile_expression(arg["newRoot"] if "newRoot" in arg else arg)
+
+    def run(docs):
+        for doc in docs:
+            value = new_root(doc)
+            if not isinstance(value, dict):
+                raise ValueError(f"replacement root must be a document, not {_value(value)!r}")
+            yield value
+    return run
+
+
+STAGES = {
+    "$match": _match_stage,
+    "$project": _project_stage,
+    "$addFields": _add_fields_stage,
+    "$set": _add_fields_stage,
+    "$group": _group_stage,
+    "$sort": _sort_stage,
+    "$limit": _limit_stage,
+    "$skip": _skip_stage,
+    "$count": _count_stage,
+    "$unwind": _unwind_stage,
+    "$replaceRoot": _replace_root_stage,
+    "$replaceWith": _replace_root_stage,
+}
+
+
+def compile_stage(stage):
+    """
+    Compile an AggStage into a function that maps an iterator of
+    documents to an iterator of documents.
+    """
+    if not isinstance(stage, AggStage):
+        raise ValueError(f"{stage!r} is not an AggStage object")
+    try:
+        compiler = STAGES[stage.op_name]
+    except KeyError:
+        raise ValueError(f"{stage.op_name} is not supported by the local executor")
+    return compiler(stage.arg)
+
+
+class LocalExecutor:
+    """
+    Compile a Pipeline once and run it against iterables of documents.
+
+    >>> from pymag.stages import match, limit
+    >>> executor = LocalExecutor([match({"a": {"$gt": 1}}), limit(1)])
+    >>> list(executor.run([{"a": 1}, {"a": 2}, {"a": 3}]))
+    [{'a': 2}]
+    """
+
+    def __init__(self, pipeline):
+        self._pipeline = list(pipeline)
+        self._transforms = []
+        i = 0
+        while i < len(self._pipeline):
+            stage = self._pipeline[i]
+            following = self._pipeline[i + 1] if i + 1 < len(self._pipeline) else None
+            if isinstance(stage, AggStage) and stage.op_name == "$sort" and \
+                    isinstance(following, AggStage) and following.op_name == "$limit":
+                self._transforms.append(_top_k(stage.arg, following.arg))
+                i = i + 2
+            else:
+                self._transforms.append(compile_stage(stage))
+                i = i + 1
+
+    @property
+    def pipeline(self):
+        return self._pipeline
+
+    def run(self, docs):
+        """
+        Return a lazy iterator of the results of running the pipeline
+        over ``docs``.
+        """
+        it = iter(docs)
+        for transform in self._transforms:
+            it = transform(it)
+        return it
+
+    def __call__(self, docs):
+        return self.run(docs)
@@ -0,0 +1,215 @@
+"""
+Run the explain command for a pipeline and summarize the plan.
+
+``explain`` returns an ``ExplainSummary`` with one ``StageSummary`` per
+stage the server reports. The query layer stage (the $cursor stage, or
+the whole pipeline when it was pushed down to a find) records the
+indexes used, whether the collection was scanned and the keys and
+documents examined. Every stage records the documents it returned and
+whether it sorted in memory or spilled to disk. Plans with a collection
+scan, a blocking sort, a disk spill or too many keys or documents
+examined per document returned are flagged:
+
+    summary = pipeline.explain(collection)
+    if summary.flags:
+        print(summary)
+
+Explain output from sharded clusters is summarized per shard.
+"""
+from collections import namedtuple
+
+Flag = namedtuple("Flag", ["stage", "rule", "detail"])
+
+VERBOSITIES = ("queryPlanner", "executionStats", "allPlansExecution")
+CHILDREN = ("inputStage", "inputStages", "queryPlan", "outerStage", "innerStage", "thenStage", "elseStage")
+
+
+def plan_nodes(node):
+    """
+    Yield every node of an explain plan tree.
+    """
+    if not isinstance(node, dict):
+        return
+    if "stage" in node:
+        yield node
+    for child in CHILDREN:
+        value = node.get(child)
+        if isinstance(value, list):
+            for v in value:
+                yield from plan_nodes(v)
+        else:
+            yield from plan_nodes(value)
+
+
+class StageSummary:
+    """
+    What one stage of an explained pipeline did.
+    """
+
+    def __init__(self, name, shard=None):
+        self.name = name
+        self.shard = shard
+        self.indexes = []
+        self.collscan = False
+        self.blocking_sort = False
+        self.used_disk = False
+        self.n_returned = None
+        self.keys_examined = None
+        self.docs_examined = None
+        self.time_ms = None
+
+    @property
+    def label(self):
+        return f"{self.shard}:{self.name}" if self.shard else self.name
+
+    def as_dict(self):
+        return {"name": self.name,
+                "shard": self.shard,
+                "indexes": list(self.indexes),
+                "collscan": self.collscan,
+                "blocking_sort": self.blocking_sort,
+                "used_disk": self.used_disk,
+                "n_returned": self.n_returned,
+                "keys_examined": self.keys_examined,
+                "docs_examined": self.docs_examined,
+                "time_ms": self.time_ms}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.as_dict()!r})"
+
+    def __str__(self):
+        parts = [self.label]
+        if self.indexes:
+            parts.append(f"index {', '.join(self.indexes)}")
+        if self.collscan:
+            parts.append("COLLSCAN")
+        if self.keys_examined is not None:
+            parts.append(f"keys {self.keys_examined}")
+        if self.docs_examined is not None:
+            parts.append(f"docs {self.docs_examined}")
+        if self.n_returned is not None:
+            parts.append(f"returned {self.n_returned}")
+        if self.blocking_sort:
+            parts.append("blocking sort")
+        if self.used_disk:
+            parts.append("used disk")
+        return " ".join(parts)
+
+
+class ExplainSummary:
+    """
+    The per stage summaries of an explain and the flags raised on them.
+    """
+
+    def __init__(self, explain, max_ratio=10):
+        self._explain = explain
+        self._max_ratio = max_ratio
+        self._stages = []
+        if "shards" in explain:
+            for shard, shard_explain in explain["shards"].items():
+                self._stages.extend(self._parse(shard_explain, shard))
+        else:
+            self._stages.extend(self._parse(explain))
+        self._flags = self._check()
+
+    @property
+    def explain(self):
+        return self._explain
+
+    @property
+    def stages(self):
+        return list(self._stages)
+
+    @property
+    def flags(self):
+        return list(self._flags)
+
+    def rules(self):
+        return [f.rule for f in self._flags]
+
+    def __bool__(self):
+        return not self._flags
+
+    def __str__(self):
+        lines = [str(s) for s in self._stages]
+        lines.extend(f"{f.stage}: {f.rule}: {f.detail}" for f in self._flags)
+        return "\n".join(lines)
+
+    def _parse(self, explain, shard=None):
+        if "stages" in explain:
+            stages = []
+            for stage in explain["stages"]:
+                name = next(k for k in stage if k.startswith("$"))
+                if name == "$cursor":
+                    summary = self._query(stage["$cursor"], shard)
+                else:
+                    summary = StageSummary(name, shard)
+                    summary.blocking_sort = name == "$sort"
+                    summary.used_disk = bool(stage.get("usedDisk") or stage.get("spills"))
+                summary.n_returned = stage.get("nReturned", summary.n_returned)
+                summary.time_ms = stage.get("executionTimeMillisEstimate", summary.time_ms)
+                stages.append(summary)
+            return stages
+        if "queryPlanner" in explain:
+            return [self._query(explain, shard)]
+        raise ValueError(f"unrecognised explain output with keys {sorted(explain)}")
+
+    def _query(self, cursor, shard):
+        summary = StageSummary("query", shard)
+        winning = cursor.get("queryPlanner", {}).get("winningPlan", {})
+        stats = cursor.get("executionStats", {})
+        for node in list(plan_nodes(winning)) + list(plan_nodes(stats.get("executionStages"))):
+            if node["stage"] == "IXSCAN" and node.get("indexName") and node["indexName"] not in summary.indexes:
+                summary.indexes.append(node["indexName"])
+            elif node["stage"] == "COLLSCAN":
+                summary.collscan = True
+            elif node["stage"] == "SORT":
+                summary.blocking_sort = True
+            if node.get("usedDisk") or node.get("spills"):
+                summary.used_disk = True
+        if stats:
+            summary.n_returned = stats.get("nReturned")
+            summary.keys_examined = stats.get("totalKeysExamined")
+            summary.docs_examined = stats.get("totalDocsExamined")
+            summary.time_ms = stats.get("executionTimeMillis")
+        return summary
+
+    def _ratio(self, examined, returned):
+        return examined / max(returned, 1)
+
+    def _check(self):
+        flags = []
+        for stage in self._stages:
+            if stage.collscan:
+                flags.append(Flag(stage.label, "collscan", "the collection was scanned without an index"))
+            if stage.blocking_sort:
+                flags.append(Flag(stage.label, "blocking_sort", "documents were sorted in memory"))
+            if stage.used_disk:
+                flags.append(Flag(stage.label, "used_disk", "the stage spilled to disk"))
+            if stage.n_returned is None:
+                continue
+            for kind, examined in (("keys", stage.keys_examined), ("docs", stage.docs_examined)):
+                if examined and self._ratio(examined, stage.n_returned) > self._max_ratio:
+                    flags.append(Flag(stage.label, f"{kind}_examined",
+                                      f"{examined} {kind} examined to return {stage.n_returned}"))
+        return flags
+
+
+def explain(pipeline, collection, verbosity="executionStats", max_ratio=10):
+    """
+    Run explain for ``pipeline`` on ``collection`` and summarize it.
+
+    :param verbosity: "queryPlanner", "executionStats" or
+                      "allPlansExecution". Examined counts, spills and
+                      timings need executionStats or above
+    :param max_ratio: keys or documents examined per document returned
+                      above which a stage is flagged
+    :return: ExplainSummary
+    """
+    if verbosity not in VERBOSITIES:
+        raise ValueError(f"verbosity {verbosity} must be one of {', '.join(VERBOSITIES)}")
+    command = {"explain": {"aggregate": collection.name,
+                           "pipeline": pipeline(),
+                           "cursor": {}},
+               "verbosity": verbosity}
+    return ExplainSummary(collection.database.command(command), max_ratio)
@@ -1,17 +1,40 @@
+"""
+Copy one document per distinct value of a field to another collection.
+
+    python -m pymag.extract_distinct --database TEST_AGG --collection groups \
+        --out test_groups --key group.id
+
+"""
+import argparse
+
 import pymongo
 
-client = pymongo.MongoClient()
+from pymag.distinct import distinct_copy
+
+if __name__ == "__main__":
 
-db = client["TEST_AGG"]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="mongodb://localhost:27017", help="MongoDB URI [default: %(default)s]")
+    parser.add_argument("--out_host", help="MongoDB URI for the output collection [default: --host]")
+    parser.add_argument("--database", type=str, default="TEST_AGG", help="Database to use: [default: %(default)s]")
+    parser.add_argument("--collection", type=str, default="groups", help="Collection to use: [default: %(default)s]")
+    parser.add_argument("--out_database", type=str, help="Output database [default: --database]")
+    parser.add_argument("--out", type=str, default="test_groups", help="Output collection [default: %(default)s]")
+    parser.add_argument("--key", type=str, default="group.id", help="Field with distinct values [default: %(default)s]")
+    parser.add_argument("--batchsize", type=int, default=1000, help="Documents per insert batch [default: %(default)s]")
+    parser.add_argument("--insert", action="store_true", default=False,
+                        help="Write with insert_many even when a server side $merge is possible")
 
-col = db["groups"]
-new_col = db["test_groups"]
+    args = parser.parse_args()
 
-distinct_values = col.distinct("group.id")
+    client = pymongo.MongoClient(host=args.host)
+    out_client = pymongo.MongoClient(host=args.out_host) if args.out_host else client
+    source = client[args.database][args.collection]
+    target = out_client[args.out_database or args.database][args.out]
+    print(f"Copying one document per {args.key} from {source.full_name} to {target.full_name}")
 
-count = 0
-for i in distinct_values:
-    v = col.find_one({"group.id": i})
-    count = count + 1
-    print(count)
-    new_col.insert_one(v)
+    copied = distinct_copy(source, target, args.key,
+                           batch_size=args.batchsize,
+                           use_merge=False if args.insert else None,
+                           progress=lambda count: print(f"{count} documents copied", flush=True))
+    print(f"Done: {copied} documents")
@@ -3,8 +3,14 @@ Represent code fragments in used in $function and other places.
 """
 from datetime import datetime
 import hashlib
+import importlib.metadata
 import os
 import inspect
+import subprocess
+import tempfile
+import threading
+
+__all__ = ["JSCode"]
 
 
 class JSCode:
@@ -19,9 +25,41 @@ class JSCode:
 
     https://pypi.org/project/Transcrypt/
 
+    Transpiled code is cached in a directory shared between processes,
+    keyed on the hash of the Python source and the transcrypt version.
+    The directory is ``$PYMAG_JSCODE_CACHE`` if set and
+    ``~/.cache/pymag/jscode`` otherwise. A cache hit does not run
+    transcrypt and does not write any files.
+
     """
 
     TARGET_DIR = "__target__"
+    CACHE_ENV = "PYMAG_JSCODE_CACHE"
+    DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "pymag", "jscode")
+
+    _memo = {}
+    _sources = {}
+    _memo_lock = threading.Lock()
+    _transcrypt_version = None
+
+    @classmethod
+    def cache_dir(cls):
+        return os.path.expanduser(os.environ.get(cls.CACHE_ENV) or cls.DEFAULT_CACHE_DIR)
+
+    @classmethod
+    def transcrypt_version(cls):
+        if cls._transcrypt_version is None:
+            try:
+                cls._transcrypt_version = importlib.metadata.version("Transcrypt")
+            except importlib.metadata.PackageNotFoundError:
+                cls._transcrypt_version = "unknown"
+        return cls._transcrypt_version
+
+    @classmethod
+    def clear_memo(cls):
+        with cls._memo_lock:
+            cls._memo.clear()
+            cls._sources.clear()
 
     @staticmethod
     def add_dollar(s):
@@ -51,37 +89,180 @@ class JSCode:
             return s
 
     def __init__(self, python_func, *args):
+        self._setup(python_func, args)
+        self._js_code = self._compile()
+
+    def _setup(self, python_func, args):
 
         self._js_code = None
         self._python_func = python_func
         assert isinstance(self._python_func, object)
-        self._python_code = inspect.getsource(self._python_func)
+        self._python_code, self._hash, self._cache_key = self._source(python_func)
         self._args = args
         self._js_args = []
         for i in self._args:
             assert isinstance(i, str)
             self._js_args.append(self.add_dollar(i))
 
-        hash_str = hashlib.sha256()
-        hash_str.update(self._python_code.encode("utf-8"))
-        self._hash = hash_str.hexdigest()
-        self._hash_path = str(self._hash)+".py"
+        self._cache_dir = self.cache_dir()
+        self._hash_path = os.path.join(self._cache_dir, str(self._hash)+".py")
 
         if "." in self._python_func.__qualname__:
             raise ValueError(f"You can only encode top level functions: "
                              f"{self._python_func.__qualname__} is a nested function")
 
-        if os.path.exists(self._hash_path):
-            self._js_code = JSCode.to_js(self._hash_path, self._python_func)
-        else:
-            with open(f"{self._hash_path}", "w") as hash_file:
-                hash_file.write(f"# qualified name : {self._python_func.__qualname__}\n")
-                hash_file.write(f"# UTC Timestamp  : {datetime.utcnow()}\n")
-                hash_file.write(self._python_code)
-            self._js_code = JSCode.to_js(f"{self._hash_path}", self._python_func)
+    @classmethod
+    def _source(cls, python_func):
+        """
+        The source of ``python_func``, its hash and its cache key. They
+        are memoized on the function's module, qualified name and code
+        object, so building a JSCode for a function seen before does not
+        read the source file again. Redefining the function gives it a
+        new code object and so a new entry.
+        """
+        version = cls.transcrypt_version()
+        key = (python_func.__module__, python_func.__qualname__, python_func.__code__, version)
+        source = cls._sources.get(key)
+        if source is None:
+            python_code = inspect.getsource(python_func)
+            hash_str = hashlib.sha256()
+            hash_str.update(python_code.encode("utf-8"))
+            source_hash = hash_str.hexdigest()
+            hash_str.update(version.encode("utf-8"))
+            source = (python_code, source_hash, hash_str.hexdigest())
+            with cls._memo_lock:
+                cls._sources[key] = source
+        return source
+
+    @classmethod
+    def batch(cls, functions):
+        """
+        Build a JSCode for each of ``functions`` with a single transcrypt
+        run. Each item is a function or a tuple of a function and its
+        argument names, as passed to ``JSCode()``. Functions already in the
+        cache are not transpiled again. The functions that miss are
+        written to one generated module and each body is extracted from
+        its output. Functions sharing a name go to separate runs.
+
+        :return: list of JSCode in the same order as ``functions``
+        """
+        codes = []
+        for spec in functions:
+            func, *args = spec if isinstance(spec, tuple) else (spec,)
+            code = cls.__new__(cls)
+            code._setup(func, tuple(args))
+            code._js_code = code._lookup()
+            codes.append(code)
+
+        pending = {}
+        for code in codes:
+            if code._js_code is None:
+                pending.setdefault(code.cache_key, code)
+
+        pending = list(pending.values())
+        while pending:
+            names = set()
+            module, rest = [], []
+            for code in pending:
+                name = code._python_func.__name__
+                (rest if name in names else module).append(code)
+                names.add(name)
+            cls._transpile_module(module)
+            pending = rest
+
+        for code in codes:
+            if code._js_code is None:
+                code._js_code = code._lookup()
+        return codes
+
+    @classmethod
+    def _transpile_module(cls, codes):
+        cache_dir = codes[0]._cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        module_hash = hashlib.sha256("".join(c.cache_key for c in codes).encode("utf-8")).hexdigest()
+        module_path = os.path.join(cache_dir, f"batch_{module_hash}.py")
+        with open(module_path, "w") as module_file:
+            module_file.write(f"# UTC Timestamp  : {datetime.utcnow()}\n")
+            for code in codes:
+                module_file.write(f"\n# qualified name : {code._python_func.__qualname__}\n")
+                module_file.write(code._python_code)
+
+        target_dir = cls.transcrypt(module_path)
+        js_filename = os.path.join(target_dir, f"batch_{module_hash}.js")
+        for code in codes:
+            js_code = cls.extract_js(js_filename, code._python_func)
+            if len(js_code) == 0:
+                raise ValueError(f"No function called {code._python_func.__name__} extracted from {js_filename}")
+            cls.write_cache(code.cache_path, js_code)
+            code._remember(js_code)
+
+    @property
+    def cache_key(self):
+        return self._cache_key
+
+    @property
+    def cache_path(self):
+        return os.path.join(self._cache_dir, f"{self.cache_key}.js")
+
+    def _compile(self):
+        """
+        Look the JavaScript up in the in-process memo, then in the cache
+        directory, and only run transcrypt when both miss.
+        """
+        js_code = self._lookup()
+        if js_code is None:
+            self.write_source()
+            js_code = JSCode.to_js(self._hash_path, self._python_func)
+            JSCode.write_cache(self.cache_path, js_code)
+            self._remember(js_code)
+        return js_code
+
+    def _lookup(self):
+        memo_key = (self._cache_dir, self.cache_key)
+        js_code = JSCode._memo.get(memo_key)
+        if js_code is not None:
+            return js_code
+        try:
+            with open(self.cache_path, "r") as cached:
+                js_code = cached.read().split("\n")
+        except FileNotFoundError:
+            return None
+        self._remember(js_code)
+        return js_code
+
+    def _remember(self, js_code):
+        with JSCode._memo_lock:
+            JSCode._memo[(self._cache_dir, self.cache_key)] = js_code
+
+    def write_source(self):
+        """
+        Write the Python source that transcrypt reads to ``hash_path``.
+        """
+        os.makedirs(self._cache_dir, exist_ok=True)
+        with open(self._hash_path, "w") as hash_file:
+            hash_file.write(f"# qualified name : {self._python_func.__qualname__}\n")
+            hash_file.write(f"# UTC Timestamp  : {datetime.utcnow()}\n")
+            hash_file.write(self._python_code)
+
+    @staticmethod
+    def write_cache(path, js_code):
+        """
+        Atomically write extracted JavaScript so that concurrent processes
+        never read a partial entry.
+        """
+        directory = os.path.dirname(path)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as output:
+            output.write("\n".join(js_code))
+        os.replace(tmp, path)
 
     @property
     def hash_path(self):
+        """
+        The path of the Python source file in the cache directory. It is
+        only written when transcrypt runs, so after a cache hit it may not
+        exist; call ``write_source`` to create it.
+        """
         return self._hash_path
 
     @property
@@ -98,18 +279,28 @@ class JSCode:
 
     transcrypt_cmd = "transcrypt -n -u .auto -p .none -xt"
 
+    @staticmethod
+    def transcrypt(input_filename):
+        """
+        Run transcrypt on ``input_filename`` in the directory holding it,
+        so the ``__target__`` output lands next to the source.
+        """
+        directory, filename_base = os.path.split(os.path.abspath(input_filename))
+        subprocess.run(JSCode.transcrypt_cmd.split() + [filename_base], cwd=directory,
+                       check=True, stdout=subprocess.DEVNULL)
+        return os.path.join(directory, JSCode.TARGET_DIR)
+
     @staticmethod
     def to_js(input_filename, f):
 
         filename_base = os.path.basename(input_filename)
         filename_root, _ = os.path.splitext(filename_base)
-        js_filename = os.path.join(JSCode.TARGET_DIR, f"{filename_root}.js")
 
         if not os.path.isfile(input_filename):
             raise OSError(f"No such file:{input_filename}")
         else:
-            print(f"{JSCode.transcrypt_cmd} {input_filename}")
-            os.system(f"{JSCode.transcrypt_cmd} {input_filename}")
+            target_dir = JSCode.transcrypt(input_filename)
+            js_filename = os.path.join(target_dir, f"{filename_root}.js")
             js_code = JSCode.extract_js(js_filename, f)
         if len(js_code) == 0:
             raise ValueError(f"No function called {f.__name__}extracted from {js_filename}")
@@ -126,6 +317,11 @@ class JSCode:
 
     @staticmethod
     def extract_js(filename, f):
+        """
+        Return the lines of the JavaScript function exported as
+        ``f.__name__`` from a transcrypt output file. Other exports in the
+        file are skipped so one module can hold many functions.
+        """
 
         func = []
         count = 1
@@ -136,12 +332,11 @@ class JSCode:
                     func.append(line.rstrip())
                     if line.startswith("};"):  # parsing is over
                         return func
-                else:
-                    line = line.lstrip()
+                    continue
+                line = line.lstrip()
                 if line.startswith("export"):
                     definition, equals, funcdef = line.partition("=")
                     definition = definition.strip()
-                    func.append(funcdef.rstrip())
                     if equals != "=":
                         raise ValueError(f"Parsing of {filename} failed at line {count}"
                                          f": No equals sign (=) found")
@@ -149,6 +344,6 @@ class JSCode:
                         raise ValueError(f"Parsing of {filename} failed at line {count}"
                                          f" 'exports var' not found"
                                          )
-                    if not definition.endswith(f.__name__):
-                        raise ValueError(f"Parsing of {filename} failed at line {count}"
-                                         f"function definition is {definition} not {function_name}")
+                    if definition.split()[-1] == f.__name__:
+                        func.append(funcdef.rstrip())
+        return func
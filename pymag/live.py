@@ -0,0 +1,246 @@
+"""
+Group results kept current in memory from a change stream.
+
+A LiveAggregate takes a pipeline of $match stages followed by one
+$group whose accumulators are $sum, $count, $min or $max. It runs the
+pipeline once, then applies change events to a dict of group results
+keyed by the group key, so reads never go to the server:
+
+    leaderboard = LiveAggregate(attendees, Pipeline([matcher, grouper]))
+    leaderboard.start()
+    leaderboard.get("Joe Drumgoole")
+
+The initial aggregate runs in a snapshot session and the change stream
+starts at its operation time, so no event is missed or applied twice.
+Updates, replaces and deletes need the document before the change: the
+collection should have changeStreamPreAndPostImages enabled. When an
+event has no pre-image, or removes the current value of a $min or $max,
+the pipeline is run again.
+
+``apply`` can also be fed events directly, from any source that
+produces documents shaped like change events. Changes to the state are
+made under a lock and readers that walk all the groups take a snapshot
+first, so reads are safe while events are applied on another thread.
+"""
+import functools
+import heapq
+import threading
+
+from pymongo.errors import PyMongoError
+
+from pymag.documents import compare, _hashable, _value
+from pymag.executor import compile_expression
+from pymag.matcher import compile_filter
+from pymag.pipeline import Pipeline
+from pymag.reducer import GroupReducer
+from pymag.stages import group
+
+COUNT = "__live_count"
+CLEARED = ("drop", "dropDatabase", "rename")
+
+
+class LiveAggregate:
+    """
+    The results of a $match + $group ``pipeline`` on ``collection``,
+    kept current by ``apply``.
+    """
+
+    def __init__(self, collection, pipeline):
+        *matches, grouper = list(pipeline) or [None]
+        if grouper is None or grouper.op_name != "$group":
+            raise ValueError("the last stage of a live aggregate must be a $group")
+        for stage in matches:
+            if stage.op_name != "$match":
+                raise ValueError(f"{stage.name} cannot be used, only $match stages may precede the $group")
+        reducer = GroupReducer(grouper)
+        if COUNT in grouper.arg:
+            raise ValueError(f"{COUNT} is reserved for the document count of each group")
+        self._collection = collection
+        self._pipeline = Pipeline(matches + [group(dict(grouper.arg, **{COUNT: {"$sum": 1}}))])
+        self._filters = [compile_filter(m.arg) for m in matches]
+        self._key = compile_expression(reducer.group_id)
+        self._accumulators = []
+        for field, op_name in reducer.accumulators:
+            expr = grouper.arg[field][op_name]
+            self._accumulators.append((field, op_name, None if op_name == "$count" else compile_expression(expr)))
+        self._groups = {}
+        self._counts = {}
+        self._after = None
+        self._stream = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __contains__(self, key):
+        return _hashable(key) in self._groups
+
+    def __getitem__(self, key):
+        return self._groups[_hashable(key)]
+
+    def get(self, key, default=None):
+        """
+        The group result for ``key``, without contacting the server.
+        """
+        return self._groups.get(_hashable(key), default)
+
+    def values(self):
+        with self._lock:
+            return list(self._groups.values())
+
+    def top(self, n, field):
+        """
+        The ``n`` groups with the largest ``field``, in BSON order, so a
+        None or a value of another type does not break the ordering.
+        """
+        key = functools.cmp_to_key(compare)
+        return heapq.nlargest(n, self.values(), key=lambda doc: key(doc.get(field)))
+
+    def load(self, session=None):
+        """
+        Replace the state with the result of running the pipeline.
+        """
+        groups, counts = {}, {}
+        for doc in self._pipeline.aggregate(self._collection, session=session, allowDiskUse=True):
+            key = _hashable(doc["_id"])
+            counts[key] = doc.pop(COUNT)
+            groups[key] = doc
+        with self._lock:
+            self._groups, self._counts = groups, counts
+
+    def resync(self):
+        """
+        Run the pipeline again in a snapshot session and ignore change
+        events up to its operation time.
+        """
+        client = self._collection.database.client
+        with client.start_session(snapshot=True) as session:
+            self.load(session)
+            with self._lock:
+                self._after = session.operation_time
+
+    def _matches(self, doc):
+        return doc is not None and all(f(doc) for f in self._filters)
+
+    def _remove(self, doc):
+        """
+        Take ``doc`` out of its group. Returns False if the group has to
+        be recomputed.
+        """
+        key_value = _value(self._key(doc))
+        key = _hashable(key_value)
+        current = self._groups.get(key)
+        if current is None:
+            return False
+        if self._counts[key] == 1:
+            del self._groups[key]
+            del self._counts[key]
+            return True
+        result = dict(current)
+        for field, op_name, expr in self._accumulators:
+            if op_name == "$count":
+                result[field] = current[field] - 1
+                continue
+            value = _value(expr(doc))
+            if op_name == "$sum":
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    result[field] = current[field] - value
+            elif value is not None and compare(value, current[field]) == 0:
+                return False
+        self._counts[key] = self._counts[key] - 1
+        self._groups[key] = result
+        return True
+
+    def _add(self, doc):
+        key_value = _value(self._key(doc))
+        key = _hashable(key_value)
+        current = self._groups.get(key)
+        result = {"_id": key_value} if current is None else dict(current)
+        for field, op_name, expr in self._accumulators:
+            existing = result.get(field)
+            if op_name == "$count":
+                result[field] = (existing or 0) + 1
+                continue
+            value = _value(expr(doc))
+            if op_name == "$sum":
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    value = 0
+                result[field] = (existing or 0) + value
+            elif value is None:
+                result.setdefault(field, None)
+            elif existing is None or compare(value, existing) * (1 if op_name == "$max" else -1) > 0:
+                result[field] = value
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._groups[key] = result
+
+    def apply(self, event):
+        """
+        Apply one change event. Events at or before the operation time
+        of the last ``resync`` are ignored.
+        """
+        with self._lock:
+            applied = self._apply(event)
+        if not applied:
+            self.resync()
+
+    def _apply(self, event):
+        """
+        Apply ``event`` with the lock held. Returns False if the pipeline
+        has to be run again.
+        """
+        cluster_time = event.get("clusterTime")
+        if self._after is not None and cluster_time is not None and cluster_time <= self._after:
+            return True
+        operation = event["operationType"]
+        if operation in CLEARED:
+            self._groups, self._counts = {}, {}
+            return True
+        if operation not in ("insert", "update", "replace", "delete"):
+            return True
+        before = event.get("fullDocumentBeforeChange")
+        after = None if operation == "delete" else event.get("fullDocument")
+        if (operation != "insert" and before is None) or (operation != "delete" and after is None):
+            return False
+        if self._matches(before) and not self._remove(before):
+            return False
+        if self._matches(after):
+            self._add(after)
+        return True
+
+    def start(self, **kwargs):
+        """
+        Load the initial state and apply change events on a daemon
+        thread until ``stop`` is called. ``kwargs`` are passed to
+        ``collection.watch``.
+        """
+        self.resync()
+        self._stopping.clear()
+        kwargs.setdefault("full_document", "whenAvailable")
+        kwargs.setdefault("full_document_before_change", "whenAvailable")
+        self._stream = self._collection.watch(start_at_operation_time=self._after, **kwargs)
+        self._thread = threading.Thread(target=self._follow, daemon=True)
+        self._thread.start()
+        return self
+
+    def _follow(self):
+        stream = self._stream
+        try:
+            with stream:
+                for event in stream:
+                    if event["operationType"] == "invalidate":
+                        break
+                    self.apply(event)
+        except PyMongoError:
+            # closing the stream from stop() interrupts a waiting getMore
+            if not self._stopping.is_set():
+                raise
+
+    def stop(self):
+        self._stopping.set()
+        if self._stream is not None:
+            self._stream.close()
+        if self._thread is not None:
+            self._thread.join()
+        self._stream = self._thread = None
@@ -0,0 +1,172 @@
+"""
+Compile the filter document of a $match stage into a single Python
+predicate.
+
+The filter is walked once. Dotted field paths are split into accessor
+closures and every operator becomes a closure over its pre-processed
+argument, so testing a document does no dict lookups on the filter.
+
+    >>> is_adult = compile_filter({"age": {"$gte": 18}, "address.city": "Dublin"})
+    >>> is_adult({"age": 21, "address": {"city": "Dublin"}})
+    True
+    >>> is_adult({"age": 12, "address": {"city": "Dublin"}})
+    False
+
+Supported operators are $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin,
+$exists, $and, $or and $nor.
+"""
+from pymag.documents import MISSING, split_path, query_path, compare, _type_rank
+
+
+def _accessor(field):
+    """
+    Return a function that gets ``field`` from a document.
+    """
+    parts = split_path(field)
+    if len(parts) == 1:
+        key = parts[0]
+        return lambda doc: doc.get(key, MISSING)
+    return lambda doc: query_path(doc, parts)
+
+
+def _eq_test(target):
+    """
+    Equality as MongoDB does it: a value matches if it equals the target
+    or, for arrays, if any element equals the target.
+    """
+    if type(target) is str:
+        def test(value):
+            if value == target:
+                return True
+            return type(value) is list and target in value
+        return test
+
+    def test(value):
+        if compare(value, target) == 0:
+            return True
+        return type(value) is list and any(compare(v, target) == 0 for v in value)
+    return test
+
+
+def _range_test(target, check):
+    """
+    Comparisons only match values of the same BSON type as the target.
+    """
+    rank = _type_rank(target)
+
+    def test(value):
+        if type(value) is list:
+            return any(_type_rank(v) == rank and check(compare(v, target)) for v in value)
+        return _type_rank(value) == rank and check(compare(value, target))
+    return test
+
+
+def _in_test(targets):
+    if not isinstance(targets, (list, tuple)):
+        raise ValueError(f"$in needs an array: {targets!r}")
+    if all(type(t) is str for t in targets):
+        strings = frozenset(targets)
+
+        def test(value):
+            if type(value) is str:
+                return value in strings
+            return type(value) is list and any(type(v) is str and v in strings for v in value)
+        return test
+
+    tests = [_eq_test(t) for t in targets]
+    return lambda value: any(t(value) for t in tests)
+
+
+def _not(test):
+    return lambda value: not test(value)
+
+
+def _exists_test(flag):
+    if flag:
+        return lambda value: value is not MISSING
+    return lambda value: value is MISSING
+
+
+OPERATORS = {
+    "$eq": _eq_test,
+    "$ne": lambda target: _not(_eq_test(target)),
+    "$gt": lambda target: _range_test(target, lambda c: c > 0),
+    "$gte": lambda target: _range_test(target, lambda c: c >= 0),
+    "$lt": lambda target: _range_test(target, lambda c: c < 0),
+    "$lte": lambda target: _range_test(target, lambda c: c <= 0),
+    "$in": _in_test,
+    "$nin": lambda targets: _not(_in_test(targets)),
+    "$exists": _exists_test,
+}
+
+
+def _is_operator_doc(condition):
+    return isinstance(condition, dict) and len(condition) > 0 and \
+        all(k.startswith("$") for k in condition)
+
+
+def _all(tests):
+    if len(tests) == 1:
+        return tests[0]
+    tests = tuple(tests)
+
+    def test(value):
+        for t in tests:
+            if not t(value):
+                return False
+        return True
+    return test
+
+
+def _value_test(condition):
+    if not _is_operator_doc(condition):
+        return _eq_test(condition)
+    tests = []
+    for op_name, arg in condition.items():
+        try:
+            tests.append(OPERATORS[op_name](arg))
+        except KeyError:
+            raise ValueError(f"query operator {op_name} is not supported by the match compiler")
+    return _all(tests)
+
+
+def _field_predicate(field, condition):
+    get = _accessor(field)
+    test = _value_test(condition)
+    return lambda doc: test(get(doc))
+
+
+def _clauses(op_name, clauses):
+    if not isinstance(clauses, list) or len(clauses) == 0:
+        raise ValueError(f"{op_name} needs a non-empty array of filters: {clauses!r}")
+    return [compile_filter(c) for c in clauses]
+
+
+def compile_filter(query):
+    """
+    Compile a query filter into a predicate taking a document and
+    returning True if the document matches.
+    """
+    if query is None:
+        query = {}
+    if not isinstance(query, dict):
+        raise ValueError(f"{query!r} is not a dict object")
+
+    predicates = []
+    for field, condition in query.items():
+        if field == "$and":
+            predicates.append(_all(_clauses(field, condition)))
+        elif field == "$or":
+            alternatives = tuple(_clauses(field, condition))
+            predicates.append(lambda doc, a=alternatives: any(p(doc) for p in a))
+        elif field == "$nor":
+            alternatives = tuple(_clauses(field, condition))
+            predicates.append(lambda doc, a=alternatives: not any(p(doc) for p in a))
+        elif field.startswith("$"):
+            raise ValueError(f"query operator {field} is not supported by the match compiler")
+        else:
+            predicates.append(_field_predicate(field, condition))
+
+    if not predicates:
+        return lambda doc: True
+    return _all(predicates)
@@ -0,0 +1,240 @@
+"""
+Record what each pipeline costs on the wire.
+
+``PipelineMonitor`` is a pymongo command listener. It follows every
+aggregate command it is told to watch through the getMore commands that
+fetch the rest of its results, and adds up per pipeline fingerprint:
+
+* round trips, the aggregate plus each getMore
+* the size of every batch and the bytes received
+* time to first document, from sending the aggregate to the first
+  non-empty batch
+* wall time, from sending the aggregate until the cursor is exhausted
+  or killed
+
+    monitor = PipelineMonitor()
+    client = pymongo.MongoClient(event_listeners=[monitor])
+    cursor = pipeline.aggregate(client.db.coll, monitor=monitor)
+    CursorIterator(cursor, monitor=monitor).print()
+    monitor.stats[pipeline.freeze().fingerprint].round_trips
+
+A pipeline is identified by the sha256 of its encoded stages, the same
+value as ``FrozenPipeline.fingerprint``. Bytes received are measured by
+re-encoding each reply, which is why monitoring is opt-in.
+"""
+import hashlib
+import threading
+import time
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from pymongo import monitoring
+
+
+def command_fingerprint(command, codec_options=DEFAULT_CODEC_OPTIONS):
+    digest = hashlib.sha256()
+    for stage in command.get("pipeline", []):
+        digest.update(stage.raw if hasattr(stage, "raw") else bson.encode(stage, codec_options=codec_options))
+    return digest.hexdigest()
+
+
+def _reply_size(reply):
+    return len(reply.raw) if hasattr(reply, "raw") else len(bson.encode(reply))
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+class PipelineRecord:
+    """
+    The totals for one pipeline fingerprint.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.runs = 0
+        self.failures = 0
+        self.round_trips = 0
+        self.bytes_received = 0
+        self.batch_sizes = []
+        self.first_doc_times = []
+        self.wall_times = []
+
+    @property
+    def documents(self):
+        return sum(self.batch_sizes)
+
+    @property
+    def mean_batch_size(self):
+        return _mean(self.batch_sizes)
+
+    @property
+    def mean_time_to_first_doc(self):
+        return _mean(self.first_doc_times)
+
+    @property
+    def mean_wall_time(self):
+        return _mean(self.wall_times)
+
+    def as_dict(self):
+        return {"fingerprint": self.fingerprint,
+                "runs": self.runs,
+                "failures": self.failures,
+                "round_trips": self.round_trips,
+                "documents": self.documents,
+                "bytes_received": self.bytes_received,
+                "mean_batch_size": self.mean_batch_size,
+                "mean_time_to_first_doc": self.mean_time_to_first_doc,
+                "mean_wall_time": self.mean_wall_time}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.as_dict()!r})"
+
+
+class PipelineStats:
+    """
+    PipelineRecords keyed by fingerprint.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def record(self, fingerprint):
+        with self._lock:
+            record = self._records.get(fingerprint)
+            if record is None:
+                record = self._records[fingerprint] = PipelineRecord(fingerprint)
+            return record
+
+    def get(self, fingerprint, default=None):
+        return self._records.get(fingerprint, default)
+
+    def __getitem__(self, fingerprint):
+        return self._records[fingerprint]
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    def fingerprints(self):
+        return list(self._records)
+
+    def top(self, n=10, by="round_trips"):
+        """
+        The ``n`` records with the largest value of the attribute ``by``,
+        e.g. "round_trips", "bytes_received" or "mean_wall_time".
+        """
+        return sorted(self, key=lambda r: getattr(r, by) or 0, reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+
+
+class _Run:
+
+    def __init__(self, record, start):
+        self.record = record
+        self.start = start
+        self.first_doc = None
+        self.cursor = None
+
+
+class PipelineMonitor(monitoring.CommandListener):
+    """
+    Command listener filling a PipelineStats. Only pipelines passed to
+    ``expect`` are recorded unless ``record_all`` is set.
+    """
+
+    def __init__(self, stats=None, record_all=False):
+        self._stats = stats if stats is not None else PipelineStats()
+        self._record_all = record_all
+        self._expected = set()
+        self._requests = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def expect(self, fingerprint):
+        with self._lock:
+            self._expected.add(fingerprint)
+
+    def last_fingerprint(self):
+        """
+        The fingerprint of the last recorded aggregate sent from this
+        thread.
+        """
+        return getattr(self._local, "fingerprint", None)
+
+    def _finish(self, run, now):
+        if run.cursor is not None:
+            self._cursors.pop(run.cursor, None)
+        run.record.wall_times.append(now - run.start)
+
+    def _batch(self, run, batch, reply, now):
+        record = run.record
+        record.round_trips = record.round_trips + 1
+        record.batch_sizes.append(len(batch))
+        record.bytes_received = record.bytes_received + _reply_size(reply)
+        if batch and run.first_doc is None:
+            run.first_doc = now - run.start
+            record.first_doc_times.append(run.first_doc)
+
+    def started(self, event):
+        now = time.monotonic()
+        if event.command_name == "aggregate":
+            fingerprint = command_fingerprint(event.command)
+            if not self._record_all and fingerprint not in self._expected:
+                return
+            self._local.fingerprint = fingerprint
+            with self._lock:
+                record = self._stats.record(fingerprint)
+                record.runs = record.runs + 1
+                self._requests[event.request_id] = _Run(record, now)
+        elif event.command_name == "getMore":
+            with self._lock:
+                run = self._cursors.get((event.connection_id, event.command["getMore"]))
+                if run is not None:
+                    self._requests[event.request_id] = run
+        elif event.command_name == "killCursors":
+            with self._lock:
+                for cursor_id in event.command["cursors"]:
+                    run = self._cursors.get((event.connection_id, cursor_id))
+                    if run is not None:
+                        self._finish(run, now)
+
+    def succeeded(self, event):
+        now = time.monotonic()
+        with self._lock:
+            run = self._requests.pop(event.request_id, None)
+            if run is None:
+                return
+            cursor = event.reply.get("cursor", {})
+            batch = cursor.get("firstBatch" if event.command_name == "aggregate" else "nextBatch", [])
+            self._batch(run, batch, event.reply, now)
+            if cursor.get("id", 0):
+                run.cursor = (event.connection_id, cursor["id"])
+                self._cursors[run.cursor] = run
+            else:
+                self._finish(run, now)
+
+    def failed(self, event):
+        now = time.monotonic()
+        with self._lock:
+            run = self._requests.pop(event.request_id, None)
+            if run is None:
+                return
+            run.record.failures = run.record.failures + 1
+            run.record.round_trips = run.record.round_trips + 1
+            self._finish(run, now)
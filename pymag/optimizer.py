@@ -0,0 +1,252 @@
+"""
+Rule based rewriting of a list of pymag stages.
+
+Pipelines assembled from reusable pieces often filter after expensive
+stages or repeat $skip/$limit stages. ``optimize`` applies these rules
+until none of them changes the pipeline:
+
+* adjacent $match stages are merged and empty $match stages dropped
+* a $match is moved ahead of $project, $addFields, $set, $unwind and
+  $sort when its filter does not use a field those stages compute
+* a $limit is moved ahead of one-to-one stages so that it ends up
+  directly after a $sort, which the local executor runs as a top-k
+* consecutive $skip and consecutive $limit stages are collapsed and
+  $skip + $limit becomes $limit + $skip so the limit reaches the sort
+
+Stage objects are never modified, rewritten stages are new objects so
+shared pipeline pieces are left alone. Every rewrite is recorded in an
+``OptimizerReport``.
+"""
+from collections import namedtuple
+
+from pymag.stages import match, limit, skip
+
+Rewrite = namedtuple("Rewrite", ["rule", "position", "detail"])
+
+
+class OptimizerReport:
+    """
+    The list of rewrites made by ``optimize``.
+    """
+
+    def __init__(self):
+        self._rewrites = []
+
+    def add(self, rule, position, detail):
+        self._rewrites.append(Rewrite(rule, position, detail))
+
+    @property
+    def rewrites(self):
+        return list(self._rewrites)
+
+    def rules(self):
+        return [r.rule for r in self._rewrites]
+
+    def __len__(self):
+        return len(self._rewrites)
+
+    def __iter__(self):
+        return iter(self._rewrites)
+
+    def __bool__(self):
+        return len(self._rewrites) > 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._rewrites!r})"
+
+    def __str__(self):
+        if not self._rewrites:
+            return "no rewrites"
+        return "\n".join(f"{r.position}: {r.rule}: {r.detail}" for r in self._rewrites)
+
+
+ONE_TO_ONE = ("$project", "$addFields", "$set", "$replaceRoot", "$replaceWith")
+
+
+def _overlaps(a, b):
+    """
+    True if dotted paths ``a`` and ``b`` are the same field or one
+    contains the other.
+    """
+    return a == b or a.startswith(b + ".") or b.startswith(a + ".")
+
+
+def filter_fields(query):
+    """
+    Return the set of field paths used by a query filter, or None if the
+    filter uses an operator such as $expr or $where whose fields cannot
+    be determined.
+    """
+    fields = set()
+    for field, condition in query.items():
+        if field in ("$and", "$or", "$nor"):
+            for clause in condition:
+                clause_fields = filter_fields(clause)
+                if clause_fields is None:
+                    return None
+                fields |= clause_fields
+        elif field.startswith("$"):
+            return None
+        else:
+            fields.add(field)
+    return fields
+
+
+def _flatten(spec, prefix=""):
+    for field, value in spec.items():
+        if isinstance(value, dict) and value and not next(iter(value)).startswith("$"):
+            yield from _flatten(value, f"{prefix}{field}.")
+        else:
+            yield f"{prefix}{field}", value
+
+
+def _passes_project(fields, spec):
+    """
+    Can a filter on ``fields`` be evaluated before this projection and
+    give the same answer as after it.
+    """
+    included = []
+    excluded = []
+    computed = []
+    include_id = True
+    for field, value in _flatten(spec):
+        if isinstance(value, (bool, int, float)):
+            if field == "_id":
+                include_id = bool(value)
+            elif value:
+                included.append(field)
+            else:
+                excluded.append(field)
+        else:
+            computed.append(field)
+
+    if not include_id:
+        excluded.append("_id")
+    elif included or computed:
+        included.append("_id")
+
+    for f in fields:
+        if any(_overlaps(f, c) for c in computed):
+            return False
+        if any(_overlaps(f, e) for e in excluded):
+            return False
+        if (included or computed) and not any(f == i or f.startswith(i + ".") for i in included):
+            return False
+    return True
+
+
+def _passes(fields, stage):
+    if stage.op_name in ("$addFields", "$set"):
+        return not any(_overlaps(f, c) for f in fields for c in stage.arg)
+    if stage.op_name == "$project":
+        return _passes_project(fields, stage.arg)
+    if stage.op_name == "$unwind":
+        arg = stage.arg if isinstance(stage.arg, dict) else {"path": stage.arg}
+        touched = [arg.get("path", "$")[1:]]
+        if arg.get("includeArrayIndex"):
+            touched.append(arg["includeArrayIndex"])
+        return not any(_overlaps(f, t) for f in fields for t in touched)
+    if stage.op_name == "$sort":
+        return True
+    return False
+
+
+def _merge_filters(a, b):
+    if not a:
+        return b
+    if not b:
+        return a
+    if set(a).isdisjoint(b):
+        return {**a, **b}
+    return {"$and": [a, b]}
+
+
+def _merge_matches(stages, report):
+    for i in range(len(stages) - 1):
+        first, second = stages[i], stages[i + 1]
+        if first.op_name == "$match" and second.op_name == "$match":
+            stages[i:i + 2] = [match(_merge_filters(first.arg, second.arg))]
+            report.add("merge_match", i, f"{first!r} and {second!r} merged")
+            return True
+    return False
+
+
+def _drop_empty_matches(stages, report):
+    for i, stage in enumerate(stages):
+        if stage.op_name == "$match" and not stage.arg:
+            del stages[i]
+            report.add("drop_empty_match", i, f"{stage!r} removed")
+            return True
+    return False
+
+
+def _push_matches(stages, report):
+    for i in range(1, len(stages)):
+        before, stage = stages[i - 1], stages[i]
+        if stage.op_name != "$match":
+            continue
+        fields = filter_fields(stage.arg)
+        if fields is not None and _passes(fields, before):
+            stages[i - 1:i + 1] = [stage, before]
+            report.add("move_match", i - 1, f"{stage!r} moved ahead of {before.name}")
+            return True
+    return False
+
+
+def _push_limits(stages, report):
+    for i in range(1, len(stages)):
+        before, stage = stages[i - 1], stages[i]
+        if stage.op_name == "$limit" and before.op_name in ONE_TO_ONE:
+            stages[i - 1:i + 1] = [stage, before]
+            report.add("move_limit", i - 1, f"{stage!r} moved ahead of {before.name}")
+            return True
+    return False
+
+
+def _collapse_skip_limit(stages, report):
+    for i in range(len(stages) - 1):
+        first, second = stages[i], stages[i + 1]
+        if first.op_name == "$skip" and second.op_name == "$skip":
+            stages[i:i + 2] = [skip(first.arg + second.arg)]
+            report.add("collapse_skip", i, f"{first!r} and {second!r} collapsed")
+            return True
+        if first.op_name == "$limit" and second.op_name == "$limit":
+            stages[i:i + 2] = [limit(min(first.arg, second.arg))]
+            report.add("collapse_limit", i, f"{first!r} and {second!r} collapsed")
+            return True
+        if first.op_name == "$skip" and second.op_name == "$limit":
+            stages[i:i + 2] = [limit(first.arg + second.arg), first]
+            report.add("limit_before_skip", i, f"{first!r} {second!r} rewritten as "
+                                               f"limit({first.arg + second.arg}) {first!r}")
+            return True
+    return False
+
+
+def _report_top_k(stages, report):
+    for i in range(len(stages) - 1):
+        if stages[i].op_name == "$sort" and stages[i + 1].op_name == "$limit":
+            report.add("top_k", i, f"{stages[i]!r} and {stages[i + 1]!r} run as a top-{stages[i + 1].arg}")
+
+
+RULES = [_drop_empty_matches,
+         _merge_matches,
+         _push_matches,
+         _collapse_skip_limit,
+         _push_limits]
+
+
+def optimize(stages, max_passes=1000):
+    """
+    Optimize a sequence of stages.
+
+    :param stages: a Pipeline, Aggregation or list of AggStage objects
+    :param max_passes: upper bound on the number of rewrites
+    :return: (list of stages, OptimizerReport)
+    """
+    stages = list(stages)
+    report = OptimizerReport()
+    for _ in range(max_passes):
+        if not any(rule(stages, report) for rule in RULES):
+            break
+    _report_top_k(stages, report)
+    return stages, report
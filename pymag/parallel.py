@@ -0,0 +1,148 @@
+"""
+Run a pipeline as several slices in parallel.
+
+A pipeline whose first stage is a range filter, as built by
+``match.range_query`` or ``BoolStage.time_range_query``, can be split
+into N pipelines over consecutive sub-ranges. Each slice runs in its own
+thread with its own cursor so the server works on all of them at once.
+If the pipeline has a $group the partial groups from each slice are
+re-reduced on the client, which needs associative accumulators ($sum,
+$count, $min, $max). Stages after the $group run in process on the
+merged result.
+
+    runner = PartitionedAggregation(pipeline, partitions=8)
+    results = runner.aggregate(attendees)
+"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymag.executor import LocalExecutor
+from pymag.pipeline import Pipeline
+from pymag.reducer import GroupReducer
+from pymag.stages import match
+
+LOWER = ("$gte", "$gt")
+UPPER = ("$lte", "$lt")
+
+PER_DOCUMENT = ("$match", "$project", "$addFields", "$set", "$unwind", "$replaceRoot", "$replaceWith")
+
+
+def split_range(start, end, partitions):
+    """
+    Split [start, end] into at most ``partitions`` consecutive ranges.
+    Works for datetimes, ints and floats. Returns the list of boundaries,
+    from ``start`` to ``end`` inclusive.
+    """
+    if type(partitions) is not int or partitions < 1:
+        raise ValueError(f"partitions {partitions} must be a positive int")
+    if not _same_kind(start, end):
+        raise ValueError(f"range bounds {start!r} and {end!r} must be the same type")
+    if not start < end:
+        return [start, end]
+
+    if isinstance(start, datetime):
+        step = (end - start) / partitions
+        bounds = [start + step * i for i in range(partitions)]
+    elif isinstance(start, int):
+        bounds = [start + (end - start) * i // partitions for i in range(partitions)]
+    elif isinstance(start, float):
+        bounds = [start + (end - start) * i / partitions for i in range(partitions)]
+    else:
+        raise ValueError(f"cannot split a range of {type(start).__name__}")
+
+    bounds.append(end)
+    return [b for i, b in enumerate(bounds) if i == 0 or b != bounds[i - 1]]
+
+
+def _same_kind(a, b):
+    if isinstance(a, datetime) or isinstance(b, datetime):
+        return isinstance(a, datetime) and isinstance(b, datetime)
+    return isinstance(a, (int, float)) and isinstance(b, (int, float))
+
+
+def _range_condition(query):
+    """
+    Find the field in ``query`` that has both a lower and an upper bound.
+    """
+    for field, condition in query.items():
+        if field.startswith("$") or not isinstance(condition, dict):
+            continue
+        lower = [op for op in LOWER if op in condition]
+        upper = [op for op in UPPER if op in condition]
+        if len(lower) == 1 and len(upper) == 1 and len(condition) == 2:
+            return field, lower[0], upper[0]
+    raise ValueError(f"{query} has no field with both a lower and an upper bound")
+
+
+class PartitionedAggregation:
+    """
+    Split a range-filtered pipeline into slices and run them on a thread
+    pool.
+    """
+
+    def __init__(self, pipeline, partitions=4, workers=None):
+        stages = list(pipeline)
+        if not stages or stages[0].op_name != "$match":
+            raise ValueError("the first stage of a partitioned pipeline must be a range match")
+
+        self._query = stages[0].arg
+        self._field, self._lower_op, self._upper_op = _range_condition(self._query)
+        condition = self._query[self._field]
+        self._bounds = split_range(condition[self._lower_op], condition[self._upper_op], partitions)
+        self._workers = workers or len(self._bounds) - 1
+
+        rest = stages[1:]
+        group_at = next((i for i, s in enumerate(rest) if s.op_name == "$group"), None)
+        if group_at is None:
+            self._per_slice, self._reducer, self._post = rest, None, []
+        else:
+            self._per_slice = rest[:group_at + 1]
+            self._reducer = GroupReducer(rest[group_at])
+            self._post = rest[group_at + 1:]
+
+        before_group = self._per_slice[:-1] if self._reducer else self._per_slice
+        for stage in before_group:
+            if stage.op_name not in PER_DOCUMENT:
+                raise ValueError(f"{stage.name} cannot run on a slice of the range, "
+                                 f"only {', '.join(PER_DOCUMENT)} may come before the $group")
+        self._post_executor = LocalExecutor(self._post)
+
+    @property
+    def field(self):
+        return self._field
+
+    @property
+    def bounds(self):
+        return list(self._bounds)
+
+    def slices(self):
+        """
+        The pipelines run for each sub-range. Interior boundaries use
+        $gte/$lt so every document falls in exactly one slice.
+        """
+        pipelines = []
+        last = len(self._bounds) - 2
+        for i, (lo, hi) in enumerate(zip(self._bounds, self._bounds[1:])):
+            condition = {self._lower_op if i == 0 else "$gte": lo,
+                         self._upper_op if i == last else "$lt": hi}
+            query = dict(self._query)
+            query[self._field] = condition
+            pipelines.append(Pipeline([match(query)] + self._per_slice))
+        return pipelines
+
+    def _run_slice(self, collection, pipeline):
+        return list(pipeline.aggregate(collection))
+
+    def aggregate(self, collection):
+        """
+        Run every slice on ``collection`` and return the merged results as
+        a list.
+        """
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            partials = list(pool.map(lambda p: self._run_slice(collection, p), self.slices()))
+
+        results = itertools.chain.from_iterable(partials)
+        if self._reducer:
+            results = self._reducer.merge(results)
+        return list(self._post_executor.run(results))
@@ -1,13 +1,105 @@
 
+import hashlib
+
 import pymag
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from pymag.aggregation import PrefetchIterator
+from pymag.aio import AsyncBatchIterator
+from pymag.executor import LocalExecutor
+from pymag.explain import explain
+from pymag.monitoring import command_fingerprint
+from pymag.optimizer import optimize
 
 import pprint
 
+__all__ = ["Pipeline", "FrozenPipeline", "PipelineTemplate"]
+
+
+class FrozenPipeline:
+    """
+    An immutable, pre-encoded form of a Pipeline. Each stage is encoded
+    to BSON once and the RawBSONDocument objects are handed straight to
+    pymongo, which copies their bytes rather than encoding them again.
+    """
+
+    def __init__(self, stages, codec_options=DEFAULT_CODEC_OPTIONS):
+        self._stages = tuple(stages)
+        self._codec_options = codec_options
+        self._raw = tuple(s.raw(codec_options) for s in self._stages)
+        self._bson = None
+        self._fingerprint = None
+        self._str = None
+
+    @property
+    def stages(self):
+        return self._stages
+
+    @property
+    def codec_options(self):
+        return self._codec_options
+
+    @property
+    def raw_stages(self):
+        return self._raw
+
+    @property
+    def bson(self):
+        """
+        The encoded stages concatenated in pipeline order.
+        """
+        if self._bson is None:
+            self._bson = b"".join(r.raw for r in self._raw)
+        return self._bson
+
+    @property
+    def fingerprint(self):
+        """
+        A sha256 hex digest of the encoded pipeline.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self.bson).hexdigest()
+        return self._fingerprint
+
+    def is_current(self, stages, codec_options=DEFAULT_CODEC_OPTIONS):
+        """
+        True if this is still the encoding of ``stages``: the same stage
+        objects in the same order with none of them invalidated since.
+        """
+        if len(stages) != len(self._stages):
+            return False
+        if codec_options is not self._codec_options and codec_options != self._codec_options:
+            return False
+        for stage, frozen, raw in zip(stages, self._stages, self._raw):
+            if stage is not frozen or stage._raw is None or stage._raw[1] is not raw:
+                return False
+        return True
+
+    def __call__(self):
+        return list(self._raw)
+
+    def __len__(self):
+        return len(self._stages)
+
+    def __iter__(self):
+        return iter(self._stages)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}([" + ", ".join([repr(i) for i in self._stages]) + "])"
+
+    def __str__(self):
+        if self._str is None:
+            self._str = str([i() for i in self._stages])
+        return self._str
+
+    def aggregate(self, collection):
+        return collection.aggregate(self())
+
 
 class Pipeline(list):
 
     def __init__(self, seq=()):
         super().__init__(seq)
+        self._frozen = None
 
         for i, d in enumerate(self):
             if not isinstance(d, pymag.AggStage):
@@ -28,5 +120,195 @@ class Pipeline(list):
     def pp(self):
         return pprint.pprint(self)
 
-    def aggregate(self, collection):
-        return collection.aggregate(self())
+    def freeze(self, codec_options=DEFAULT_CODEC_OPTIONS):
+        """
+        Return a FrozenPipeline for the current stages. The frozen form
+        is cached and reused until a stage is added, removed, replaced or
+        invalidated.
+        """
+        if self._frozen is None or not self._frozen.is_current(self, codec_options):
+            self._frozen = FrozenPipeline(self, codec_options)
+        return self._frozen
+
+    def _encoded(self, collection, frozen):
+        """
+        The stages to send to the server. Unless ``frozen`` is True each
+        stage is encoded from its current argument, so changes made to an
+        argument in place are always sent.
+        """
+        if frozen:
+            return self.freeze(collection.codec_options)()
+        return self()
+
+    def aggregate(self, collection, monitor=None, frozen=False, **kwargs):
+        """
+        Run the pipeline on ``collection``. Pass a
+        ``pymag.monitoring.PipelineMonitor`` registered with the client as
+        ``monitor`` to record the round trips and transfer of this run.
+        With ``frozen=True`` the cached encoding from ``freeze`` is sent,
+        see FrozenPipeline.
+        """
+        pipeline = self._encoded(collection, frozen)
+        if monitor is not None:
+            monitor.expect(command_fingerprint({"pipeline": pipeline}, collection.codec_options))
+        return collection.aggregate(pipeline, **kwargs)
+
+    def aggregate_cached(self, collection, cache, ttl=None):
+        """
+        Run the pipeline through a ``pymag.cache.PipelineCache`` and return
+        the results as a list. ``ttl`` overrides the cache's time to live.
+        """
+        return cache.aggregate(self, collection, ttl=ttl)
+
+    def aggregate_raw_batches(self, collection, frozen=False, **kwargs):
+        """
+        Run the pipeline returning a RawBatchCommandCursor whose items are
+        undecoded batches of BSON documents.
+        """
+        return collection.aggregate_raw_batches(self._encoded(collection, frozen), **kwargs)
+
+    def aggregate_async(self, collection, batch_size=100, frozen=False, **kwargs):
+        """
+        Run the pipeline on an async driver collection (e.g. Motor) and
+        return an async iterator of result batches.
+        """
+        return AsyncBatchIterator(collection, self._encoded(collection, frozen),
+                                  batch_size=batch_size, **kwargs)
+
+    def aggregate_prefetch(self, collection, batch_size=100, depth=2, frozen=False, **kwargs):
+        """
+        Run the pipeline returning a PrefetchIterator that fetches up to
+        ``depth`` batches of ``batch_size`` documents ahead on a
+        background thread.
+        """
+        cursor = collection.aggregate(self._encoded(collection, frozen), batchSize=batch_size, **kwargs)
+        return PrefetchIterator(cursor, batch_size=batch_size, depth=depth)
+
+    def aggregate_local(self, docs):
+        """
+        Run the pipeline in process over an iterable of dicts and return
+        a lazy iterator of the results.
+        """
+        return LocalExecutor(self).run(docs)
+
+    def explain(self, collection, verbosity="executionStats", max_ratio=10):
+        """
+        Run explain for the pipeline on ``collection`` and return an
+        ExplainSummary of each stage with any flagged problems.
+        """
+        return explain(self, collection, verbosity=verbosity, max_ratio=max_ratio)
+
+    def optimize(self):
+        """
+        Return an optimized copy of the pipeline and an OptimizerReport
+        listing the rewrites that were made.
+        """
+        stages, report = optimize(self)
+        return Pipeline(stages), report
+
+
+def _slots(value):
+    """
+    The tree of placeholder positions in ``value``: the placeholder name
+    for a Placeholder, a dict of key (or list index) to subtree for a
+    container holding placeholders and None otherwise.
+    """
+    if type(value) is pymag.Placeholder:
+        return value.name
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = enumerate(value)
+    else:
+        return None
+    tree = {}
+    for key, item in items:
+        sub = _slots(item)
+        if sub is not None:
+            tree[key] = sub
+    return tree or None
+
+
+def _names(tree):
+    if isinstance(tree, str):
+        yield tree
+    else:
+        for sub in tree.values():
+            yield from _names(sub)
+
+
+def _fill(value, tree, params):
+    if isinstance(tree, str):
+        return params[tree]
+    # copy only the containers on the way to a placeholder, everything
+    # else is shared with the template
+    value = list(value) if isinstance(value, tuple) else value.copy()
+    for key, sub in tree.items():
+        value[key] = _fill(value[key], sub, params)
+    return value
+
+
+class PipelineTemplate:
+    """
+    A pipeline with named placeholders that is analyzed once and then
+    bound to values for each run:
+
+        template = PipelineTemplate(Pipeline([match({"tenant": param("tenant")}),
+                                              limit(param("n"))]))
+        template.bind(tenant="t1", n=10)
+
+    Binding copies only the containers on the path to each placeholder
+    and does not validate the stages again. A placeholder that is the
+    whole argument of a stage, like the limit above, is validated when
+    it is bound. Stages without placeholders are shared by every bound
+    pipeline so their encoding is cached once; do not change them in
+    place.
+    """
+
+    def __init__(self, pipeline):
+        self._stages = tuple(pipeline)
+        self._slots = tuple(_slots(stage.arg) for stage in self._stages)
+        self._params = frozenset(name for tree in self._slots if tree is not None for name in _names(tree))
+
+    @property
+    def params(self):
+        return self._params
+
+    @property
+    def stages(self):
+        return self._stages
+
+    def _bind(self, params):
+        if params.keys() != self._params:
+            missing = ", ".join(sorted(self._params - params.keys()))
+            unknown = ", ".join(sorted(params.keys() - self._params))
+            raise ValueError(f"bind parameters do not match the template"
+                             f"{' missing: ' + missing if missing else ''}"
+                             f"{' unknown: ' + unknown if unknown else ''}")
+        stages = []
+        for stage, tree in zip(self._stages, self._slots):
+            if tree is None:
+                stages.append(stage)
+            elif isinstance(tree, str):
+                bound = stage._bound(params[tree])
+                bound.validate()
+                stages.append(bound)
+            else:
+                stages.append(stage._bound(_fill(stage.arg, tree, params)))
+        return stages
+
+    def bind(self, **params):
+        """
+        The Pipeline with every placeholder replaced by its value in
+        ``params``.
+        """
+        return Pipeline(self._bind(params))
+
+    def bind_frozen(self, codec_options=DEFAULT_CODEC_OPTIONS, **params):
+        """
+        The bound pipeline as a FrozenPipeline, ready to pass to pymongo.
+        """
+        return FrozenPipeline(self._bind(params), codec_options)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}([" + ", ".join([repr(i) for i in self._stages]) + "])"
@@ -0,0 +1,121 @@
+"""
+Combine partial results of a $group stage.
+
+When a $group runs over several slices of a collection, or over new
+documents that are merged into an earlier result, each partial result
+holds the accumulated value for its own documents. For associative
+accumulators those partial values can be reduced again to get the value
+for all the documents together.
+"""
+from pymag.documents import compare, _hashable
+
+
+def _sum(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def _min(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if compare(b, a) < 0 else a
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if compare(b, a) > 0 else a
+
+
+REDUCERS = {
+    "$sum": _sum,
+    "$count": _sum,
+    "$min": _min,
+    "$max": _max,
+}
+
+MERGE_OPERATORS = {
+    "$sum": "$add",
+    "$count": "$add",
+    "$min": "$min",
+    "$max": "$max",
+}
+
+
+class GroupReducer:
+    """
+    Re-reduce partial $group results. Only $sum, $count, $min and $max
+    accumulators can be re-reduced, any other accumulator raises a
+    ValueError.
+    """
+
+    def __init__(self, group_stage):
+        spec = group_stage.arg if hasattr(group_stage, "arg") else group_stage
+        if not isinstance(spec, dict) or "_id" not in spec:
+            raise ValueError(f"{group_stage!r} is not a group specification with an _id")
+        self._id = spec["_id"]
+        self._accumulators = []
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            if not isinstance(accumulator, dict) or len(accumulator) != 1:
+                raise ValueError(f"group field {field} must be a single accumulator e.g. {{'$sum': 1}}")
+            op_name, = accumulator.keys()
+            if op_name not in REDUCERS:
+                raise ValueError(f"{op_name} in group field {field} cannot be re-reduced")
+            self._accumulators.append((field, op_name))
+
+    @property
+    def group_id(self):
+        return self._id
+
+    @property
+    def accumulators(self):
+        return list(self._accumulators)
+
+    def fields(self):
+        return [field for field, _ in self._accumulators]
+
+    def combine(self, a, b):
+        """
+        Combine two partial results for the same group key into a new
+        document.
+        """
+        result = dict(a)
+        for field, op_name in self._accumulators:
+            result[field] = REDUCERS[op_name](a.get(field), b.get(field))
+        return result
+
+    def merge(self, partials):
+        """
+        Reduce an iterable of partial group documents to one document per
+        group key, in the order keys were first seen.
+        """
+        groups = {}
+        for doc in partials:
+            key = _hashable(doc.get("_id"))
+            current = groups.get(key)
+            groups[key] = doc if current is None else self.combine(current, doc)
+        return list(groups.values())
+
+    def merge_update(self, new="new"):
+        """
+        The update pipeline for a $merge ``whenMatched`` clause that folds
+        the incoming partial result (bound to ``$$<new>``) into the
+        existing document.
+        """
+        update = {}
+        for field, op_name in self._accumulators:
+            existing, incoming = f"${field}", f"$${new}.{field}"
+            if MERGE_OPERATORS[op_name] == "$add":
+                existing = {"$ifNull": [existing, 0]}
+                incoming = {"$ifNull": [incoming, 0]}
+            update[field] = {MERGE_OPERATORS[op_name]: [existing, incoming]}
+        return [{"$set": update}]
@@ -8,8 +8,9 @@ import pprint
 
 import argparse
 
-from pymongo_aggregation.aggoperation import project, limit, out
-from pymongo_aggregation.pipeline import Pipeline
+from pymag.stages import project, limit, out
+from pymag.pipeline import Pipeline
+from pymag.chunked import ChunkedMerge
 
 if __name__ == "__main__":
     # location: {
@@ -24,6 +25,13 @@ if __name__ == "__main__":
     parser.add_argument("--database", type=str, default="test", help="Database to use: [default: %(default)s]" )
     parser.add_argument("--collection", type=str, default="test", help="Collection to use: [default: %(default)s]" )
     parser.add_argument("--out", type=str, default="yellow_cabs", help="Default output collection [default: %(default)s]")
+    parser.add_argument("--chunked", action="store_true", default=False,
+                        help="Process the collection in resumable _id chunks merged into --out")
+    parser.add_argument("--chunks", type=int, default=256, help="Number of _id chunks [default: %(default)s]")
+    parser.add_argument("--workers", type=int, default=4, help="Chunks processed in parallel [default: %(default)s]")
+    parser.add_argument("--checkpoint", type=str, help="Checkpoint collection [default: <out>_checkpoint]")
+    parser.add_argument("--restart", action="store_true", default=False,
+                        help="Discard the checkpoint and process every chunk again")
 
     args = parser.parse_args()
 
@@ -58,15 +66,29 @@ if __name__ == "__main__":
                     "improvement_surcharge": 1,
                     "total_amount": 1 }
 
-    projector = project(point_mapper)
-    new_collection = out(args.out)
-
-    if args.limit and (args.limit > 0):
-        pipeline = Pipeline(projector, limit(args.limit), new_collection)
+    if args.chunked:
+        # keep _id so a chunk that is run again replaces its own documents
+        del point_mapper["_id"]
+        checkpoint = database[args.checkpoint or f"{args.out}_checkpoint"]
+        print('Using checkpoint        : {}'.format(checkpoint.name))
+        job = ChunkedMerge(collection, [project(point_mapper)], database[args.out],
+                           checkpoint, chunks=args.chunks)
+        if args.restart:
+            job.reset()
+        print("Processing {} of {} chunks".format(len(job.pending()), max(len(job.bounds()) - 1, 0)))
+        job.run(workers=args.workers,
+                progress=lambda chunk, finished, total: print(f"chunk {chunk} done ({finished}/{total})",
+                                                              flush=True))
     else:
-        pipeline = Pipeline(projector, new_collection)
+        projector = project(point_mapper)
+        new_collection = out(args.out)
+
+        if args.limit and (args.limit > 0):
+            pipeline = Pipeline([projector, limit(args.limit), new_collection])
+        else:
+            pipeline = Pipeline([projector, new_collection])
 
-    print( "Processing")
-    pprint.pprint(pipeline)
+        print( "Processing")
+        pprint.pprint(pipeline)
 
-    pipeline.aggregate(collection)
+        pipeline.aggregate(collection)
@@ -11,7 +11,40 @@ the correct name for the MongoDB Aggregation operation
 import datetime
 from collections import OrderedDict
 
+import bson
 import pymongo
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.raw_bson import RawBSONDocument
+
+from pymag.matcher import compile_filter
+
+
+class Placeholder:
+    """
+    A named slot in a stage argument that is filled in when a
+    ``PipelineTemplate`` is bound. Create them with ``param``.
+
+    >>> limit(param("n"))
+    limit(param('n'))
+    """
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name):
+        if type(name) is not str or not name:
+            raise ValueError(f"placeholder name {name!r} must be a non-empty str")
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def __repr__(self):
+        return f"param({self._name!r})"
+
+
+def param(name):
+    return Placeholder(name)
 
 
 class AggStage:
@@ -19,13 +52,61 @@ class AggStage:
     Super class for all Aggregation operations.
     Should not be instantiated directly. Use
     DocStage or ValueOperation
+
+    Stages use ``__slots__`` and the operator name is computed once per
+    class, so a stage instance only holds its argument and its cached
+    encoding.
+
+    The argument is validated when the stage is created. Set ``lazy``
+    to True on a stage class (or on AggStage for every stage) to defer
+    validation until the stage is first serialized.
     """
 
+    __slots__ = ("_arg", "_raw", "_valid")
+
+    _name = "AggStage"
+    _op_name = "$AggStage"
+    lazy = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "_op_name" not in cls.__dict__:
+            cls._name = cls.__name__
+            cls._op_name = f"${cls.__name__}"
+
     def __init__(self, arg=None):
-        super().__init__()
         self._arg = arg
-        self._name = self.__class__.__name__
-        self._op_name = f"${self._name}"
+        self._raw = None
+        self._valid = False
+        if not self.lazy:
+            self.check()
+
+    def validate(self):
+        """
+        Raise ValueError if the argument is not valid for this stage.
+        """
+        pass
+
+    def check(self):
+        """
+        Validate the argument once, until the next ``invalidate``. An
+        argument that is a Placeholder is checked when it is bound.
+        """
+        if not self._valid:
+            if type(self._arg) is not Placeholder:
+                self.validate()
+            self._valid = True
+
+    @classmethod
+    def _bound(cls, arg):
+        """
+        A stage of this class with ``arg`` taken as already validated.
+        """
+        stage = cls.__new__(cls)
+        stage._arg = arg
+        stage._raw = None
+        stage._valid = True
+        return stage
 
     @property
     def arg(self):
@@ -40,8 +121,28 @@ class AggStage:
         return self._op_name
 
     def __call__(self):
+        if not self._valid:
+            self.check()
         return {self._op_name: self._arg}
 
+    def raw(self, codec_options=DEFAULT_CODEC_OPTIONS):
+        """
+        The stage encoded as a RawBSONDocument. The encoding is cached
+        until ``invalidate`` is called so a stage that appears in many
+        runs is only encoded once.
+        """
+        if self._raw is None or (self._raw[0] is not codec_options and self._raw[0] != codec_options):
+            self._raw = (codec_options, RawBSONDocument(bson.encode(self(), codec_options=codec_options)))
+        return self._raw[1]
+
+    def invalidate(self):
+        """
+        Drop the cached encoding. Call this after changing the stage
+        argument in place.
+        """
+        self._raw = None
+        self._valid = False
+
     def __repr__(self):
         return f"{self.name}({self.arg!r})"
 
@@ -57,14 +158,14 @@ class DocStage(AggStage):
     e.g. { "$match" : { <match args> }}
     """
 
+    __slots__ = ()
+
     def __init__(self, arg=None):
-        super().__init__(arg)
-        if arg is None:
-            self._arg = {}
-        elif isinstance(arg, dict):
-            self._arg = arg
-        else:
-            raise ValueError(f'{arg} is not a dict object')
+        super().__init__({} if arg is None else arg)
+
+    def validate(self):
+        if not isinstance(self._arg, dict):
+            raise ValueError(f'{self._arg} is not a dict object')
 
 
 class PositiveIntStage(AggStage):
@@ -75,14 +176,17 @@ class PositiveIntStage(AggStage):
     e.g. { "$limit" : 30 }
     """
 
-    def __init__(self, arg):
-        if type(arg) is not int:
-            raise ValueError(f"arg {arg} to {self.__class__.__name__} must be an int")
-        if arg < 0:
-            raise ValueError(f"arg {arg} to {self.__class__.__name__} must be non-negative")
+    __slots__ = ()
 
+    def __init__(self, arg):
         super().__init__(arg)
 
+    def validate(self):
+        if type(self._arg) is not int:
+            raise ValueError(f"arg {self._arg} to {self.name} must be an int")
+        if self._arg < 0:
+            raise ValueError(f"arg {self._arg} to {self.name} must be non-negative")
+
 
 class StrStage(AggStage):
     """
@@ -92,10 +196,14 @@ class StrStage(AggStage):
     e.g. { "$out" : "data_collection" }
     """
 
+    __slots__ = ()
+
     def __init__(self, arg=""):
         super().__init__(arg)
-        if type(arg) is not str:
-            raise ValueError(f"parameter arg to {self.name}({arg}) must be a str")
+
+    def validate(self):
+        if type(self._arg) is not str:
+            raise ValueError(f"parameter arg to {self.name}({self._arg}) must be a str")
 
 
 class FloatStage(AggStage):
@@ -106,11 +214,15 @@ class FloatStage(AggStage):
     e.g. { "$limit" : 30 } or { "$out" : "data_collection" }
     """
 
+    __slots__ = ()
+
     def __init__(self, arg):
-        if type(arg) is not float:
-            raise ValueError(f"parameter arg to {self.__name__} ('{arg}') must be a float")
         super().__init__(arg)
 
+    def validate(self):
+        if type(self._arg) is not float:
+            raise ValueError(f"parameter arg to {self.name} ('{self._arg}') must be a float")
+
 
 class BoolStage(AggStage):
     """
@@ -119,11 +231,15 @@ class BoolStage(AggStage):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, arg):
-        if type(arg) is not bool:
-            raise ValueError(f"parameter arg to {self.__name__} ('{arg}') must be a bool")
         super().__init__(arg)
 
+    def validate(self):
+        if type(self._arg) is not bool:
+            raise ValueError(f"parameter arg to {self.name} ('{self._arg}') must be a bool")
+
     @staticmethod
     def time_range_query(date_field, start=None, end=None):
         if start is not None and not isinstance(start, datetime.datetime):
@@ -137,104 +253,120 @@ class addFields(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/addFields/
     """
-    pass
+
+    __slots__ = ()
 
 
 class bucket(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/bucket/
     """
-    pass
+
+    __slots__ = ()
 
 
 class bucketAuto(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/bucketAuto/
     """
-    pass
+
+    __slots__ = ()
 
 
 class collStats(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/collStats/
     """
-    pass
+
+    __slots__ = ()
 
 
 class count(StrStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/count/
     """
-    pass
+
+    __slots__ = ()
 
 
 class facet(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/facet/
     """
-    pass
+
+    __slots__ = ()
 
 
 class geoNear(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/geoNear/
     """
-    pass
+
+    __slots__ = ()
 
 
 class graphLookup(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/graphLookup/
     """
-    pass
+
+    __slots__ = ()
 
 
 class group(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/group/
     """
-    pass
+
+    __slots__ = ()
 
 
 class indexStats(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/indexStats/
     """
-    pass
+
+    __slots__ = ()
 
 
 class limit(PositiveIntStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/limit/
     """
-    pass
+
+    __slots__ = ()
 
 
 class listSessions(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/listSessions/
     """
-    pass
+
+    __slots__ = ()
 
 
 class listLocalSessions(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/listLocalSessions/
     """
-    pass
+
+    __slots__ = ()
 
 
 class lookup(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/lookup/
     """
-    pass
+
+    __slots__ = ()
 
 
 class match(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/match/
     """
+
+    __slots__ = ()
     @staticmethod
     def range_query(field, start=None, end=None):
 
@@ -248,12 +380,30 @@ class match(DocStage):
 
         return match(doc)
 
+    def compile(self):
+        """
+        Compile the filter into a predicate that can be used to filter
+        documents on the client.
+
+        >>> is_joe = match({"name": "Joe"}).compile()
+        >>> is_joe({"name": "Joe"})
+        True
+        """
+        return compile_filter(self._arg)
+
+    def filter(self, docs):
+        """
+        Lazily yield the documents in ``docs`` that match the filter.
+        """
+        return filter(self.compile(), docs)
+
 
 class merge(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/merge/
     """
-    pass
+
+    __slots__ = ()
 
 
 class out(StrStage):
@@ -261,8 +411,11 @@ class out(StrStage):
     https://docs.mongodb.com/manual/reference/operator/aggregation/out/
     """
 
-    def __init__(self, arg):
-        super().__init__(arg)
+    __slots__ = ()
+
+    def validate(self):
+        super().validate()
+        arg = self._arg
         if arg == "":
             raise ValueError("collection names cannot be any empty string")
         if '$' in arg:
@@ -275,56 +428,64 @@ class planCacheStats(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/planCacheStats/
     """
-    pass
+
+    __slots__ = ()
 
 
 class project(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/project/
     """
-    pass
+
+    __slots__ = ()
 
 
 class redact(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/redact/
     """
-    pass
+
+    __slots__ = ()
 
 
 class replaceRoot(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/replaceRoot/
     """
-    pass
+
+    __slots__ = ()
 
 
 class replaceWith(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/replaceWith/
     """
-    pass
+
+    __slots__ = ()
 
 
 class sample(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/sample/
     """
-    pass
+
+    __slots__ = ()
 
 
 class set(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/set/
     """
-    pass
+
+    __slots__ = ()
 
 
 class skip(PositiveIntStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/skip/
     """
-    pass
+
+    __slots__ = ()
 
 
 class sort(DocStage):
@@ -340,6 +501,8 @@ class sort(DocStage):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         """
         parameters are key="ascending" or key="descending"
@@ -347,21 +510,21 @@ class sort(DocStage):
         be a dotted string e.g. "group.name".
         """
 
-        self[self.op_name] = OrderedDict()
+        super().__init__(OrderedDict())
 
         self.add(*args, **kwargs)
 
     def add(self, *args, **kwargs):
         """
-        >>> sort("x")
+        >>> sort("x")()
         {'$sort': OrderedDict([('x', 1)])}
-        >>> sort(x=1)
+        >>> sort(x=1)()
         {'$sort': OrderedDict([('x', 1)])}
-        >>> sort(("x", 1))
+        >>> sort(("x", 1))()
         {'$sort': OrderedDict([('x', 1)])}
-        >>> sort(x=pymongo.DESCENDING)
+        >>> sort(x=pymongo.DESCENDING)()
         {'$sort': OrderedDict([('x', -1)])}
-        >>> sort(x=pymongo.ASCENDING)
+        >>> sort(x=pymongo.ASCENDING)()
         {'$sort': OrderedDict([('x', 1)])}
 
         >>> sort( x=2)
@@ -388,17 +551,18 @@ class sort(DocStage):
                 raise ValueError(f"{v} is not equal to pymongo.ASCENDING or pymongo.DESCENDING")
 
     def sort_fields(self):
-        return self[self.op_name].keys()
+        return self._arg.keys()
 
     def sort_items(self):
-        return self[self.op_name].items()
+        return self._arg.items()
 
     def sort_directions(self):
-        return self[self.op_name].values()
+        return self._arg.values()
 
     def add_sort(self, field, sort_order=pymongo.ASCENDING):
         if sort_order in [pymongo.ASCENDING, pymongo.DESCENDING]:
-            self[self.op_name][field] = sort_order
+            self._arg[field] = sort_order
+            self.invalidate()
         else:
             raise ValueError("Invalid sort order must be pymongo.ASCENDING or pymongo.DESCENDING")
 
@@ -407,21 +571,24 @@ class sortByCount(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/sortByCount/
     """
-    pass
+
+    __slots__ = ()
 
 
 class unionWith(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/unionWith/
     """
-    pass
+
+    __slots__ = ()
 
 
 class unset(DocStage):
     """
     https://docs.mongodb.com/manual/reference/operator/aggregation/unset/
     """
-    pass
+
+    __slots__ = ()
 
 
 
@@ -440,17 +607,21 @@ class unset(DocStage):
 
 class Example_for_Sample_Op_with_name(DocStage):
 
-    def __init__(self, arg=None):
-        super().__init__(arg)
-        self._op_name = "$sample"
+    __slots__ = ()
 
-    @property
-    def name(self):
-        return "sample"
+    _name = "sample"
+    _op_name = "$sample"
 
 
 class unwind(DocStage):
-    pass
+
+    __slots__ = ()
+
+
+# only the stages and the placeholders are exported by "from pymag import *"
+__all__ = ["Placeholder", "param"] + [name for name, value in list(globals().items())
+                                      if isinstance(value, type) and issubclass(value, AggStage)]
+
 
 if __name__ == "__main__":
     import doctest
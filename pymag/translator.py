@@ -0,0 +1,382 @@
+"""
+Translate simple Python functions into native aggregation expressions.
+
+``JSCode`` turns a Python function into server side JavaScript for a
+$function operator. JavaScript runs much slower than native operators
+and stops the server using the slot based execution engine, yet most
+helpers are a single expression over a few fields. ``translate`` reads
+the function's AST and builds the equivalent operator tree:
+
+    def full_name(first, last):
+        return first.upper() + " " + last
+
+    translate(full_name, "name.first", "name.last")
+    {'$concat': [{'$toUpper': '$name.first'}, ' ', '$name.last']}
+
+Each parameter stands for the field of the same name, or for the field
+passed in the same position, as with ``JSCode``. The body may assign
+local names, use if/else and return expressions built from arithmetic,
+comparisons, boolean operators, conditional expressions, f-strings,
+string methods, a few builtins and field access with ``.`` or ``[]``.
+``and``/``or`` become $and/$or so they yield booleans rather than one of
+their operands. ``%``, ``in``, ``len`` and comparisons with None are
+written to give Python's result. ``+`` needs one side known to be a
+number, string or list, since $add fails where Python concatenates.
+
+``to_expression`` returns the native form when the function can be
+translated and falls back to ``$function`` with ``JSCode`` otherwise.
+"""
+import ast
+import inspect
+import textwrap
+
+from pymag.jscode import JSCode
+from pymag.operators import function
+
+STR = "str"
+NUMBER = "number"
+LIST = "list"
+
+BINARY_OPERATORS = {
+    ast.Add: "$add",
+    ast.Sub: "$subtract",
+    ast.Mult: "$multiply",
+    ast.Div: "$divide",
+    ast.Pow: "$pow",
+}
+
+COMPARISONS = {
+    ast.Eq: "$eq",
+    ast.NotEq: "$ne",
+    ast.Lt: "$lt",
+    ast.LtE: "$lte",
+    ast.Gt: "$gt",
+    ast.GtE: "$gte",
+}
+
+# a missing field is below null in the server's order, so these match a
+# missing field as well as null, as Python sees None for both
+NONE_COMPARISONS = {
+    ast.Eq: "$lte",
+    ast.Is: "$lte",
+    ast.NotEq: "$gt",
+    ast.IsNot: "$gt",
+}
+
+STRING_METHODS = {
+    "upper": lambda s: {"$toUpper": s},
+    "lower": lambda s: {"$toLower": s},
+    "strip": lambda s, chars=None: _trim("$trim", s, chars),
+    "lstrip": lambda s, chars=None: _trim("$ltrim", s, chars),
+    "rstrip": lambda s, chars=None: _trim("$rtrim", s, chars),
+    "split": lambda s, sep: {"$split": [s, sep]},
+    "replace": lambda s, old, new: {"$replaceAll": {"input": s, "find": old, "replacement": new}},
+    "startswith": lambda s, prefix: {"$eq": [{"$indexOfCP": [s, prefix]}, 0]},
+    "find": lambda s, sub: {"$indexOfCP": [s, sub]},
+}
+
+STRING_RESULTS = ("upper", "lower", "strip", "lstrip", "rstrip", "replace")
+
+BUILTINS = {
+    "abs": lambda x: {"$abs": x},
+    "round": lambda x, places=0: {"$round": [x, places]},
+    "min": lambda *xs: {"$min": list(xs)},
+    "max": lambda *xs: {"$max": list(xs)},
+    "str": lambda x: {"$toString": x},
+    "int": lambda x: {"$toInt": x},
+    "float": lambda x: {"$toDouble": x},
+    "bool": lambda x: {"$toBool": x},
+}
+
+BUILTIN_RESULTS = {"abs": NUMBER, "round": NUMBER, "str": STR, "int": NUMBER, "float": NUMBER}
+
+
+def _trim(op_name, s, chars):
+    spec = {"input": s}
+    if chars is not None:
+        spec["chars"] = chars
+    return {op_name: spec}
+
+
+def _by_type(value, array, string, obj):
+    """
+    Choose between expressions on the BSON type of ``value``, for Python
+    operations that work on lists, strings and dicts alike. Any other
+    type matches no branch, so the server raises an error as Python
+    would.
+    """
+    return {"$switch": {"branches": [
+        {"case": {"$isArray": value}, "then": array},
+        {"case": {"$eq": [{"$type": value}, "string"]}, "then": string},
+        {"case": {"$eq": [{"$type": value}, "object"]}, "then": obj},
+    ]}}
+
+
+def _keys(obj):
+    return {"$map": {"input": {"$objectToArray": obj}, "in": "$$this.k"}}
+
+
+def _contains(container, kind, item):
+    """
+    The expression for ``item in container``.
+    """
+    in_string = {"$gte": [{"$indexOfCP": [container, item]}, 0]}
+    if kind == STR:
+        return in_string
+    if kind == LIST:
+        return {"$in": [item, container]}
+    return _by_type(container, {"$in": [item, container]}, in_string, {"$in": [item, _keys(container)]})
+
+
+class _Translator:
+    """
+    Walks a function body keeping the expression bound to each name and
+    whether an expression is known to produce a string.
+    """
+
+    def __init__(self, fields):
+        self._names = {name: (f"${field}", None) for name, field in fields.items()}
+
+    def fail(self, node, reason="is not supported"):
+        raise ValueError(f"line {getattr(node, 'lineno', '?')}: {type(node).__name__} {reason}")
+
+    #
+    # statements
+    #
+
+    def body(self, statements):
+        """
+        Translate a block that must end by returning a value.
+        """
+        for i, statement in enumerate(statements):
+            rest = statements[i + 1:]
+            if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant) \
+                    and isinstance(statement.value.value, str):
+                continue
+            if isinstance(statement, ast.Pass):
+                continue
+            if isinstance(statement, ast.Return):
+                if statement.value is None:
+                    return None, None
+                return self.expr(statement.value)
+            if isinstance(statement, ast.Assign):
+                if len(statement.targets) != 1 or not isinstance(statement.targets[0], ast.Name):
+                    self.fail(statement, "to anything but a single name is not supported")
+                self._names[statement.targets[0].id] = self.expr(statement.value)
+                continue
+            if isinstance(statement, ast.If):
+                test, _ = self.expr(statement.test)
+                saved = dict(self._names)
+                then, then_kind = self.body(statement.body)
+                self._names = dict(saved)
+                otherwise, else_kind = self.body(statement.orelse + rest)
+                self._names = saved
+                return {"$cond": [test, then, otherwise]}, then_kind if then_kind == else_kind else None
+            self.fail(statement)
+        self.fail(statements[-1] if statements else ast.Pass(), "block does not return a value")
+
+    #
+    # expressions
+    #
+
+    def expr(self, node):
+        method = getattr(self, f"_{type(node).__name__}", None)
+        if method is None:
+            self.fail(node)
+        return method(node)
+
+    def _Constant(self, node):
+        value = node.value
+        if isinstance(value, str):
+            return ({"$literal": value} if value.startswith("$") else value), STR
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value, NUMBER
+        if value is None or isinstance(value, bool):
+            return value, None
+        self.fail(node, f"constant {value!r} is not supported")
+
+    def _Name(self, node):
+        try:
+            return self._names[node.id]
+        except KeyError:
+            self.fail(node, f"{node.id} is not a parameter or a local name")
+
+    def _List(self, node):
+        return [self.expr(e)[0] for e in node.elts], LIST
+
+    _Tuple = _List
+
+    def _path(self, node, value, key):
+        if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+            return f"{value}.{key}", None
+        return {"$getField": {"field": key, "input": value}}, None
+
+    def _Attribute(self, node):
+        value, _ = self.expr(node.value)
+        return self._path(node, value, node.attr)
+
+    def _Subscript(self, node):
+        value, _ = self.expr(node.value)
+        index = node.slice
+        if isinstance(index, ast.Constant) and isinstance(index.value, str):
+            return self._path(node, value, index.value)
+        if isinstance(index, ast.Slice):
+            self.fail(node, "slices are not supported")
+        position, _ = self.expr(index)
+        return {"$arrayElemAt": [value, position]}, None
+
+    def _BinOp(self, node):
+        lhs, lhs_kind = self.expr(node.left)
+        rhs, rhs_kind = self.expr(node.right)
+        if isinstance(node.op, ast.Add) and STR in (lhs_kind, rhs_kind):
+            parts = []
+            for part in (lhs, rhs):
+                if isinstance(part, dict) and list(part) == ["$concat"]:
+                    parts.extend(part["$concat"])
+                else:
+                    parts.append(part)
+            return {"$concat": parts}, STR
+        if isinstance(node.op, ast.Add) and lhs_kind == rhs_kind == LIST:
+            return {"$concatArrays": [lhs, rhs]}, LIST
+        if isinstance(node.op, ast.Add) and NUMBER not in (lhs_kind, rhs_kind):
+            # $add fails on strings and lists where Python concatenates
+            self.fail(node, "of two values of unknown type is not supported")
+        if STR in (lhs_kind, rhs_kind) or LIST in (lhs_kind, rhs_kind):
+            self.fail(node, f"operator {type(node.op).__name__} on a string or list is not supported")
+        if isinstance(node.op, ast.FloorDiv):
+            return {"$floor": {"$divide": [lhs, rhs]}}, NUMBER
+        if isinstance(node.op, ast.Mod):
+            # $mod truncates, taking the sign of the dividend, where
+            # Python's % takes the sign of the divisor
+            return {"$mod": [{"$add": [{"$mod": [lhs, rhs]}, rhs]}, rhs]}, NUMBER
+        try:
+            op_name = BINARY_OPERATORS[type(node.op)]
+        except KeyError:
+            self.fail(node, f"operator {type(node.op).__name__} is not supported")
+        return {op_name: [lhs, rhs]}, NUMBER
+
+    def _UnaryOp(self, node):
+        operand, kind = self.expr(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return operand, kind
+        if isinstance(node.op, ast.USub):
+            if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+                return -operand, NUMBER
+            return {"$multiply": [-1, operand]}, NUMBER
+        if isinstance(node.op, ast.Not):
+            return {"$not": [operand]}, None
+        self.fail(node, f"operator {type(node.op).__name__} is not supported")
+
+    def _BoolOp(self, node):
+        op_name = "$and" if isinstance(node.op, ast.And) else "$or"
+        return {op_name: [self.expr(v)[0] for v in node.values]}, None
+
+    def _Compare(self, node):
+        clauses = []
+        lhs, _ = self.expr(node.left)
+        for op, right in zip(node.ops, node.comparators):
+            rhs, rhs_kind = self.expr(right)
+            if isinstance(op, ast.In):
+                clauses.append(_contains(rhs, rhs_kind, lhs))
+            elif isinstance(op, ast.NotIn):
+                clauses.append({"$not": [_contains(rhs, rhs_kind, lhs)]})
+            elif type(op) in NONE_COMPARISONS and (lhs is None or rhs is None):
+                clauses.append({NONE_COMPARISONS[type(op)]: [rhs if lhs is None else lhs, None]})
+            elif type(op) in COMPARISONS:
+                clauses.append({COMPARISONS[type(op)]: [lhs, rhs]})
+            else:
+                self.fail(node, f"comparison {type(op).__name__} is not supported")
+            lhs = rhs
+        return (clauses[0] if len(clauses) == 1 else {"$and": clauses}), None
+
+    def _IfExp(self, node):
+        test, _ = self.expr(node.test)
+        then, then_kind = self.expr(node.body)
+        otherwise, else_kind = self.expr(node.orelse)
+        return {"$cond": [test, then, otherwise]}, then_kind if then_kind == else_kind else None
+
+    def _JoinedStr(self, node):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+                continue
+            if value.format_spec is not None or value.conversion not in (-1, ord("s")):
+                self.fail(value, "format specs and conversions are not supported")
+            part, kind = self.expr(value.value)
+            parts.append(part if kind == STR else {"$toString": part})
+        return {"$concat": parts}, STR
+
+    def _Call(self, node):
+        if node.keywords:
+            self.fail(node, "keyword arguments are not supported")
+        args = [self.expr(a)[0] for a in node.args]
+        if isinstance(node.func, ast.Attribute) and node.func.attr in STRING_METHODS:
+            target, _ = self.expr(node.func.value)
+            try:
+                result = STRING_METHODS[node.func.attr](target, *args)
+            except TypeError:
+                self.fail(node, f"call to {node.func.attr} has the wrong arguments")
+            return result, STR if node.func.attr in STRING_RESULTS else None
+        if isinstance(node.func, ast.Name) and node.func.id not in self._names:
+            if node.func.id == "len":
+                if len(args) != 1:
+                    self.fail(node, "call to len has the wrong arguments")
+                _, kind = self.expr(node.args[0])
+                if kind == STR:
+                    return {"$strLenCP": args[0]}, NUMBER
+                if kind == LIST:
+                    return {"$size": args[0]}, NUMBER
+                return _by_type(args[0], {"$size": args[0]}, {"$strLenCP": args[0]},
+                                {"$size": {"$objectToArray": args[0]}}), NUMBER
+            if node.func.id in BUILTINS:
+                try:
+                    return BUILTINS[node.func.id](*args), BUILTIN_RESULTS.get(node.func.id)
+                except TypeError:
+                    self.fail(node, f"call to {node.func.id} has the wrong arguments")
+        self.fail(node, "call is not supported")
+
+
+def _function_def(func):
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+    except (OSError, TypeError):
+        raise ValueError(f"cannot read the source of {func!r}")
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.FunctionDef) and node.name == func.__name__:
+            return node
+    raise ValueError(f"{func!r} is not defined with a def statement")
+
+
+def translate(python_func, *args):
+    """
+    Return the native aggregation expression computing ``python_func``.
+
+    :param python_func: a function whose body can be translated
+    :param args: field names bound to the parameters in order, as for
+                 ``JSCode``, or none to use the parameter names
+    :return: an expression that can be used in $project, $addFields etc.
+    :raises ValueError: when the function uses anything not translated
+    """
+    node = _function_def(python_func)
+    params = node.args
+    if params.vararg or params.kwarg or params.kwonlyargs or params.defaults or params.posonlyargs:
+        raise ValueError(f"{python_func.__name__} must only have plain positional parameters")
+    names = [a.arg for a in params.args]
+    if args and len(args) != len(names):
+        raise ValueError(f"{python_func.__name__} takes {len(names)} parameters, {len(args)} fields given")
+
+    fields = {name: JSCode.remove_dollar(field) for name, field in zip(names, args or names)}
+    expression, _ = _Translator(fields).body(node.body)
+    return expression
+
+
+def to_expression(python_func, *args):
+    """
+    The native expression for ``python_func`` if it can be translated,
+    otherwise a $function operator running it as JavaScript.
+    """
+    try:
+        return translate(python_func, *args)
+    except ValueError:
+        return function(JSCode(python_func, *args))()
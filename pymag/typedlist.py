@@ -3,7 +3,7 @@ from collections import UserList
 
 class TypedList(UserList):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, type_constraint=None, seq=()):
         self._type = type_constraint
         super().__init__([self._validate(x) for x in seq])
 
@@ -0,0 +1,119 @@
+"""
+Materialized views that are refreshed incrementally.
+
+A MaterializedView runs a pipeline over the documents of ``source``
+whose ``field`` is above the high-water mark of the last refresh and
+merges the results into ``target``. The mark is kept in a ``state``
+collection, so each refresh only reads the documents added since.
+
+    view = MaterializedView(events, Pipeline([group({"_id": "$member",
+                                                     "n": {"$sum": 1}})]),
+                            target=db["events_by_member"], state=db["views"],
+                            field="created")
+    view.refresh()
+
+When the pipeline ends in a $group, results for a key that is already in
+the target are re-reduced into it with ``GroupReducer.merge_update``, so
+only $sum, $count, $min and $max accumulators can be used. Otherwise
+matched documents are replaced.
+
+``field`` must only ever grow: a document inserted with a value at or
+below the mark is never picked up. A refresh that fails after the $merge
+has started may have folded part of the new documents into the target;
+call ``rebuild`` to recompute the view from scratch.
+"""
+from datetime import datetime
+
+import pymongo
+
+from pymag.pipeline import Pipeline
+from pymag.reducer import GroupReducer
+from pymag.stages import match, merge, sort, limit, project
+
+WRITE_STAGES = ("$out", "$merge")
+
+
+class MaterializedView:
+    """
+    Keep ``target`` up to date with the results of ``pipeline`` over
+    ``source``, recording the high-water mark of ``field`` in ``state``.
+    """
+
+    def __init__(self, source, pipeline, target, state, field="_id", name=None):
+        stages = list(pipeline)
+        for i, stage in enumerate(stages):
+            if stage.op_name in WRITE_STAGES:
+                raise ValueError(f"{stage.name} cannot be used, the view ends with its own $merge")
+            if stage.op_name == "$group" and i != len(stages) - 1:
+                raise ValueError("a $group must be the last stage so its results can be re-reduced")
+        self._source = source
+        self._stages = stages
+        self._target = target
+        self._state = state
+        self._field = field
+        self._name = name or f"{source.full_name}->{target.full_name}"
+        if stages and stages[-1].op_name == "$group":
+            self._when_matched = GroupReducer(stages[-1]).merge_update()
+        else:
+            self._when_matched = "replace"
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def mark(self):
+        """
+        The largest value of ``field`` processed so far, None before the
+        first refresh.
+        """
+        state = self._state.find_one({"_id": self._name})
+        return None if state is None else state["mark"]
+
+    def _latest(self):
+        latest = Pipeline([match({self._field: {"$exists": True}}),
+                           sort((self._field, pymongo.DESCENDING)),
+                           limit(1),
+                           project({"_id": 0, "mark": f"${self._field}"})]).aggregate(self._source)
+        for doc in latest:
+            return doc.get("mark")
+        return None
+
+    def pipeline(self, mark, latest):
+        """
+        The pipeline that folds the documents with ``field`` in
+        (mark, latest] into the target.
+        """
+        condition = {"$lte": latest} if mark is None else {"$gt": mark, "$lte": latest}
+        into = {"db": self._target.database.name, "coll": self._target.name}
+        return Pipeline([match({self._field: condition})] + self._stages +
+                        [merge({"into": into, "on": "_id",
+                                "whenMatched": self._when_matched, "whenNotMatched": "insert"})])
+
+    def refresh(self):
+        """
+        Process the documents added since the last refresh. The upper
+        bound is read before the run so documents inserted while it runs
+        are left for the next refresh.
+
+        :return: True if there were new documents to process
+        """
+        mark = self.mark
+        latest = self._latest()
+        if latest is None or (mark is not None and latest <= mark):
+            return False
+        for _ in self.pipeline(mark, latest).aggregate(self._source, allowDiskUse=True):
+            pass
+        self._state.update_one({"_id": self._name},
+                               {"$set": {"mark": latest, "refreshed": datetime.utcnow()},
+                                "$inc": {"refreshes": 1}},
+                               upsert=True)
+        return True
+
+    def rebuild(self):
+        """
+        Drop the target and the recorded mark and recompute the view.
+        """
+        self._target.drop()
+        self._state.delete_one({"_id": self._name})
+        return self.refresh()
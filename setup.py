@@ -44,11 +44,12 @@ setup(
         'Programming Language :: Python :: 3.7'],
 
     install_requires=["pymongo", "nose"],
+    extras_require={"orjson": ["orjson"]},
     tests_require=["dateutils", "nose"],
     package_data={
         '': ['*.txt', '*.rst', '*.md'],
     },
 
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "test"]),
     test_suite='nose.collector',
 )
@@ -0,0 +1,198 @@
+"""
+An in-process stand-in for a pymongo Collection, shared by the tests of
+the modules that run pipelines against a server.
+
+LocalCollection keeps its documents in a dict keyed by ``_id`` and runs
+``aggregate`` with the LocalExecutor. Pipelines can be passed as stage
+dicts or as the RawBSONDocuments of a FrozenPipeline. A trailing $merge
+is applied to the LocalCollection registered under the target name in
+``targets``, following its ``on``, ``whenMatched`` and
+``whenNotMatched`` options. A ``whenMatched`` pipeline may use
+``$$new`` for the incoming document.
+
+The basic CRUD methods used by the checkpoint and state collections are
+provided, with filters evaluated by ``compile_filter``. Tests subclass
+LocalCollection for anything more specific.
+"""
+import contextlib
+import threading
+from types import SimpleNamespace
+
+import bson
+import pymongo.errors
+from bson.codec_options import CodecOptions
+
+from pymag import stages
+from pymag.executor import LocalExecutor, compile_expression
+from pymag.matcher import compile_filter
+
+NEW = "__new"
+
+
+def decode(pipeline):
+    """
+    The stages of ``pipeline`` as plain dicts, however they were encoded.
+    """
+    return [bson.decode(s.raw) if hasattr(s, "raw") else bson.decode(bson.encode(s)) for s in pipeline]
+
+
+def to_stage(doc):
+    """
+    The AggStage for a stage dict.
+    """
+    (op_name, arg), = doc.items()
+    if op_name == "$sort":
+        return stages.sort(*arg.items())
+    return getattr(stages, op_name[1:])(arg)
+
+
+def _bind_new(expr):
+    # rewrite $$new references as paths into the NEW field of the scope
+    # the whenMatched pipeline is evaluated against
+    if isinstance(expr, str) and (expr == "$$new" or expr.startswith("$$new.")):
+        return f"${NEW}{expr[len('$$new'):]}"
+    if isinstance(expr, dict):
+        return {k: _bind_new(v) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [_bind_new(v) for v in expr]
+    return expr
+
+
+class FakeClient:
+    """
+    Hands out sessions whose operation time is the client's ``time``.
+    """
+
+    def __init__(self):
+        self.time = 0
+
+    @contextlib.contextmanager
+    def start_session(self, snapshot=False):
+        yield SimpleNamespace(operation_time=self.time)
+
+
+class FakeDatabase:
+
+    def __init__(self, name="db", client=None):
+        self.name = name
+        self.client = FakeClient() if client is None else client
+
+
+class LocalCollection:
+
+    def __init__(self, name="coll", docs=(), database=None):
+        self.codec_options = CodecOptions()
+        self.database = FakeDatabase() if database is None else database
+        self.name = name
+        self.full_name = f"{self.database.name}.{name}"
+        self.docs = {d["_id"]: d for d in docs}
+        self.targets = {}
+        self.pipelines = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def run(self, pipeline):
+        """
+        The results of the stage dicts in ``pipeline`` over the documents.
+        """
+        with self._lock:
+            docs = list(self.docs.values())
+        return LocalExecutor([to_stage(s) for s in pipeline]).run(docs)
+
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = decode(pipeline)
+        with self._lock:
+            self.pipelines.append((pipeline, kwargs))
+            self.threads.add(threading.get_ident())
+        if pipeline and "$merge" in pipeline[-1]:
+            self._merge(pipeline[-1]["$merge"], list(self.run(pipeline[:-1])))
+            return iter([])
+        return self.run(pipeline)
+
+    def _merge(self, spec, results):
+        into = spec["into"]
+        target = self.targets[into if isinstance(into, str) else into["coll"]]
+        on = spec.get("on", "_id")
+        on = [on] if isinstance(on, str) else on
+        when_matched = spec.get("whenMatched", "merge")
+        when_not_matched = spec.get("whenNotMatched", "insert")
+        with target._lock:
+            for doc in results:
+                existing = next((d for d in target.docs.values() if all(d.get(f) == doc.get(f) for f in on)),
+                                None)
+                if existing is None:
+                    if when_not_matched == "fail":
+                        raise pymongo.errors.OperationFailure("no matching document in the target")
+                    if when_not_matched == "insert":
+                        target.docs[doc["_id"]] = doc
+                elif when_matched == "replace":
+                    target.docs[existing["_id"]] = dict(doc, _id=existing["_id"])
+                elif when_matched == "merge":
+                    existing.update(doc)
+                elif when_matched == "fail":
+                    raise pymongo.errors.DuplicateKeyError("document already in the target")
+                elif isinstance(when_matched, list):
+                    scope = dict(existing, **{NEW: doc})
+                    for stage in when_matched:
+                        (op_name, fields), = stage.items()
+                        if op_name not in ("$set", "$addFields"):
+                            raise ValueError(f"{op_name} is not supported in whenMatched")
+                        for field, expr in fields.items():
+                            existing[field] = compile_expression(_bind_new(expr))(scope)
+
+    def find_one(self, query=None):
+        return next(iter(self.find(query)), None)
+
+    def find(self, query=None, projection=None):
+        matches = compile_filter(query or {})
+        with self._lock:
+            return [d for d in self.docs.values() if matches(d)]
+
+    def insert_one(self, doc):
+        with self._lock:
+            if doc["_id"] in self.docs:
+                raise pymongo.errors.DuplicateKeyError(f"duplicate _id {doc['_id']}")
+            self.docs[doc["_id"]] = doc
+
+    def insert_many(self, docs, ordered=True):
+        """
+        Insert the documents whose _id is new, raising a BulkWriteError
+        with a duplicate key error for each of the others.
+        """
+        with self._lock:
+            new = [d for d in docs if d["_id"] not in self.docs]
+            for doc in new:
+                self.docs[doc["_id"]] = doc
+        if len(new) < len(docs):
+            raise pymongo.errors.BulkWriteError({"nInserted": len(new),
+                                                 "writeErrors": [{"code": 11000}] * (len(docs) - len(new))})
+        return SimpleNamespace(inserted_ids=[d["_id"] for d in docs])
+
+    def update_one(self, query, update, upsert=False):
+        with self._lock:
+            doc = next((d for d in self.docs.values() if compile_filter(query)(d)), None)
+            if doc is None:
+                if not upsert:
+                    return
+                doc = self.docs.setdefault(query["_id"], {"_id": query["_id"]})
+            doc.update(update.get("$set", {}))
+            for field, n in update.get("$inc", {}).items():
+                doc[field] = doc.get(field, 0) + n
+
+    def delete_one(self, query):
+        with self._lock:
+            doc = next((d for d in self.docs.values() if compile_filter(query)(d)), None)
+            if doc is not None:
+                del self.docs[doc["_id"]]
+
+    def delete_many(self, query):
+        matches = compile_filter(query)
+        with self._lock:
+            self.docs = {k: d for k, d in self.docs.items() if not matches(d)}
+
+    def drop(self):
+        with self._lock:
+            self.docs = {}
+
+    def estimated_document_count(self):
+        return len(self.docs)
@@ -0,0 +1,97 @@
+import unittest
+
+import pymongo
+
+import pymag
+from pymag.advisor import IndexAdvisor, IndexProposal, propose, combine, covered, is_prefix
+
+
+class FakeCollection:
+
+    def __init__(self, name, indexes):
+        self.name = name
+        self.indexes = indexes
+        self.created = []
+
+    def index_information(self):
+        return self.indexes
+
+    def create_index(self, keys, name=None, **kwargs):
+        self.created.append((keys, name, kwargs))
+        self.indexes[name] = {"key": keys}
+        return name
+
+
+class FakeDatabase:
+
+    def __init__(self, indexes):
+        self.collections = {name: FakeCollection(name, dict(info)) for name, info in indexes.items()}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection(name, {"_id_": {"key": [("_id", 1)]}}))
+
+
+def events_pipeline():
+    return pymag.Pipeline([pymag.match({"rsvp": "yes", "time": {"$gte": 1, "$lt": 9}}),
+                           pymag.sort(("score", pymongo.DESCENDING)),
+                           pymag.group({"_id": "$member", "n": {"$sum": 1}})])
+
+
+class TestAdvisor(unittest.TestCase):
+
+    def test_esr(self):
+        proposal, = propose(events_pipeline(), "events")
+        self.assertEqual(proposal.collection, "events")
+        self.assertEqual(proposal.keys, [("rsvp", 1), ("score", -1), ("time", 1)])
+        self.assertEqual(proposal.reason, "equality rsvp; sort score; range time")
+
+    def test_in(self):
+        p = pymag.Pipeline([pymag.match({"city": {"$in": ["a", "b"]}, "rsvp": "yes"})])
+        self.assertEqual(propose(p, "c")[0].keys, [("rsvp", 1), ("city", 1)])
+        p.append(pymag.sort("when"))
+        self.assertEqual(propose(p, "c")[0].keys, [("rsvp", 1), ("when", 1), ("city", 1)])
+
+    def test_only_leading_stages(self):
+        p = pymag.Pipeline([pymag.match({"$and": [{"a": 1}, {"b": {"$gt": 2}}], "$or": [{"c": 1}]}),
+                            pymag.project({"a": 1}),
+                            pymag.match({"d": 1})])
+        self.assertEqual(propose(p, "c")[0].keys, [("a", 1), ("b", 1)])
+        self.assertEqual(propose(pymag.Pipeline([pymag.match({"_id": 1})]), "c"), [])
+        self.assertEqual(propose(pymag.Pipeline([pymag.project({"a": 1})]), "c"), [])
+
+    def test_lookup(self):
+        p = pymag.Pipeline([pymag.lookup({"from": "members", "localField": "member",
+                                          "foreignField": "member_id", "as": "m"})])
+        self.assertEqual(propose(p, "events"),
+                         [IndexProposal("members", [("member_id", 1)], "$lookup from events on member_id")])
+
+    def test_prefix(self):
+        self.assertTrue(is_prefix([("a", 1)], [("a", 1), ("b", -1)]))
+        self.assertTrue(is_prefix([("a", -1), ("b", 1)], [("a", 1), ("b", -1)]))
+        self.assertFalse(is_prefix([("a", 1), ("b", 1)], [("a", 1), ("b", -1)]))
+        self.assertFalse(is_prefix([("b", 1)], [("a", 1), ("b", 1)]))
+        self.assertTrue(covered(IndexProposal("c", [("a", 1)], ""), {"a_1_b_1": {"key": [("a", 1), ("b", 1)]}}))
+
+    def test_combine(self):
+        short = IndexProposal("c", [("rsvp", 1)], "")
+        long = IndexProposal("c", [("rsvp", 1), ("time", 1)], "")
+        other = IndexProposal("d", [("rsvp", 1)], "")
+        self.assertEqual(combine([short, long, other, long]), [long, other])
+
+    def test_recommend_and_create(self):
+        db = FakeDatabase({"events": {"_id_": {"key": [("_id", 1)]},
+                                      "rsvp_1_score_-1_time_1": {"key": [("rsvp", 1), ("score", -1), ("time", 1)]}}})
+        by_city = pymag.Pipeline([pymag.match({"city": "Dublin", "rsvp": "yes"})])
+        city_only = pymag.Pipeline([pymag.match({"city": "Dublin"})])
+        advisor = IndexAdvisor(db)
+        proposals = advisor.recommend([("events", events_pipeline()),
+                                       (db["events"], by_city),
+                                       ("events", city_only)])
+        self.assertEqual(proposals, [IndexProposal("events", [("city", 1), ("rsvp", 1)], "equality city, rsvp")])
+        self.assertEqual(advisor.create(proposals, background=True), ["city_1_rsvp_1"])
+        self.assertEqual(db["events"].created, [([("city", 1), ("rsvp", 1)], "city_1_rsvp_1", {"background": True})])
+        self.assertEqual(advisor.recommend([("events", by_city)]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+import bson
+from bson.codec_options import CodecOptions
+
+import pymag
+from pymag.aio import AsyncBatchIterator, aggregate_many
+
+
+class FakeAsyncCursor:
+    """
+    Stands in for a Motor cursor: to_list yields to the event loop and
+    returns the next slice of documents.
+    """
+
+    def __init__(self, collection, docs):
+        self._collection = collection
+        self._docs = list(docs)
+        self.closed = False
+
+    async def to_list(self, length):
+        await asyncio.sleep(0)
+        batch, self._docs = self._docs[:length], self._docs[length:]
+        return batch
+
+    async def close(self):
+        self.closed = True
+        self._collection.active = self._collection.active - 1
+
+
+class FakeAsyncCollection:
+
+    def __init__(self, docs, awaitable=False):
+        self.codec_options = CodecOptions()
+        self._docs = docs
+        self._awaitable = awaitable
+        self.calls = []
+        self.cursors = []
+        self.active = 0
+        self.max_active = 0
+
+    def _open(self, pipeline, **kwargs):
+        self.calls.append((pipeline, kwargs))
+        self.active = self.active + 1
+        self.max_active = max(self.max_active, self.active)
+        # only $limit is honoured, enough to tell pipelines apart
+        stages = [bson.decode(r.raw) if hasattr(r, "raw") else r for r in pipeline]
+        limit = next((s["$limit"] for s in stages if "$limit" in s), len(self._docs))
+        cursor = FakeAsyncCursor(self, self._docs[:limit])
+        self.cursors.append(cursor)
+        return cursor
+
+    def aggregate(self, pipeline, **kwargs):
+        if self._awaitable:
+            async def opened():
+                return self._open(pipeline, **kwargs)
+            return opened()
+        return self._open(pipeline, **kwargs)
+
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+
+    async def test_batches(self):
+        collection = FakeAsyncCollection([{"i": i} for i in range(10)])
+        p = pymag.Pipeline([pymag.match()])
+        batches = [b async for b in p.aggregate_async(collection, batch_size=4)]
+        self.assertEqual([4, 4, 2], [len(b) for b in batches])
+        self.assertEqual({"batchSize": 4}, collection.calls[0][1])
+        self.assertTrue(collection.cursors[0].closed)
+
+    async def test_awaitable_aggregate(self):
+        collection = FakeAsyncCollection([{"i": i} for i in range(3)], awaitable=True)
+        p = pymag.Pipeline([pymag.limit(2)])
+        docs = await p.aggregate_async(collection).to_list()
+        self.assertEqual([{"i": 0}, {"i": 1}], docs)
+
+    async def test_early_exit(self):
+        collection = FakeAsyncCollection([{"i": i} for i in range(10)])
+        async with AsyncBatchIterator(collection, [], batch_size=2) as batches:
+            async for _ in batches:
+                break
+        self.assertTrue(collection.cursors[0].closed)
+        self.assertRaises(ValueError, AsyncBatchIterator, collection, [], batch_size=0)
+
+    async def test_aggregate_many(self):
+        collection = FakeAsyncCollection([{"i": i} for i in range(5)])
+        jobs = [(collection, pymag.Pipeline([pymag.limit(n)])) for n in range(1, 11)]
+        results = await aggregate_many(jobs, concurrency=3, batch_size=2)
+        self.assertEqual([min(n, 5) for n in range(1, 11)], [len(r) for r in results])
+        self.assertLessEqual(collection.max_active, 3)
+        self.assertEqual(0, collection.active)
+
+
+if __name__ == '__main__':
+    unittest.main()
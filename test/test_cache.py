@@ -0,0 +1,189 @@
+import datetime
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from bson.codec_options import CodecOptions
+
+import pymag
+from pymag.cache import PipelineCache, MemoryCache, DiskCache, fingerprint, cache_key, is_cacheable
+
+
+class FakeDatabase:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeCollection:
+    """
+    Counts the aggregations it is asked to run.
+    """
+
+    def __init__(self, docs, name="coll", database="db"):
+        self.codec_options = CodecOptions()
+        self.database = FakeDatabase(database)
+        self.name = name
+        self.docs = docs
+        self.calls = 0
+
+    def aggregate(self, pipeline):
+        self.calls = self.calls + 1
+        return iter([dict(d) for d in self.docs])
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_match_key_order(self):
+        a = pymag.Pipeline([pymag.match({"a": 1, "b": {"$gt": 1, "$lt": 5}})])
+        b = pymag.Pipeline([pymag.match({"b": {"$lt": 5, "$gt": 1}, "a": 1})])
+        self.assertEqual(fingerprint(a), fingerprint(b))
+
+    def test_embedded_document_order(self):
+        a = pymag.Pipeline([pymag.match({"addr": {"city": "D", "zip": 1}})])
+        b = pymag.Pipeline([pymag.match({"addr": {"zip": 1, "city": "D"}})])
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+        docs = [{"addr": {"city": "D", "zip": 1}}]
+        self.assertEqual(len(list(a.aggregate_local(docs))), 1)
+        self.assertEqual(len(list(b.aggregate_local(docs))), 0)
+
+        a = pymag.Pipeline([pymag.match({"$or": [{"x": 1, "y": {"$in": [{"p": 1, "q": 2}]}}]})])
+        b = pymag.Pipeline([pymag.match({"$or": [{"y": {"$in": [{"p": 1, "q": 2}]}, "x": 1}]})])
+        c = pymag.Pipeline([pymag.match({"$or": [{"y": {"$in": [{"q": 2, "p": 1}]}, "x": 1}]})])
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        self.assertNotEqual(fingerprint(a), fingerprint(c))
+
+    def test_argument_changed_in_place(self):
+        m = pymag.match({"a": 1})
+        p = pymag.Pipeline([pymag.limit(1), m])
+        before = fingerprint(p)
+        p.freeze()
+        m.arg["a"] = 2
+        self.assertNotEqual(fingerprint(p), before)
+
+    def test_sort_key_order(self):
+        a = pymag.sort("a")
+        a.add_sort("b")
+        b = pymag.sort("b")
+        b.add_sort("a")
+        a, b = pymag.Pipeline([a]), pymag.Pipeline([b])
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+
+    def test_cache_key(self):
+        p = pymag.Pipeline([pymag.match({"a": 1})])
+        self.assertNotEqual(cache_key(FakeCollection([], name="x"), p),
+                            cache_key(FakeCollection([], name="y"), p))
+        self.assertNotEqual(cache_key(FakeCollection([], database="x"), p),
+                            cache_key(FakeCollection([], database="y"), p))
+
+    def test_is_cacheable(self):
+        self.assertTrue(is_cacheable(pymag.Pipeline([pymag.match({"a": 1})])))
+        self.assertFalse(is_cacheable(pymag.Pipeline([pymag.match({"a": 1}), pymag.out("x")])))
+        self.assertFalse(is_cacheable(pymag.Pipeline([pymag.match({"a": 1}), pymag.merge({"into": "x"})])))
+
+
+class TestPipelineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_backend(self, backend):
+        coll = FakeCollection([{"_id": 1, "a": 1}, {"_id": 2, "a": 2}])
+        cache = PipelineCache(backend, ttl=60)
+        p = pymag.Pipeline([pymag.match({"a": {"$gte": 1}})])
+
+        first = cache.aggregate(p, coll)
+        second = p.aggregate_cached(coll, cache)
+        self.assertEqual(first, coll.docs)
+        self.assertEqual(second, coll.docs)
+        self.assertEqual(coll.calls, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.invalidate(p, coll)
+        cache.aggregate(p, coll)
+        self.assertEqual(coll.calls, 2)
+
+    def test_memory(self):
+        self.check_backend(MemoryCache())
+
+    def test_disk(self):
+        self.check_backend(DiskCache(self.directory))
+
+    def test_hits_are_copies(self):
+        coll = FakeCollection([{"_id": 1, "tags": ["a"]}])
+        cache = PipelineCache(MemoryCache())
+        p = pymag.Pipeline([pymag.match({})])
+        cache.aggregate(p, coll)[0]["tags"].append("b")
+        cache.aggregate(p, coll)[0]["tags"].append("c")
+        self.assertEqual(cache.aggregate(p, coll), [{"_id": 1, "tags": ["a"]}])
+
+    def test_codec_options(self):
+        when = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        for backend in (MemoryCache(), DiskCache(self.directory)):
+            coll = FakeCollection([{"_id": 1, "when": when}])
+            coll.codec_options = CodecOptions(tz_aware=True)
+            cache = PipelineCache(backend)
+            p = pymag.Pipeline([pymag.match({})])
+            self.assertEqual(cache.aggregate(p, coll), cache.aggregate(p, coll))
+            self.assertIsNotNone(cache.aggregate(p, coll)[0]["when"].tzinfo)
+            self.assertEqual(cache.hits, 2)
+
+    def test_ttl(self):
+        coll = FakeCollection([{"_id": 1}])
+        cache = PipelineCache(MemoryCache(), ttl=60)
+        p = pymag.Pipeline([pymag.match({"_id": 1})])
+        cache.aggregate(p, coll, ttl=10)
+        with mock.patch("pymag.cache.time.time", return_value=time.time() + 20):
+            cache.aggregate(p, coll)
+        self.assertEqual(coll.calls, 2)
+
+        cache.aggregate(pymag.Pipeline([pymag.match({"_id": 2})]), coll, ttl=0)
+        cache.aggregate(pymag.Pipeline([pymag.match({"_id": 2})]), coll, ttl=0)
+        self.assertEqual(coll.calls, 4)
+
+    def test_disk_expiry(self):
+        backend = DiskCache(self.directory)
+        backend.set("k", [{"a": 1}], 10)
+        self.assertEqual(backend.get("k"), [{"a": 1}])
+        with mock.patch("pymag.cache.time.time", return_value=time.time() + 20):
+            self.assertIsNone(backend.get("k"))
+        self.assertEqual(len(backend), 0)
+
+    def test_write_stages_not_cached(self):
+        coll = FakeCollection([])
+        cache = PipelineCache(MemoryCache())
+        p = pymag.Pipeline([pymag.match({"a": 1}), pymag.out("results")])
+        cache.aggregate(p, coll)
+        cache.aggregate(p, coll)
+        self.assertEqual(coll.calls, 2)
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_lru(self):
+        backend = MemoryCache(max_entries=2)
+        backend.set("a", [{"n": 1}], 60)
+        backend.set("b", [{"n": 2}], 60)
+        backend.get("a")
+        backend.set("c", [{"n": 3}], 60)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), [{"n": 1}])
+        self.assertEqual(backend.get("c"), [{"n": 3}])
+        self.assertRaises(ValueError, MemoryCache, 0)
+
+    def test_disk_size_cap(self):
+        backend = DiskCache(self.directory, max_bytes=300)
+        doc = {"x": "y" * 100}
+        backend.set("a", [doc], 60)
+        backend.set("b", [doc], 60)
+        backend.set("c", [doc], 60)
+        self.assertEqual(len(backend), 2)
+        self.assertIsNotNone(backend.get("c"))
+        self.assertRaises(ValueError, DiskCache, self.directory, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from pymag.chunked import ChunkedMerge
+from pymag.stages import project, out
+from test.localcollection import LocalCollection
+
+
+class ChunkedCollection(LocalCollection):
+    """
+    Adds $bucketAuto on _id, counts the chunk pipelines and fails the
+    chunk starting at ``fail_on``.
+    """
+
+    def __init__(self, name, docs=(), fail_on=None):
+        super().__init__(name, docs)
+        self.fail_on = fail_on
+
+    @property
+    def chunk_runs(self):
+        return sum(1 for p, _ in self.pipelines if "$merge" in p[-1])
+
+    def aggregate(self, pipeline, **kwargs):
+        first = pipeline[0]
+        (op_name, arg), = (first if isinstance(first, dict) else dict(first)).items()
+        if op_name == "$bucketAuto":
+            ids = sorted(self.docs)
+            size = -(-len(ids) // arg["buckets"])
+            chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+            bounds = [c[0] for c in chunks] + [ids[-1]]
+            return iter([{"_id": {"min": lo, "max": hi}} for lo, hi in zip(bounds, bounds[1:])])
+        if self.fail_on is not None and arg["_id"]["$gte"] == self.fail_on:
+            raise RuntimeError("chunk failed")
+        return super().aggregate(pipeline, **kwargs)
+
+
+def taxis():
+    return [{"_id": i, "lon": i / 10, "lat": -i / 10, "fare": i} for i in range(100)]
+
+
+class TestChunkedMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.target = ChunkedCollection("yellow_cabs")
+        self.checkpoint = ChunkedCollection("checkpoint")
+        self.stages = [project({"fare": 1, "point": {"coordinates": ["$lon", "$lat"]}})]
+
+    def source(self, **kwargs):
+        source = ChunkedCollection("taxis", taxis(), **kwargs)
+        source.targets["yellow_cabs"] = self.target
+        return source
+
+    def test_run(self):
+        source = self.source()
+        job = ChunkedMerge(source, self.stages, self.target, self.checkpoint, chunks=8)
+        progress = []
+        self.assertEqual(job.run(workers=3, progress=lambda *p: progress.append(p)), 8)
+        self.assertEqual(sorted(self.target.docs), list(range(100)))
+        self.assertEqual(self.target.docs[99], {"_id": 99, "fare": 99, "point": {"coordinates": [9.9, -9.9]}})
+        self.assertEqual(sorted(p[1] for p in progress), list(range(1, 9)))
+        self.assertEqual(job.run(), 0)
+        self.assertEqual(source.chunk_runs, 8)
+
+    def test_resume(self):
+        failing = self.source(fail_on=52)
+        job = ChunkedMerge(failing, self.stages, self.target, self.checkpoint, chunks=8)
+        self.assertRaises(RuntimeError, job.run)
+        self.assertEqual(len(job.pending()), 1)
+
+        source = self.source()
+        source.docs[1000] = {"_id": 1000, "fare": 1}
+        job = ChunkedMerge(source, self.stages, self.target, self.checkpoint, chunks=8, name=job.name)
+        self.assertEqual(job.run(), 1)
+        self.assertEqual(source.chunk_runs, 1)
+        self.assertEqual(sorted(self.target.docs), list(range(100)))
+
+        job.reset()
+        self.assertEqual(len(job.pending()), 8)
+
+    def test_bounds(self):
+        job = ChunkedMerge(self.source(), self.stages, self.target, self.checkpoint, chunks=4)
+        bounds = job.bounds()
+        self.assertEqual(bounds, [0, 25, 50, 75, 99])
+        self.assertEqual(job.pipeline(0, bounds)[0].arg, {"_id": {"$gte": 0, "$lt": 25}})
+        self.assertEqual(job.pipeline(3, bounds)[0].arg, {"_id": {"$gte": 75, "$lte": 99}})
+        self.assertRaises(ValueError, ChunkedMerge, self.source(), [out("x")], self.target, self.checkpoint)
+        self.assertRaises(ValueError, ChunkedMerge, self.source(), self.stages, self.target, self.checkpoint, 0)
+
+    def test_concurrent_plan(self):
+        first = ChunkedMerge(self.source(), self.stages, self.target, self.checkpoint, chunks=4)
+        second = ChunkedMerge(self.source(), self.stages, self.target, self.checkpoint, chunks=2,
+                              name=first.name)
+        find_one = self.checkpoint.find_one
+
+        def racing_find_one(query):
+            # the second run stores its plan between the first run's
+            # read and insert
+            self.checkpoint.find_one = find_one
+            self.assertIsNone(find_one(query))
+            second.bounds()
+            return None
+
+        self.checkpoint.find_one = racing_find_one
+        self.assertEqual(first.bounds(), [0, 50, 99])
+        self.assertEqual(first.pending(), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
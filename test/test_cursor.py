@@ -0,0 +1,152 @@
+import gzip
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+import bson
+from bson import Code, ObjectId, Decimal128, Int64, json_util
+
+from pymag import cursor
+from pymag.cursor import CursorFormatter, FieldProjection, NoResults, FirstResults, LastResults
+
+
+def docs(n):
+    return ({"_id": i, "name": f"name {i}"} for i in range(n))
+
+
+class TestCursorFormatter(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self._filename)
+
+    def test_keep_all(self):
+        kept = []
+        formatter = CursorFormatter(docs(5), filename=self._filename, formatter="csv", results=kept)
+        self.assertEqual(5, formatter.printCursor(formatter._cursor, ["_id", "name"]))
+        self.assertIs(kept, formatter.results())
+        self.assertEqual(5, len(kept))
+
+        formatter = CursorFormatter(docs(5), filename=self._filename)
+        formatter.output(fieldNames=["_id"])
+        self.assertEqual(5, len(formatter.results()))
+
+    def test_keep_none(self):
+        formatter = CursorFormatter(docs(100), filename=self._filename, formatter="csv", keep="none")
+        formatter.output(fieldNames=["_id", "name"])
+        self.assertRaises(ValueError, formatter.results)
+        with open(self._filename) as f:
+            self.assertEqual(101, len(f.readlines()))
+
+    def test_keep_first_last(self):
+        formatter = CursorFormatter(docs(100), filename=self._filename, keep=FirstResults(3))
+        formatter.output(fieldNames=["_id"])
+        self.assertEqual([0, 1, 2], [d["_id"] for d in formatter.results()])
+
+        formatter = CursorFormatter(docs(100), filename=self._filename, keep=LastResults(3))
+        formatter.output(fieldNames=["_id"])
+        self.assertEqual([97, 98, 99], [d["_id"] for d in formatter.results()])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, CursorFormatter, 1)
+        self.assertRaises(ValueError, CursorFormatter, docs(1), keep="some")
+        self.assertRaises(ValueError, FirstResults, -1)
+        self.assertRaises(ValueError, LastResults, "10")
+        self.assertRaises(ValueError, NoResults().view)
+
+    def test_ndjson(self):
+        source = [{"_id": ObjectId(), "when": datetime(2020, 10, 9, 16, 6, 55, 1000),
+                   "amount": Decimal128(Decimal("1.10")), "member": {"name": "Joe", "id": 1}},
+                  {"_id": ObjectId(), "when": datetime(2021, 1, 1), "member": {"name": "Mary"}}]
+        for fast_json in (True, False):
+            formatter = CursorFormatter(iter(source), filename=self._filename, formatter="ndjson",
+                                        fast_json=fast_json)
+            self.assertEqual(2, formatter.output())
+            with open(self._filename) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(source, [json_util.loads(line) for line in lines])
+
+        formatter = CursorFormatter(iter(source), filename=self._filename, formatter="ndjson",
+                                    json_options=json_util.CANONICAL_JSON_OPTIONS)
+        formatter.output(fieldNames=["member.name"])
+        with open(self._filename) as f:
+            self.assertEqual('{"member": {"name": "Joe"}}', f.readline().strip())
+
+    @unittest.skipIf(cursor.orjson is None, "orjson is not installed")
+    def test_ndjson_encoders_agree(self):
+        fast = CursorFormatter(iter([]), fast_json=True).ndjson_encoder()
+        slow = CursorFormatter(iter([]), fast_json=False).ndjson_encoder()
+        values = [float("nan"), float("inf"), float("-inf"), 1.5, Int64(2 ** 62), Int64(1),
+                  Decimal128(Decimal("1.10")), ObjectId(), datetime(2020, 10, 9, 16, 6, 55, 1000), None,
+                  "null", "nullable", [float("nan"), 1], {"nested": float("-inf")},
+                  Code("function(){}"), Code("function(){ return a; }", {"a": 1}), 2 ** 70, -2 ** 65]
+        for value in values:
+            doc = {"v": value}
+            canonical = [json_util.dumps(json_util.loads(encode(doc)), json_options=json_util.CANONICAL_JSON_OPTIONS)
+                         for encode in (fast, slow)]
+            self.assertEqual(canonical[0], canonical[1], value)
+        # text that merely contains null stays on the orjson path
+        self.assertEqual(fast({"v": "nullable"}), b'{"v":"nullable"}')
+
+    def test_ndjson_batches(self):
+        formatter = CursorFormatter(docs(2500), filename=self._filename, formatter="ndjson", keep="none")
+        formatter.output()
+        with open(self._filename) as f:
+            self.assertEqual(list(range(2500)), [json_util.loads(line)["_id"] for line in f])
+
+    def test_bson(self):
+        source = [{"_id": i, "when": datetime(2020, 1, 1), "name": f"name {i}"} for i in range(10)]
+        batches = [b"".join(bson.encode(d) for d in source[:4]),
+                   b"".join(bson.encode(d) for d in source[4:])]
+        formatter = CursorFormatter(iter(batches), filename=self._filename, formatter="bson")
+        self.assertEqual(10, formatter.output())
+        with open(self._filename, "rb") as f:
+            self.assertEqual(source, bson.decode_all(f.read()))
+        self.assertEqual([], formatter.results())
+
+        gz_filename = self._filename + ".bson.gz"
+        try:
+            CursorFormatter(iter(batches), filename=gz_filename, formatter="bson").output()
+            with gzip.open(gz_filename, "rb") as f:
+                self.assertEqual(source, bson.decode_all(f.read()))
+        finally:
+            os.unlink(gz_filename)
+
+        formatter = CursorFormatter(iter(source), filename=self._filename, formatter="bson")
+        self.assertRaises(ValueError, formatter.output)
+        self.assertRaises(ValueError, CursorFormatter.count_bson_documents, batches[0][:-3])
+
+
+class TestFieldProjection(unittest.TestCase):
+
+    def test_nested(self):
+        doc = {"a": 1, "b": {"c": 2, "d": {"e": 3}}, "f": [1, 2], "g": "x"}
+        p = FieldProjection(["a", "b.d.e", "b.c", "f", "missing", "b.missing", "g.h", "f.x"])
+        self.assertEqual({"a": 1, "b": {"d": {"e": 3}, "c": 2}, "f": [1, 2]}, p(doc))
+        self.assertEqual({}, p({}))
+
+    def test_flat(self):
+        doc = {"a": 1, "b": {"c": 2}}
+        p = FieldProjection(["a", "b.c", "b.x"], nested=False)
+        self.assertEqual({"a": 1, "b.c": 2}, p(doc))
+        self.assertEqual(["a", "b.c", "b.x"], p.fieldnames)
+
+    def test_csv_dotted_fields(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            formatter = CursorFormatter([{"a": 1, "b": {"c": 2}}, {"a": 3}], filename=filename, formatter="csv")
+            formatter.output(fieldNames=["a", "b.c"])
+            with open(filename) as f:
+                self.assertEqual(["a,b.c", "1,2", "3,"], f.read().splitlines())
+        finally:
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
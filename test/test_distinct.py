@@ -0,0 +1,69 @@
+import unittest
+
+import pymongo
+
+from pymag.distinct import distinct_copy, distinct_pipeline
+from test.localcollection import FakeDatabase, LocalCollection
+
+
+class BatchCollection(LocalCollection):
+    """
+    Records the size of each insert_many batch.
+    """
+
+    def __init__(self, name="coll", docs=(), client=None):
+        super().__init__(name, docs, FakeDatabase("db", client))
+        self.batches = []
+
+    def insert_many(self, docs, ordered=True):
+        self.batches.append(len(docs))
+        return super().insert_many(docs, ordered)
+
+
+def groups():
+    return [{"_id": i, "group": {"id": i % 7}, "n": i} for i in range(50)] + [{"_id": 50, "n": 50}]
+
+
+class TestDistinct(unittest.TestCase):
+
+    def test_pipeline(self):
+        p = distinct_pipeline("group.id", order=[("n", pymongo.DESCENDING)])
+        self.assertEqual([s.op_name for s in p], ["$match", "$sort", "$group", "$replaceRoot"])
+        self.assertEqual(p[0].arg, {"group.id": {"$exists": True}})
+        self.assertEqual(distinct_pipeline("k", query={"k": 1})[0].arg, {"k": 1})
+
+    def test_insert(self):
+        source = BatchCollection(docs=groups(), client="client")
+        target = BatchCollection(name="target", client="other")
+        progress = []
+        copied = distinct_copy(source, target, "group.id", batch_size=3, progress=progress.append)
+        self.assertEqual(copied, 7)
+        self.assertEqual(progress, [3, 6, 7])
+        self.assertEqual(target.batches, [3, 3, 1])
+        self.assertEqual(sorted(target.docs), list(range(7)))
+        self.assertEqual(source.pipelines[0][1], {"allowDiskUse": True, "batchSize": 3})
+
+        self.assertEqual(distinct_copy(source, target, "group.id"), 0)
+        self.assertEqual(len(target.docs), 7)
+
+    def test_order(self):
+        source = BatchCollection(docs=groups(), client="client")
+        target = BatchCollection(name="target", client="other")
+        distinct_copy(source, target, "group.id", order=[("n", pymongo.DESCENDING)])
+        self.assertEqual(sorted(target.docs), list(range(43, 50)))
+
+    def test_merge(self):
+        source = BatchCollection(docs=groups(), client="client")
+        target = BatchCollection(name="target", client="client")
+        source.targets["target"] = target
+        distinct_copy(source, target, "group.id")
+        self.assertEqual(sorted(target.docs), list(range(7)))
+        pipeline, kwargs = source.pipelines[0]
+        self.assertEqual(pipeline[-1], {"$merge": {"into": {"db": "db", "coll": "target"},
+                                                   "whenMatched": "keepExisting",
+                                                   "whenNotMatched": "insert"}})
+        self.assertRaises(ValueError, distinct_copy, source, target, "group.id", batch_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+
+import pymongo
+
+import pymag
+from pymag.executor import LocalExecutor, compare, compile_expression
+from pymag.pipeline import Pipeline
+from pymag.stages import match, project, group, sort, limit, skip, unwind, addFields, count, lookup
+
+
+def people():
+    return [{"_id": 1, "name": "Joe", "city": "Dublin", "age": 50, "tags": ["a", "b"]},
+            {"_id": 2, "name": "Mary", "city": "London", "age": 35, "tags": ["b"]},
+            {"_id": 3, "name": "Sean", "city": "Dublin", "age": 25, "tags": []},
+            {"_id": 4, "name": "Anne", "city": "Paris", "age": 41, "address": {"zip": "75001"}}]
+
+
+class TestLocalExecutor(unittest.TestCase):
+
+    def test_match(self):
+        p = Pipeline([match({"city": "Dublin"})])
+        self.assertEqual([1, 3], [d["_id"] for d in p.aggregate_local(people())])
+
+        p = Pipeline([match({"age": {"$gte": 35, "$lt": 50}})])
+        self.assertEqual([2, 4], [d["_id"] for d in p.aggregate_local(people())])
+
+        p = Pipeline([match({"tags": "b"})])
+        self.assertEqual([1, 2], [d["_id"] for d in p.aggregate_local(people())])
+
+        p = Pipeline([match({"address.zip": {"$exists": True}})])
+        self.assertEqual([4], [d["_id"] for d in p.aggregate_local(people())])
+
+    def test_project(self):
+        p = Pipeline([project({"_id": 0, "name": 1, "address.zip": 1})])
+        results = list(p.aggregate_local(people()))
+        self.assertEqual({"name": "Joe"}, results[0])
+        self.assertEqual({"name": "Anne", "address": {"zip": "75001"}}, results[3])
+
+        p = Pipeline([project({"tags": 0, "address": 0, "age": 0})])
+        results = list(p.aggregate_local(people()))
+        self.assertEqual({"_id": 2, "name": "Mary", "city": "London"}, results[1])
+
+        p = Pipeline([project({"upper": {"$toUpper": "$name"}, "older": {"$add": ["$age", 1]}})])
+        self.assertEqual({"_id": 1, "upper": "JOE", "older": 51}, next(p.aggregate_local(people())))
+
+        self.assertRaises(ValueError, LocalExecutor, [project({"a": 1, "b": 0})])
+
+    def test_add_fields(self):
+        docs = people()
+        p = Pipeline([addFields({"decade": {"$cond": [{"$gte": ["$age", 40]}, "old", "young"]},
+                                 "address.country": "IE"})])
+        result = next(p.aggregate_local(docs))
+        self.assertEqual("old", result["decade"])
+        self.assertEqual({"country": "IE"}, result["address"])
+        self.assertNotIn("decade", docs[0])
+
+    def test_group(self):
+        p = Pipeline([group({"_id": "$city",
+                             "count": {"$sum": 1},
+                             "total_age": {"$sum": "$age"},
+                             "avg_age": {"$avg": "$age"},
+                             "youngest": {"$min": "$age"},
+                             "names": {"$push": "$name"}}),
+                      sort("_id")])
+        results = list(p.aggregate_local(people()))
+        self.assertEqual(["Dublin", "London", "Paris"], [d["_id"] for d in results])
+        self.assertEqual({"_id": "Dublin", "count": 2, "total_age": 75, "avg_age": 37.5,
+                          "youngest": 25, "names": ["Joe", "Sean"]}, results[0])
+
+        self.assertRaises(ValueError, LocalExecutor, [group({"count": {"$sum": 1}})])
+
+    def test_sort_limit_skip(self):
+        p = Pipeline([sort(("age", pymongo.DESCENDING)), skip(1), limit(2)])
+        self.assertEqual([4, 2], [d["_id"] for d in p.aggregate_local(people())])
+
+        p = Pipeline([sort("city", ("age", pymongo.ASCENDING))])
+        self.assertEqual([3, 1, 2, 4], [d["_id"] for d in p.aggregate_local(people())])
+
+    def test_unwind(self):
+        p = Pipeline([unwind({"path": "$tags"})])
+        self.assertEqual([(1, "a"), (1, "b"), (2, "b")],
+                         [(d["_id"], d["tags"]) for d in p.aggregate_local(people())])
+
+        p = Pipeline([unwind({"path": "$tags", "preserveNullAndEmptyArrays": True,
+                              "includeArrayIndex": "i"})])
+        self.assertEqual([0, 1, 0, None, None], [d["i"] for d in p.aggregate_local(people())])
+
+    def test_count(self):
+        p = Pipeline([match({"city": "Dublin"}), count("dubliners")])
+        self.assertEqual([{"dubliners": 2}], list(p.aggregate_local(people())))
+
+    def test_streaming(self):
+
+        def endless():
+            i = 0
+            while True:
+                yield {"i": i}
+                i = i + 1
+
+        p = Pipeline([match({"i": {"$gt": 10}}), project({"j": "$i"}), limit(3)])
+        self.assertEqual([{"j": 11}, {"j": 12}, {"j": 13}], list(p.aggregate_local(endless())))
+
+    def test_reuse(self):
+        executor = LocalExecutor([match({"city": "Dublin"}), count("n")])
+        self.assertEqual([{"n": 2}], list(executor.run(people())))
+        self.assertEqual([{"n": 2}], list(executor(people())))
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, LocalExecutor, [lookup({"from": "x"})])
+        self.assertRaises(ValueError, LocalExecutor, [1])
+
+    def test_compare(self):
+        self.assertEqual(-1, compare(None, 1))
+        self.assertEqual(-1, compare(1, "a"))
+        self.assertEqual(0, compare(1, 1.0))
+        self.assertEqual(1, compare(True, 100))
+
+    def test_mod(self):
+        mod = compile_expression({"$mod": ["$x", "$y"]})
+        for x, y, expected in [(7, 3, 1), (-7, 3, -1), (7, -3, 1), (-7, -3, -1), (-7.5, 2, -1.5)]:
+            self.assertEqual(expected, mod({"x": x, "y": y}), (x, y))
+
+    def test_star_export(self):
+        self.assertIn("LocalExecutor", vars(pymag))
+        for name in ("compare", "functools", "heapq", "STAGES", "bson", "compile_filter", "RawBSONDocument"):
+            self.assertNotIn(name, vars(pymag))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+
+from bson.codec_options import CodecOptions
+
+import pymag
+from pymag.explain import ExplainSummary
+
+# explain output from a 6.0 mongod for match + group + sort where the
+# match could not use an index
+COLLSCAN_GROUP_SORT = {
+    "explainVersion": "1",
+    "stages": [
+        {"$cursor": {
+            "queryPlanner": {
+                "namespace": "test.events",
+                "winningPlan": {"stage": "PROJECTION_SIMPLE",
+                                "inputStage": {"stage": "COLLSCAN", "filter": {"rsvp": {"$eq": "yes"}},
+                                               "direction": "forward"}}},
+            "executionStats": {
+                "nReturned": 120, "executionTimeMillis": 35,
+                "totalKeysExamined": 0, "totalDocsExamined": 50000,
+                "executionStages": {"stage": "PROJECTION_SIMPLE", "nReturned": 120,
+                                    "inputStage": {"stage": "COLLSCAN", "nReturned": 120,
+                                                   "docsExamined": 50000}}}},
+         "nReturned": 120, "executionTimeMillisEstimate": 30},
+        {"$group": {"_id": "$member", "events": {"$sum": {"$const": 1}}},
+         "maxAccumulatorMemoryUsageBytes": {"events": 4800},
+         "totalOutputDataSizeBytes": 12000, "usedDisk": False, "spills": 0,
+         "nReturned": 40, "executionTimeMillisEstimate": 31},
+        {"$sort": {"sortKey": {"events": -1}},
+         "totalDataSizeSortedBytesEstimate": 9000, "usedDisk": True, "spills": 1,
+         "nReturned": 40, "executionTimeMillisEstimate": 33}],
+    "ok": 1.0}
+
+# the whole pipeline pushed down to the query layer, using an index
+INDEXED_FIND = {
+    "explainVersion": "1",
+    "queryPlanner": {
+        "namespace": "test.events",
+        "winningPlan": {"stage": "LIMIT", "limitAmount": 10,
+                        "inputStage": {"stage": "FETCH",
+                                       "inputStage": {"stage": "IXSCAN", "indexName": "rsvp_1_time_-1",
+                                                      "keyPattern": {"rsvp": 1, "time": -1}}}}},
+    "executionStats": {"nReturned": 10, "executionTimeMillis": 0,
+                       "totalKeysExamined": 10, "totalDocsExamined": 10,
+                       "executionStages": {"stage": "LIMIT", "nReturned": 10}},
+    "ok": 1.0}
+
+# slot based engine plans nest the tree under queryPlan, sharded output
+# is keyed by shard
+SHARDED_SBE = {
+    "shards": {
+        "shard0": {"queryPlanner": {"winningPlan": {"queryPlan": {
+            "stage": "SORT", "sortPattern": {"time": 1},
+            "inputStage": {"stage": "IXSCAN", "indexName": "rsvp_1"}}}},
+            "executionStats": {"nReturned": 5, "totalKeysExamined": 900, "totalDocsExamined": 900,
+                               "executionTimeMillis": 4}},
+        "shard1": {"queryPlanner": {"winningPlan": {"queryPlan": {
+            "stage": "IXSCAN", "indexName": "rsvp_1"}}},
+            "executionStats": {"nReturned": 5, "totalKeysExamined": 5, "totalDocsExamined": 5,
+                               "executionTimeMillis": 1}}},
+    "ok": 1.0}
+
+
+class FakeDatabase:
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.commands = []
+
+    def command(self, command):
+        self.commands.append(command)
+        return self.reply
+
+
+class FakeCollection:
+
+    def __init__(self, reply):
+        self.name = "events"
+        self.codec_options = CodecOptions()
+        self.database = FakeDatabase(reply)
+
+
+class TestExplain(unittest.TestCase):
+
+    def test_command(self):
+        collection = FakeCollection(INDEXED_FIND)
+        p = pymag.Pipeline([pymag.match({"rsvp": "yes"}), pymag.limit(10)])
+        summary = p.explain(collection)
+        command, = collection.database.commands
+        self.assertEqual(list(command), ["explain", "verbosity"])
+        self.assertEqual(command["verbosity"], "executionStats")
+        self.assertEqual(command["explain"]["aggregate"], "events")
+        self.assertEqual(command["explain"]["pipeline"], p())
+        self.assertTrue(summary)
+        self.assertRaises(ValueError, p.explain, collection, verbosity="everything")
+
+    def test_indexed(self):
+        summary = ExplainSummary(INDEXED_FIND)
+        stage, = summary.stages
+        self.assertEqual(stage.name, "query")
+        self.assertEqual(stage.indexes, ["rsvp_1_time_-1"])
+        self.assertFalse(stage.collscan)
+        self.assertEqual((stage.keys_examined, stage.docs_examined, stage.n_returned), (10, 10, 10))
+        self.assertEqual(summary.flags, [])
+
+    def test_collscan_group_sort(self):
+        summary = ExplainSummary(COLLSCAN_GROUP_SORT)
+        self.assertEqual([s.name for s in summary.stages], ["query", "$group", "$sort"])
+        query, grouper, sorter = summary.stages
+        self.assertTrue(query.collscan)
+        self.assertEqual(query.docs_examined, 50000)
+        self.assertEqual(query.n_returned, 120)
+        self.assertFalse(grouper.used_disk)
+        self.assertTrue(sorter.blocking_sort)
+        self.assertTrue(sorter.used_disk)
+        self.assertFalse(summary)
+        self.assertEqual(summary.rules(), ["collscan", "docs_examined", "blocking_sort", "used_disk"])
+        self.assertIn("query: docs_examined: 50000 docs examined to return 120", str(summary))
+
+    def test_sharded(self):
+        summary = ExplainSummary(SHARDED_SBE, max_ratio=100)
+        self.assertEqual([s.label for s in summary.stages], ["shard0:query", "shard1:query"])
+        self.assertEqual(summary.stages[0].indexes, ["rsvp_1"])
+        self.assertEqual(summary.rules(), ["blocking_sort", "keys_examined", "docs_examined"])
+        self.assertEqual({f.stage for f in summary.flags}, {"shard0:query"})
+
+    def test_query_planner_only(self):
+        summary = ExplainSummary({"queryPlanner": INDEXED_FIND["queryPlanner"]})
+        stage, = summary.stages
+        self.assertIsNone(stage.n_returned)
+        self.assertEqual(stage.indexes, ["rsvp_1_time_-1"])
+        self.assertRaises(ValueError, ExplainSummary, {"ok": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
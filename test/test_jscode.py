@@ -1,14 +1,22 @@
 import unittest
 import os
+import re
+import shutil
+import tempfile
+from unittest import mock
 
 from pymag import JSCode
-from .simple_function import simple_function
+from .simplefunction import simple_function
 
 
 def dummy_function(x: int, y: int, z: int):
     return [x, y, z]
 
 
+def other_function(a):
+    return a
+
+
 class TestJSCode(unittest.TestCase):
 
     @staticmethod
@@ -32,5 +40,114 @@ class TestJSCode(unittest.TestCase):
         print(x.js_code_min)
         os.unlink(x.hash_path)
 
+class TestJSCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = mock.patch.dict(os.environ, {JSCode.CACHE_ENV: self.directory})
+        self.env.start()
+        JSCode.clear_memo()
+
+    def tearDown(self):
+        self.env.stop()
+        JSCode.clear_memo()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def fake_transcrypt(cmd, cwd, **kwargs):
+        """
+        Write an export for every def in the module, returning a list of
+        its argument names, as transcrypt would for dummy_function.
+        """
+        root, _ = os.path.splitext(cmd[-1])
+        with open(os.path.join(cwd, cmd[-1])) as source:
+            defs = re.findall(r"^def (\w+)\((.*)\):", source.read(), re.M)
+        os.makedirs(os.path.join(cwd, JSCode.TARGET_DIR), exist_ok=True)
+        with open(os.path.join(cwd, JSCode.TARGET_DIR, f"{root}.js"), "w") as js:
+            for name, args in defs:
+                args = ", ".join(a.split(":")[0].strip() for a in args.split(","))
+                js.write(f"export var {name} = function ({args}) {{\n")
+                js.write(f"\treturn [{args}];\n")
+                js.write("};\n")
+
+    def test_miss_then_hit(self):
+        cwd = os.listdir(".")
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt) as run:
+            x = JSCode(dummy_function, "a")
+            self.assertEqual(run.call_count, 1)
+            self.assertEqual(run.call_args.kwargs["cwd"], self.directory)
+            self.assertEqual(x.js_code_min, "function (x, y, z) {return [x, y, z];};")
+            self.assertTrue(os.path.exists(x.cache_path))
+
+            JSCode(dummy_function, "a")
+            JSCode.clear_memo()
+            y = JSCode(dummy_function, "b")
+            self.assertEqual(run.call_count, 1)
+            self.assertEqual(y.js_code_min, x.js_code_min)
+        self.assertEqual(os.listdir("."), cwd)
+
+    def test_hit_writes_nothing(self):
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt):
+            x = JSCode(dummy_function)
+        shutil.rmtree(os.path.join(self.directory, JSCode.TARGET_DIR))
+        os.unlink(x.hash_path)
+        before = sorted(os.listdir(self.directory))
+        JSCode.clear_memo()
+        with mock.patch("pymag.jscode.subprocess.run") as run:
+            y = JSCode(dummy_function)
+        run.assert_not_called()
+        self.assertEqual(sorted(os.listdir(self.directory)), before)
+        self.assertEqual(y.js_code, x.js_code)
+
+    def test_memo_hit_skips_source(self):
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt):
+            x = JSCode(dummy_function)
+        with mock.patch("pymag.jscode.inspect.getsource") as getsource:
+            y = JSCode(dummy_function, "a")
+        getsource.assert_not_called()
+        self.assertEqual(y.cache_key, x.cache_key)
+        self.assertEqual(y.js_code, x.js_code)
+
+    def test_hash_path_writes_nothing(self):
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt):
+            x = JSCode(dummy_function)
+        os.unlink(x.hash_path)
+        self.assertFalse(os.path.exists(x.hash_path))
+        x.write_source()
+        self.assertTrue(os.path.exists(x.hash_path))
+
+    def test_transcrypt_version_in_key(self):
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt) as run:
+            JSCode(dummy_function)
+            JSCode.clear_memo()
+            with mock.patch.object(JSCode, "_transcrypt_version", "0.0.0"):
+                JSCode(dummy_function)
+            self.assertEqual(run.call_count, 2)
+
+    def test_batch(self):
+        cwd = os.listdir(".")
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt) as run:
+            dummy, other = JSCode.batch([(dummy_function, "a", "b", "c"), other_function])
+            self.assertEqual(run.call_count, 1)
+            self.assertEqual(dummy.js_code_min, "function (x, y, z) {return [x, y, z];};")
+            self.assertEqual(dummy()["args"], ["$a", "$b", "$c"])
+            self.assertEqual(other.js_code_min, "function (a) {return [a];};")
+
+            JSCode.clear_memo()
+            self.assertEqual(JSCode(other_function).js_code, other.js_code)
+            again = JSCode.batch([dummy_function, other_function])
+            self.assertEqual(run.call_count, 1)
+            self.assertEqual([c.js_code for c in again], [dummy.js_code, other.js_code])
+        self.assertEqual(os.listdir("."), cwd)
+
+    def test_batch_partial_hit(self):
+        with mock.patch("pymag.jscode.subprocess.run", side_effect=self.fake_transcrypt) as run:
+            JSCode(dummy_function)
+            JSCode.batch([dummy_function, other_function])
+            self.assertEqual(run.call_count, 2)
+            with open(os.path.join(self.directory, run.call_args.args[0][-1])) as module:
+                self.assertNotIn("dummy_function", module.read())
+
+
 if __name__ == '__main__':
     unittest.main()
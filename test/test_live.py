@@ -0,0 +1,132 @@
+import threading
+import unittest
+
+import pymag
+from pymag.live import LiveAggregate
+from test.localcollection import LocalCollection
+
+
+class EventCollection(LocalCollection):
+    """
+    Stands in for the change stream by returning the change event for
+    each write, with the client time as its cluster time.
+    """
+
+    @property
+    def aggregates(self):
+        return len(self.pipelines)
+
+    def _event(self, operation, before, after):
+        client = self.database.client
+        client.time = client.time + 1
+        return {"operationType": operation, "clusterTime": client.time,
+                "fullDocumentBeforeChange": before, "fullDocument": after}
+
+    def insert(self, doc):
+        self.docs[doc["_id"]] = doc
+        return self._event("insert", None, doc)
+
+    def update(self, _id, **fields):
+        before = self.docs[_id]
+        self.docs[_id] = dict(before, **fields)
+        return self._event("update", before, self.docs[_id])
+
+    def delete(self, _id):
+        return self._event("delete", self.docs.pop(_id), None)
+
+
+def attendee(i, name, rsvp="yes", score=1):
+    return {"_id": i, "name": name, "rsvp": rsvp, "score": score}
+
+
+class TestLiveAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = EventCollection(docs=[attendee(1, "joe"), attendee(2, "joe", score=5),
+                                             attendee(3, "ann", score=2), attendee(4, "ann", rsvp="no")])
+        self.pipeline = pymag.Pipeline([pymag.match({"rsvp": "yes"}),
+                                        pymag.group({"_id": "$name", "event_count": {"$sum": 1},
+                                                     "best": {"$max": "$score"}})])
+        self.live = LiveAggregate(self.collection, self.pipeline)
+        self.live.resync()
+
+    def check(self):
+        """
+        The live state is what running the pipeline from scratch gives.
+        """
+        expected = {d["_id"]: d for d in self.pipeline.aggregate(self.collection)}
+        self.assertEqual({d["_id"]: d for d in self.live.values()}, expected)
+
+    def test_initial(self):
+        self.assertEqual(self.live.get("joe"), {"_id": "joe", "event_count": 2, "best": 5})
+        self.assertEqual(self.live["ann"]["event_count"], 1)
+        self.assertNotIn("bob", self.live)
+        self.assertEqual([d["_id"] for d in self.live.top(1, "event_count")], ["joe"])
+
+    def test_top_in_bson_order(self):
+        self.live.apply(self.collection.insert(attendee(5, "bob", score=None)))
+        self.live.apply(self.collection.insert(attendee(6, "cat", score="high")))
+        self.assertEqual([d["_id"] for d in self.live.top(4, "best")], ["cat", "joe", "ann", "bob"])
+
+    def test_events(self):
+        self.live.apply(self.collection.insert(attendee(5, "bob", score=3)))
+        self.live.apply(self.collection.insert(attendee(6, "ann", rsvp="no")))
+        self.live.apply(self.collection.update(4, rsvp="yes", score=7))
+        self.live.apply(self.collection.update(1, name="bob"))
+        self.live.apply(self.collection.delete(3))
+        self.check()
+        self.assertEqual(self.live.get("ann"), {"_id": "ann", "event_count": 1, "best": 7})
+        self.assertEqual(self.collection.aggregates, 2)
+
+    def test_group_removed(self):
+        self.live.apply(self.collection.update(3, rsvp="no"))
+        self.live.apply(self.collection.delete(4))
+        self.assertNotIn("ann", self.live)
+        self.check()
+
+    def test_resync(self):
+        aggregates = self.collection.aggregates
+        # removing the current $max needs the group recomputed
+        self.live.apply(self.collection.delete(2))
+        self.assertEqual(self.collection.aggregates, aggregates + 1)
+        self.check()
+        aggregates = self.collection.aggregates
+        event = self.collection.insert(attendee(7, "joe"))
+        self.live.apply(dict(event, fullDocument=None))
+        self.assertEqual(self.collection.aggregates, aggregates + 1)
+        # events up to the resync are already in the state
+        self.live.apply(event)
+        self.check()
+
+    def test_concurrent_reads(self):
+        errors = []
+
+        def insert():
+            try:
+                for i in range(100, 3000):
+                    self.live.apply(self.collection.insert(attendee(i, f"member {i}")))
+            except Exception as e:
+                errors.append(e)
+
+        writer = threading.Thread(target=insert)
+        writer.start()
+        try:
+            while writer.is_alive():
+                self.live.top(5, "event_count")
+                self.live.values()
+        except Exception as e:
+            errors.append(e)
+        writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.live), 2902)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, LiveAggregate, self.collection, pymag.Pipeline([pymag.match({})]))
+        self.assertRaises(ValueError, LiveAggregate, self.collection,
+                          pymag.Pipeline([pymag.project({"a": 1}), pymag.group({"_id": "$a"})]))
+        self.assertRaises(ValueError, LiveAggregate, self.collection,
+                          pymag.Pipeline([pymag.group({"_id": "$a", "x": {"$avg": "$b"}})]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from datetime import datetime
+
+from pymag.matcher import compile_filter
+from pymag.stages import match
+
+
+class TestMatcher(unittest.TestCase):
+
+    def test_equality(self):
+        p = compile_filter({"name": "Joe"})
+        self.assertTrue(p({"name": "Joe"}))
+        self.assertFalse(p({"name": "Mary"}))
+        self.assertFalse(p({}))
+        self.assertTrue(p({"name": ["Mary", "Joe"]}))
+
+        p = compile_filter({"count": 1})
+        self.assertTrue(p({"count": 1.0}))
+        self.assertFalse(p({"count": True}))
+
+        p = compile_filter({"name": None})
+        self.assertTrue(p({}))
+        self.assertTrue(p({"name": None}))
+
+        p = compile_filter({})
+        self.assertTrue(p({"anything": 1}))
+
+    def test_comparisons(self):
+        p = compile_filter({"age": {"$gt": 18, "$lte": 65}})
+        self.assertTrue(p({"age": 19}))
+        self.assertTrue(p({"age": 65}))
+        self.assertFalse(p({"age": 18}))
+        self.assertFalse(p({"age": "40"}))
+        self.assertFalse(p({}))
+
+        p = compile_filter({"age": {"$lt": 18}})
+        self.assertTrue(p({"age": [30, 10]}))
+
+        p = compile_filter({"when": {"$gte": datetime(2020, 1, 1)}})
+        self.assertTrue(p({"when": datetime(2021, 1, 1)}))
+        self.assertFalse(p({"when": datetime(2019, 1, 1)}))
+
+        p = compile_filter({"name": {"$ne": "Joe"}})
+        self.assertFalse(p({"name": "Joe"}))
+        self.assertTrue(p({"name": "Mary"}))
+        self.assertTrue(p({}))
+
+        p = compile_filter({"name": {"$eq": "Joe"}})
+        self.assertTrue(p({"name": "Joe"}))
+
+    def test_in_nin(self):
+        p = compile_filter({"city": {"$in": ["Dublin", "London"]}})
+        self.assertTrue(p({"city": "Dublin"}))
+        self.assertTrue(p({"city": ["Paris", "London"]}))
+        self.assertFalse(p({"city": "Paris"}))
+
+        p = compile_filter({"n": {"$in": [1, None]}})
+        self.assertTrue(p({"n": 1}))
+        self.assertTrue(p({}))
+
+        p = compile_filter({"city": {"$nin": ["Dublin", "London"]}})
+        self.assertFalse(p({"city": "Dublin"}))
+        self.assertTrue(p({"city": "Paris"}))
+
+        self.assertRaises(ValueError, compile_filter, {"city": {"$in": "Dublin"}})
+
+    def test_exists(self):
+        p = compile_filter({"a.b": {"$exists": True}})
+        self.assertTrue(p({"a": {"b": None}}))
+        self.assertFalse(p({"a": {}}))
+
+        p = compile_filter({"a": {"$exists": False}})
+        self.assertTrue(p({}))
+        self.assertFalse(p({"a": 1}))
+
+    def test_logical(self):
+        p = compile_filter({"$or": [{"a": 1}, {"b": {"$gt": 5}}]})
+        self.assertTrue(p({"a": 1}))
+        self.assertTrue(p({"b": 6}))
+        self.assertFalse(p({"a": 2, "b": 5}))
+
+        p = compile_filter({"$and": [{"a": 1}, {"b": 2}], "c": 3})
+        self.assertTrue(p({"a": 1, "b": 2, "c": 3}))
+        self.assertFalse(p({"a": 1, "b": 2}))
+
+        self.assertRaises(ValueError, compile_filter, {"$or": []})
+        self.assertRaises(ValueError, compile_filter, {"$where": "true"})
+        self.assertRaises(ValueError, compile_filter, {"a": {"$regex": "x"}})
+
+    def test_dotted_paths(self):
+        p = compile_filter({"attendee.member.name": "Joe"})
+        self.assertTrue(p({"attendee": {"member": {"name": "Joe"}}}))
+        self.assertFalse(p({"attendee": {"member": "Joe"}}))
+        self.assertTrue(p({"attendee": [{"member": {"name": "Mary"}}, {"member": {"name": "Joe"}}]}))
+
+    def test_paths_through_arrays(self):
+        missing = {"a": [{"c": 1}]}
+        partial = {"a": [{"c": 1}, {"b": 2}]}
+        p = compile_filter({"a.b": {"$exists": True}})
+        self.assertFalse(p(missing))
+        self.assertTrue(p(partial))
+
+        p = compile_filter({"a.b": None})
+        self.assertTrue(p(missing))
+        self.assertTrue(p(partial))
+        self.assertFalse(p({"a": [{"b": 1}]}))
+        self.assertFalse(compile_filter({"a.b": {"$ne": None}})(partial))
+        self.assertTrue(compile_filter({"a.b": 2})(partial))
+        self.assertEqual(len(list(match({"a.b": None}).filter([missing, partial, {"a": [{"b": 1}]}]))), 2)
+
+    def test_match_stage(self):
+        m = match({"attendee.rsvp.response": "yes",
+                   "attendee.member.name": {"$ne": "Former member"}})
+        docs = [{"attendee": {"rsvp": {"response": "yes"}, "member": {"name": "Joe"}}},
+                {"attendee": {"rsvp": {"response": "no"}, "member": {"name": "Mary"}}},
+                {"attendee": {"rsvp": {"response": "yes"}, "member": {"name": "Former member"}}}]
+        self.assertTrue(m.compile()(docs[0]))
+        self.assertEqual([docs[0]], list(m.filter(docs)))
+
+        m = match.range_query("n", 2, 3)
+        self.assertEqual([{"n": 2}, {"n": 3}], list(m.filter({"n": i} for i in range(5))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import itertools
+import unittest
+from types import SimpleNamespace
+
+from bson.codec_options import CodecOptions
+
+import pymag
+from pymag.aggregation import CursorIterator
+from pymag.monitoring import PipelineMonitor, PipelineStats, command_fingerprint
+
+ADDRESS = ("localhost", 27017)
+
+
+class FakeCursor:
+    """
+    Serves documents in batches, sending getMore and killCursors events to
+    the listener like a pymongo CommandCursor would.
+    """
+
+    def __init__(self, collection, cursor_id, batches):
+        self._collection = collection
+        self._id = cursor_id
+        self._batches = batches
+        self._current = iter([])
+
+    def next(self):
+        for doc in self._current:
+            return doc
+        if not self._batches or not self._id:
+            raise StopIteration
+        batch = self._batches.pop(0)
+        next_id = self._id if self._batches else 0
+        self._collection.command("getMore", {"getMore": self._id},
+                                 {"cursor": {"id": next_id, "nextBatch": batch}})
+        self._id = next_id
+        self._current = iter(batch)
+        return self.next()
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        if self._id:
+            self._collection.command("killCursors", {"cursors": [self._id]}, {"ok": 1})
+            self._id = 0
+
+
+class FakeCollection:
+
+    def __init__(self, listener, docs, batch_size=2):
+        self.codec_options = CodecOptions()
+        self._listener = listener
+        self._docs = docs
+        self._batch_size = batch_size
+        self._request_ids = itertools.count(1)
+
+    def command(self, name, command, reply):
+        request_id = next(self._request_ids)
+        self._listener.started(SimpleNamespace(command_name=name, command=command,
+                                               request_id=request_id, connection_id=ADDRESS))
+        self._listener.succeeded(SimpleNamespace(command_name=name, reply=reply,
+                                                 request_id=request_id, connection_id=ADDRESS))
+
+    def aggregate(self, pipeline, **kwargs):
+        n = self._batch_size
+        batches = [self._docs[i:i + n] for i in range(0, len(self._docs), n)] or [[]]
+        cursor_id = 77 if len(batches) > 1 else 0
+        self.command("aggregate", {"aggregate": "coll", "pipeline": pipeline},
+                     {"cursor": {"id": cursor_id, "firstBatch": batches[0]}})
+        cursor = FakeCursor(self, cursor_id, batches[1:])
+        cursor._current = iter(batches[0])
+        return cursor
+
+
+class TestMonitoring(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = PipelineMonitor()
+        self.docs = [{"_id": i} for i in range(5)]
+        self.pipeline = pymag.Pipeline([pymag.match({"a": 1}), pymag.limit(10)])
+
+    def test_fingerprint(self):
+        frozen = self.pipeline.freeze()
+        self.assertEqual(command_fingerprint({"pipeline": frozen()}), frozen.fingerprint)
+        self.assertEqual(command_fingerprint({"pipeline": self.pipeline()}), frozen.fingerprint)
+
+    def test_exhausted(self):
+        collection = FakeCollection(self.monitor, self.docs)
+        self.assertEqual(list(self.pipeline.aggregate(collection, monitor=self.monitor)), self.docs)
+        record = self.monitor.stats[self.pipeline.freeze().fingerprint]
+        self.assertEqual(record.runs, 1)
+        self.assertEqual(record.round_trips, 3)
+        self.assertEqual(record.batch_sizes, [2, 2, 1])
+        self.assertEqual(record.documents, 5)
+        self.assertGreater(record.bytes_received, 0)
+        self.assertEqual(len(record.first_doc_times), 1)
+        self.assertEqual(len(record.wall_times), 1)
+        self.assertEqual(self.monitor._cursors, {})
+
+    def test_not_expected(self):
+        collection = FakeCollection(self.monitor, self.docs)
+        list(self.pipeline.aggregate(collection))
+        self.assertEqual(len(self.monitor.stats), 0)
+
+        monitor = PipelineMonitor(record_all=True)
+        list(self.pipeline.aggregate(FakeCollection(monitor, self.docs)))
+        self.assertEqual(monitor.stats.fingerprints(), [self.pipeline.freeze().fingerprint])
+
+    def test_cursor_iterator(self):
+        collection = FakeCollection(self.monitor, self.docs)
+        iterator = CursorIterator(self.pipeline.aggregate(collection, monitor=self.monitor), monitor=self.monitor)
+        iterator.limit = 3
+        iterator.print()
+        record = iterator.record
+        self.assertEqual(iterator.fingerprint, self.pipeline.freeze().fingerprint)
+        self.assertEqual(record.round_trips, 2)
+        self.assertEqual(record.batch_sizes, [2, 2])
+        self.assertEqual(len(record.wall_times), 1)
+        self.assertIsNone(CursorIterator(iter([])).record)
+
+    def test_failure(self):
+        self.monitor.expect(self.pipeline.freeze().fingerprint)
+        self.monitor.started(SimpleNamespace(command_name="aggregate", command={"pipeline": self.pipeline()},
+                                             request_id=1, connection_id=ADDRESS))
+        self.monitor.failed(SimpleNamespace(command_name="aggregate", request_id=1, connection_id=ADDRESS))
+        record = self.monitor.stats[self.pipeline.freeze().fingerprint]
+        self.assertEqual((record.runs, record.failures, record.round_trips), (1, 1, 1))
+        self.assertIsNone(record.mean_time_to_first_doc)
+
+    def test_stats(self):
+        stats = PipelineStats()
+        stats.record("a").round_trips = 1
+        stats.record("b").round_trips = 5
+        self.assertEqual([r.fingerprint for r in stats.top(1)], ["b"])
+        self.assertIn("a", stats)
+        self.assertEqual(stats["a"].as_dict()["round_trips"], 1)
+        stats.reset()
+        self.assertEqual(len(stats), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
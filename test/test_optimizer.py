@@ -0,0 +1,96 @@
+import unittest
+
+import pymongo
+
+from pymag.aggregation import Aggregation
+from pymag.optimizer import optimize, filter_fields
+from pymag.pipeline import Pipeline
+from pymag.stages import match, project, addFields, unwind, sort, limit, skip, group, out
+
+
+class TestOptimizer(unittest.TestCase):
+
+    def test_merge_matches(self):
+        stages, report = optimize([match({"a": 1}), match({"b": 2}), match({"a": {"$gt": 0}})])
+        self.assertEqual(1, len(stages))
+        self.assertEqual({"$and": [{"a": 1, "b": 2}, {"a": {"$gt": 0}}]}, stages[0].arg)
+        self.assertEqual(["merge_match", "merge_match"], report.rules())
+
+        stages, report = optimize([match(), group({"_id": "$a"})])
+        self.assertEqual(["$group"], [s.op_name for s in stages])
+        self.assertEqual(["drop_empty_match"], report.rules())
+
+    def test_move_match(self):
+        expensive = [unwind({"path": "$tags"}),
+                     addFields({"total": {"$add": ["$x", "$y"]}}),
+                     project({"name": 1, "total": 1, "tags": 1})]
+
+        stages, report = optimize(expensive + [match({"name": "Joe"})])
+        self.assertEqual(["$match", "$unwind", "$addFields", "$project"], [s.op_name for s in stages])
+        self.assertEqual(["move_match"] * 3, report.rules())
+
+        stages, _ = optimize(expensive + [match({"total": {"$gt": 10}})])
+        self.assertEqual(["$unwind", "$addFields", "$match", "$project"], [s.op_name for s in stages])
+
+        stages, _ = optimize(expensive + [match({"tags": "x"})])
+        self.assertEqual(["$unwind", "$match", "$addFields", "$project"], [s.op_name for s in stages])
+
+        # filter on a field removed by the projection must stay after it
+        stages, _ = optimize([project({"name": 1}), match({"age": 10})])
+        self.assertEqual(["$project", "$match"], [s.op_name for s in stages])
+        stages, _ = optimize([project({"age": 0}), match({"age": 10})])
+        self.assertEqual(["$project", "$match"], [s.op_name for s in stages])
+
+        stages, _ = optimize([group({"_id": "$a"}), match({"_id": 1})])
+        self.assertEqual(["$group", "$match"], [s.op_name for s in stages])
+
+        stages, _ = optimize([project({"a": 1}), match({"$expr": {"$gt": ["$a", 1]}})])
+        self.assertEqual(["$project", "$match"], [s.op_name for s in stages])
+
+    def test_top_k(self):
+        stages, report = optimize([sort(("score", pymongo.DESCENDING)),
+                                   project({"score": 1}),
+                                   skip(5),
+                                   limit(10)])
+        self.assertEqual(["$sort", "$limit", "$project", "$skip"], [s.op_name for s in stages])
+        self.assertEqual(15, stages[1].arg)
+        self.assertIn("top_k", report.rules())
+
+    def test_collapse_skip_limit(self):
+        stages, _ = optimize([skip(2), skip(3), limit(10), limit(4)])
+        self.assertEqual([("$limit", 9), ("$skip", 5)], [(s.op_name, s.arg) for s in stages])
+
+    def test_originals_untouched(self):
+        m1 = match({"a": 1})
+        m2 = match({"b": 2})
+        optimize([m1, m2])
+        self.assertEqual({"a": 1}, m1.arg)
+        self.assertEqual({"b": 2}, m2.arg)
+
+    def test_filter_fields(self):
+        self.assertEqual({"a", "b.c"}, filter_fields({"a": 1, "$or": [{"b.c": 2}]}))
+        self.assertIsNone(filter_fields({"$where": "true"}))
+
+    def test_pipeline_optimize(self):
+        p = Pipeline([project({"name": 1, "age": 1}), match({"age": {"$gte": 18}}), out("adults")])
+        optimized, report = p.optimize()
+        self.assertIsInstance(optimized, Pipeline)
+        self.assertEqual(["$match", "$project", "$out"], [s.op_name for s in optimized])
+        self.assertEqual(1, len(report))
+        self.assertEqual(["$project", "$match", "$out"], [s.op_name for s in p])
+
+        docs = [{"name": "a", "age": i} for i in range(30)]
+        p = Pipeline([sort(("age", pymongo.DESCENDING)), skip(2), limit(3), project({"_id": 0, "age": 1})])
+        optimized, _ = p.optimize()
+        self.assertEqual(list(p.aggregate_local(docs)), list(optimized.aggregate_local(docs)))
+
+    def test_aggregation_optimize(self):
+        a = Aggregation(match({"a": 1}), match({"b": 1}))
+        optimized, report = a.optimize()
+        self.assertIsInstance(optimized, Aggregation)
+        self.assertEqual(1, len(optimized))
+        self.assertEqual("0: merge_match: match({'a': 1}) and match({'b': 1}) merged", str(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
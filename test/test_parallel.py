@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pymongo
+
+from pymag.parallel import PartitionedAggregation, split_range
+from pymag.pipeline import Pipeline
+from pymag.reducer import GroupReducer
+from pymag.stages import match, group, sort, project, limit, BoolStage
+from test.localcollection import LocalCollection
+
+
+def events():
+    start = datetime(2018, 1, 1)
+    names = ["joe", "mary", "sean"]
+    return [{"_id": i, "name": names[i % 3], "time": start + timedelta(days=i), "n": i}
+            for i in range(365)]
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_split_range(self):
+        self.assertEqual([0, 2, 5, 7, 10], split_range(0, 10, 4))
+        self.assertEqual([0, 1, 2], split_range(0, 2, 5))
+        self.assertEqual([0.0, 0.5, 1.0], split_range(0.0, 1.0, 2))
+        bounds = split_range(datetime(2018, 1, 1), datetime(2018, 1, 5), 2)
+        self.assertEqual(datetime(2018, 1, 3), bounds[1])
+        self.assertRaises(ValueError, split_range, 0, 10, 0)
+        self.assertRaises(ValueError, split_range, 0, datetime(2018, 1, 1), 2)
+        self.assertRaises(ValueError, split_range, "a", "z", 2)
+
+    def test_slices(self):
+        m = BoolStage.time_range_query("time", datetime(2018, 1, 1), datetime(2018, 12, 31))
+        runner = PartitionedAggregation(Pipeline([m, group({"_id": "$name", "count": {"$sum": 1}})]),
+                                        partitions=3)
+        slices = runner.slices()
+        self.assertEqual(3, len(slices))
+        self.assertEqual("$gte", next(iter(slices[0][0].arg["time"])))
+        self.assertEqual(["$gte", "$lt"], list(slices[1][0].arg["time"]))
+        self.assertEqual(["$gte", "$lte"], list(slices[2][0].arg["time"]))
+
+    def test_group_rereduce(self):
+        docs = events()
+        p = Pipeline([match.range_query("time", datetime(2018, 2, 1), datetime(2018, 11, 30)),
+                      match({"n": {"$gte": 0}}),
+                      group({"_id": "$name",
+                             "count": {"$sum": 1},
+                             "total": {"$sum": "$n"},
+                             "first": {"$min": "$time"},
+                             "last": {"$max": "$time"}}),
+                      sort(("count", pymongo.DESCENDING), "_id")])
+        collection = LocalCollection(docs=docs)
+        results = PartitionedAggregation(p, partitions=6).aggregate(collection)
+        self.assertEqual(list(p.aggregate_local(docs)), results)
+        self.assertEqual(6, len(collection.pipelines))
+        self.assertTrue(all("$group" in p[-1] for p, _ in collection.pipelines))
+
+    def test_no_group(self):
+        docs = events()
+        p = Pipeline([match.range_query("n", 10, 100), project({"n": 1})])
+        results = PartitionedAggregation(p, partitions=4, workers=2).aggregate(LocalCollection(docs=docs))
+        self.assertEqual(sorted(d["n"] for d in p.aggregate_local(docs)), sorted(d["n"] for d in results))
+
+    def test_invalid(self):
+        g = group({"_id": "$name", "names": {"$push": "$name"}})
+        self.assertRaises(ValueError, PartitionedAggregation, Pipeline([match.range_query("n", 1, 10), g]))
+        self.assertRaises(ValueError, PartitionedAggregation, Pipeline([match({"n": 1})]))
+        self.assertRaises(ValueError, PartitionedAggregation, Pipeline([match.range_query("n", 1)]))
+        self.assertRaises(ValueError, PartitionedAggregation,
+                          Pipeline([match.range_query("n", 1, 10), limit(5), group({"_id": None})]))
+
+    def test_reducer(self):
+        reducer = GroupReducer(group({"_id": "$k", "c": {"$count": {}}, "lo": {"$min": "$v"}}))
+        merged = reducer.merge([{"_id": 1, "c": 2, "lo": 5}, {"_id": 2, "c": 1, "lo": 1},
+                                {"_id": 1, "c": 3, "lo": None}])
+        self.assertEqual([{"_id": 1, "c": 5, "lo": 5}, {"_id": 2, "c": 1, "lo": 1}], merged)
+        self.assertEqual([{"$set": {"c": {"$add": [{"$ifNull": ["$c", 0]}, {"$ifNull": ["$$new.c", 0]}]},
+                                    "lo": {"$min": ["$lo", "$$new.lo"]}}}],
+                         reducer.merge_update())
+
+
+if __name__ == '__main__':
+    unittest.main()
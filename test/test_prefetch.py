@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+
+from bson.codec_options import CodecOptions
+
+import pymag
+from pymag.aggregation import CursorIterator, PrefetchIterator
+
+
+class FakeCursor:
+
+    def __init__(self, n, fail_at=None, delay=0):
+        self._docs = iter(range(n))
+        self._fail_at = fail_at
+        self._delay = delay
+        self.read = 0
+        self.closed = False
+        self.size = None
+        self.threads = set()
+
+    def batch_size(self, n):
+        self.size = n
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.threads.add(threading.current_thread())
+        if self.read == self._fail_at:
+            raise RuntimeError("getMore failed")
+        time.sleep(self._delay)
+        doc = next(self._docs)
+        self.read = self.read + 1
+        return {"_id": doc}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+
+    def __init__(self, cursor):
+        self.codec_options = CodecOptions()
+        self.cursor = cursor
+        self.kwargs = None
+
+    def aggregate(self, pipeline, **kwargs):
+        self.kwargs = kwargs
+        return self.cursor
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def test_all(self):
+        cursor = FakeCursor(25)
+        docs = PrefetchIterator(cursor, batch_size=10, depth=2)
+        self.assertEqual(cursor.size, 10)
+        self.assertEqual([d["_id"] for d in docs], list(range(25)))
+        self.assertTrue(cursor.closed)
+        self.assertNotIn(threading.current_thread(), cursor.threads)
+
+    def test_batches(self):
+        for n in (0, 10, 20):
+            with PrefetchIterator(FakeCursor(n), batch_size=10) as docs:
+                self.assertEqual([len(b) for b in docs.batches()], [10] * (n // 10))
+
+    def test_early_exit(self):
+        cursor = FakeCursor(10_000)
+        docs = PrefetchIterator(cursor, batch_size=10, depth=2)
+        for doc in docs:
+            if doc["_id"] == 5:
+                break
+        self.assertTrue(cursor.closed)
+        self.assertFalse(docs._thread.is_alive())
+        # one batch being consumed, two queued and one waiting to be put
+        self.assertLessEqual(cursor.read, 40)
+
+    def test_error(self):
+        docs = PrefetchIterator(FakeCursor(100, fail_at=15), batch_size=10)
+        seen = []
+        with self.assertRaises(RuntimeError):
+            for doc in docs:
+                seen.append(doc)
+        self.assertEqual(len(seen), 10)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, PrefetchIterator, FakeCursor(1), batch_size=0)
+        self.assertRaises(ValueError, PrefetchIterator, FakeCursor(1), depth=0)
+
+    def test_overlap(self):
+        def consume(docs):
+            start = time.perf_counter()
+            for _ in docs:
+                time.sleep(0.001)
+            return time.perf_counter() - start
+        serial = consume(FakeCursor(100, delay=0.001))
+        prefetched = consume(PrefetchIterator(FakeCursor(100, delay=0.001), batch_size=10))
+        self.assertLess(prefetched, serial)
+
+    def test_pipeline_and_print(self):
+        collection = FakeCollection(FakeCursor(30))
+        docs = pymag.Pipeline([pymag.match({})]).aggregate_prefetch(collection, batch_size=7, depth=3)
+        self.assertEqual(collection.kwargs, {"batchSize": 7})
+        self.assertEqual(len(list(docs)), 30)
+
+        cursor = FakeCursor(30)
+        iterator = CursorIterator(cursor, prefetch=2, batch_size=5)
+        iterator.limit = 3
+        iterator.print()
+        self.assertTrue(cursor.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
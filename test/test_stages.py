@@ -107,6 +107,27 @@ class Test(unittest.TestCase):
         op = sort(name=1, date=-1)
         # print(op)
 
+    def test_slots(self):
+        op = match({"a": 1})
+        self.assertFalse(hasattr(op, "__dict__"))
+        self.assertRaises(AttributeError, setattr, op, "other", 1)
+        self.assertEqual(match._op_name, "$match")
+        self.assertEqual(Example_for_Sample_Op_with_name().name, "sample")
+
+    def test_lazy(self):
+        AggStage.lazy = True
+        try:
+            op = limit(-1)
+            self.assertRaises(ValueError, op)
+            self.assertRaises(ValueError, op.raw)
+            op = out("system.x")
+            self.assertRaises(ValueError, op)
+            op = match({"a": 1})
+            self.assertEqual(op(), {"$match": {"a": 1}})
+        finally:
+            AggStage.lazy = False
+        self.assertRaises(ValueError, limit, -1)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
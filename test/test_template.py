@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+import pymag
+from pymag import PipelineTemplate, param
+
+
+def tenant_template():
+    return PipelineTemplate(pymag.Pipeline([
+        pymag.match({"tenant": param("tenant"),
+                     "time": {"$gte": param("start"), "$lt": param("end")},
+                     "rsvp": {"$in": ["yes", "maybe"]}}),
+        pymag.group({"_id": "$member", "n": {"$sum": 1}}),
+        pymag.sort(n=-1),
+        pymag.limit(param("n"))]))
+
+
+class TestPipelineTemplate(unittest.TestCase):
+
+    def test_bind(self):
+        template = tenant_template()
+        self.assertEqual(template.params, {"tenant", "start", "end", "n"})
+        start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1)
+        p = template.bind(tenant="t1", start=start, end=end, n=5)
+        self.assertIsInstance(p, pymag.Pipeline)
+        self.assertEqual(p()[0], {"$match": {"tenant": "t1", "time": {"$gte": start, "$lt": end},
+                                             "rsvp": {"$in": ["yes", "maybe"]}}})
+        self.assertEqual(p()[-1], {"$limit": 5})
+        expected = pymag.Pipeline([pymag.match({"tenant": "t1", "time": {"$gte": start, "$lt": end},
+                                                "rsvp": {"$in": ["yes", "maybe"]}}),
+                                   pymag.group({"_id": "$member", "n": {"$sum": 1}}),
+                                   pymag.sort(n=-1),
+                                   pymag.limit(5)])
+        self.assertEqual(template.bind_frozen(tenant="t1", start=start, end=end, n=5).bson,
+                         expected.freeze().bson)
+
+    def test_shares_unchanged_parts(self):
+        template = tenant_template()
+        a = template.bind(tenant="a", start=1, end=2, n=1)
+        b = template.bind(tenant="b", start=1, end=2, n=1)
+        self.assertIs(a[1], template.stages[1])
+        self.assertIs(a[1], b[1])
+        self.assertIsNot(a[0].arg, template.stages[0].arg)
+        self.assertIs(a[0].arg["rsvp"], template.stages[0].arg["rsvp"])
+        self.assertEqual(a[0].arg["tenant"], "a")
+        self.assertEqual(repr(template.stages[0].arg["tenant"]), "param('tenant')")
+
+    def test_lists(self):
+        template = PipelineTemplate(pymag.Pipeline([pymag.match({"city": {"$in": [param("city"), "Dublin"]}})]))
+        self.assertEqual(template.bind(city="Cork")(), [{"$match": {"city": {"$in": ["Cork", "Dublin"]}}}])
+
+    def test_errors(self):
+        template = tenant_template()
+        self.assertRaises(ValueError, template.bind, tenant="t1", start=1, end=2)
+        self.assertRaises(ValueError, template.bind, tenant="t1", start=1, end=2, n=1, other=3)
+        self.assertRaises(ValueError, template.bind, tenant="t1", start=1, end=2, n=-1)
+        out = PipelineTemplate(pymag.Pipeline([pymag.out(param("target"))]))
+        self.assertRaises(ValueError, out.bind, target="system.x")
+        self.assertRaises(ValueError, param, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
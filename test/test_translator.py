@@ -0,0 +1,169 @@
+import unittest
+from unittest import mock
+
+from pymag.executor import compile_expression
+from pymag.translator import translate, to_expression
+
+
+def full_name(first, last):
+    return first.upper() + " " + last
+
+
+def price_with_tax(price, rate):
+    """
+    Docstrings are skipped.
+    """
+    tax = price * rate / 100
+    return price + tax
+
+
+def band(score):
+    if score >= 90:
+        return "A"
+    elif score >= 50:
+        return "B"
+    return "C"
+
+
+def in_range(x):
+    return 1 <= x < 10 and x not in [3, 4]
+
+
+def describe(doc):
+    return f"{doc.name} is {doc['age']}" if doc.age > 18 else "minor"
+
+
+def dollar_string(x):
+    return "$" + x
+
+
+def uses_a_loop(xs):
+    total = 0
+    for x in xs:
+        total = total + x
+    return total
+
+
+def calls_unknown(x):
+    return sorted(x)
+
+
+def remainder(x, y):
+    return x % y
+
+
+def add(x, y):
+    return x + y
+
+
+def increment(x):
+    return x + 1
+
+
+def contains(s):
+    return "ab" in s
+
+
+def in_literal(s):
+    return "ab" in s.lower()
+
+
+def size(x):
+    return len(x)
+
+
+def is_none(x):
+    return x is None
+
+
+def is_not_none(x):
+    return x is not None
+
+
+def is_true(x):
+    return x is True
+
+
+class TestTranslator(unittest.TestCase):
+
+    def check(self, func, docs, *args):
+        expression = compile_expression(translate(func, *args))
+        for doc in docs:
+            self.assertEqual(expression(doc), func(*[doc[a] for a in args]))
+
+    def test_concat(self):
+        self.assertEqual(translate(full_name, "name.first", "name.last"),
+                         {"$concat": [{"$toUpper": "$name.first"}, " ", "$name.last"]})
+        expression = compile_expression(translate(full_name))
+        self.assertEqual(expression({"first": "ada", "last": "Lovelace"}), "ADA Lovelace")
+
+    def test_arithmetic(self):
+        self.assertEqual(translate(price_with_tax),
+                         {"$add": ["$price", {"$divide": [{"$multiply": ["$price", "$rate"]}, 100]}]})
+        expression = compile_expression(translate(price_with_tax, "p", "$r"))
+        self.assertEqual(expression({"p": 200, "r": 10}), 220)
+
+    def test_if_else(self):
+        self.assertEqual(translate(band),
+                         {"$cond": [{"$gte": ["$score", 90]}, "A",
+                                    {"$cond": [{"$gte": ["$score", 50]}, "B", "C"]}]})
+        self.check(band, [{"score": s} for s in (10, 50, 95)], "score")
+
+    def test_compare(self):
+        self.check(in_range, [{"x": x} for x in range(-1, 12)], "x")
+
+    def test_field_access(self):
+        self.assertEqual(translate(describe),
+                         {"$cond": [{"$gt": ["$doc.age", 18]},
+                                    {"$concat": [{"$toString": "$doc.name"}, " is ",
+                                                 {"$toString": "$doc.age"}]},
+                                    "minor"]})
+
+    def test_literal(self):
+        self.assertEqual(translate(dollar_string), {"$concat": [{"$literal": "$"}, "$x"]})
+
+    def test_untranslatable(self):
+        self.assertRaises(ValueError, translate, uses_a_loop)
+        self.assertRaises(ValueError, translate, calls_unknown)
+        self.assertRaises(ValueError, translate, full_name, "only_one")
+        self.assertRaises(ValueError, translate, lambda x: x)
+
+    def test_mod(self):
+        self.check(remainder, [{"x": x, "y": y} for x in (-7, 7, 0, -7.5) for y in (3, -3, 2.5)], "x", "y")
+
+    def test_add(self):
+        self.assertRaises(ValueError, translate, add)
+        self.assertEqual(translate(increment), {"$add": ["$x", 1]})
+
+    def test_in(self):
+        self.assertEqual(translate(in_literal), {"$gte": [{"$indexOfCP": [{"$toLower": "$s"}, "ab"]}, 0]})
+        self.assertEqual(translate(contains)["$switch"]["branches"],
+                         [{"case": {"$isArray": "$s"}, "then": {"$in": ["ab", "$s"]}},
+                          {"case": {"$eq": [{"$type": "$s"}, "string"]},
+                           "then": {"$gte": [{"$indexOfCP": ["$s", "ab"]}, 0]}},
+                          {"case": {"$eq": [{"$type": "$s"}, "object"]},
+                           "then": {"$in": ["ab", {"$map": {"input": {"$objectToArray": "$s"},
+                                                            "in": "$$this.k"}}]}}])
+
+    def test_len(self):
+        self.assertEqual([b["then"] for b in translate(size)["$switch"]["branches"]],
+                         [{"$size": "$x"}, {"$strLenCP": "$x"}, {"$size": {"$objectToArray": "$x"}}])
+
+    def test_none(self):
+        self.assertEqual(translate(is_none), {"$lte": ["$x", None]})
+        self.assertEqual(translate(is_not_none), {"$gt": ["$x", None]})
+        self.check(is_none, [{"x": None}, {"x": 0}, {"x": "a"}], "x")
+        self.assertTrue(compile_expression(translate(is_none))({}))
+        self.assertRaises(ValueError, translate, is_true)
+
+    def test_to_expression(self):
+        self.assertEqual(to_expression(band, "grade"), translate(band, "grade"))
+        with mock.patch("pymag.translator.JSCode") as jscode:
+            jscode.return_value.return_value = {"body": "function (xs) {}", "args": ["$xs"], "lang": "js"}
+            self.assertEqual(to_expression(uses_a_loop, "xs"),
+                             {"$function": {"body": "function (xs) {}", "args": ["$xs"], "lang": "js"}})
+            jscode.assert_called_once_with(uses_a_loop, "xs")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from pymag.pipeline import Pipeline
+from pymag.stages import group, project, out, sort
+from pymag.views import MaterializedView
+from test.localcollection import LocalCollection
+
+
+def event(i, member):
+    return {"_id": i, "member": member, "time": 100 + i, "score": i}
+
+
+class TestMaterializedView(unittest.TestCase):
+
+    def setUp(self):
+        self.source = LocalCollection("events", [event(i, f"m{i % 3}") for i in range(6)])
+        self.target = LocalCollection("by_member")
+        self.state = LocalCollection("views")
+        self.source.targets["by_member"] = self.target
+        self.view = MaterializedView(self.source,
+                                     Pipeline([group({"_id": "$member", "n": {"$sum": 1},
+                                                      "total": {"$sum": "$score"}})]),
+                                     self.target, self.state, field="time")
+
+    def counts(self):
+        return {k: (d["n"], d["total"]) for k, d in self.target.docs.items()}
+
+    def test_incremental(self):
+        self.assertIsNone(self.view.mark)
+        self.assertTrue(self.view.refresh())
+        self.assertEqual(self.view.mark, 105)
+        self.assertEqual(self.counts(), {"m0": (2, 3), "m1": (2, 5), "m2": (2, 7)})
+
+        self.assertFalse(self.view.refresh())
+        for i in (6, 7):
+            self.source.docs[i] = event(i, "m0" if i == 6 else "m9")
+        self.assertTrue(self.view.refresh())
+        self.assertEqual(self.source.pipelines[-1][0][0], {"$match": {"time": {"$gt": 105, "$lte": 107}}})
+        self.assertEqual(self.counts(), {"m0": (3, 9), "m1": (2, 5), "m2": (2, 7), "m9": (1, 7)})
+        self.assertEqual(self.state.docs[self.view.name]["refreshes"], 2)
+
+    def test_rebuild(self):
+        self.view.refresh()
+        self.target.docs["m0"]["n"] = 100
+        self.assertTrue(self.view.rebuild())
+        self.assertEqual(self.counts()["m0"], (2, 3))
+
+    def test_replace(self):
+        view = MaterializedView(self.source, Pipeline([project({"member": 1})]),
+                                self.target, self.state, field="time")
+        self.assertEqual(view.pipeline(None, 5)()[-1]["$merge"]["whenMatched"], "replace")
+        view.refresh()
+        self.assertEqual(len(self.target.docs), 6)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, MaterializedView, self.source, Pipeline([out("x")]),
+                          self.target, self.state)
+        self.assertRaises(ValueError, MaterializedView, self.source,
+                          Pipeline([group({"_id": "$member", "n": {"$sum": 1}}), sort(n=-1)]),
+                          self.target, self.state)
+        self.assertRaises(ValueError, MaterializedView, self.source,
+                          Pipeline([group({"_id": "$member", "n": {"$avg": 1}})]),
+                          self.target, self.state)
+
+
+if __name__ == '__main__':
+    unittest.main()